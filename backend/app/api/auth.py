@@ -6,33 +6,11 @@ from datetime import datetime, timedelta
 import jwt
 import os
 import hashlib
-import json
 
-router = APIRouter()
-
-# 数据存储 - 使用绝对路径
-# __file__ = D:/PycharmProjects/SoulEcho/backend/app/api/auth.py
-# 需要向上找3级到项目根目录
-APP_DIR = os.path.dirname(os.path.abspath(__file__))  # D:/PycharmProjects/SoulEcho/backend/app/api
-BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # D:/PycharmProjects/SoulEcho/backend
-DATA_DIR = os.path.join(BACKEND_DIR, "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-
-
-def load_users():
-    """加载用户数据"""
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-
-def save_users(users):
-    """保存用户数据"""
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+from app.db.database import get_user_store
+from app.db.repository import DuplicateUserError, ANONYMOUS_OWNER
 
+router = APIRouter()
 
 # JWT配置
 SECRET_KEY = os.getenv("JWT_SECRET", "soul-echo-secret-key-change-in-production")
@@ -58,6 +36,32 @@ def get_password_hash(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 
+def decode_user_id(token: str) -> str:
+    """从 JWT 中取出用户ID（sub），令牌无效时返回 401"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+        if not user_id:
+            raise HTTPException(status_code=401, detail="无效令牌")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="无效令牌")
+    return user_id
+
+
+def get_owner_id(request: Request) -> str:
+    """
+    当前请求所属的分区（路由依赖）
+
+    携带令牌时为 JWT 中的用户ID，未登录时为匿名分区；令牌无效时返回 401，
+    不会退回匿名分区。
+    """
+    authorization = request.headers.get("Authorization") or ""
+    token = authorization[len("Bearer "):].strip() if authorization.startswith("Bearer ") else ""
+    if not token:
+        return ANONYMOUS_OWNER
+    return decode_user_id(token)
+
+
 # Pydantic 模型
 class UserRegister(BaseModel):
     username: str
@@ -87,14 +91,13 @@ class TokenResponse(BaseModel):
 @router.post("/auth/register", response_model=TokenResponse)
 async def register(user: UserRegister):
     """用户注册"""
-    users = load_users()
+    users = get_user_store()
 
     # 检查用户名是否存在
-    for u in users.values():
-        if u["username"] == user.username:
-            raise HTTPException(status_code=400, detail="用户名已存在")
-        if u["email"] == user.email:
-            raise HTTPException(status_code=400, detail="邮箱已被注册")
+    if users.get_by_username(user.username):
+        raise HTTPException(status_code=400, detail="用户名已存在")
+    if users.get_by_email(user.email):
+        raise HTTPException(status_code=400, detail="邮箱已被注册")
 
     # 创建新用户
     user_id = str(uuid4())
@@ -109,8 +112,12 @@ async def register(user: UserRegister):
         "created_at": now
     }
 
-    users[user_id] = new_user
-    save_users(users)
+    try:
+        users.create(new_user)
+    except DuplicateUserError as e:
+        # 并发注册时由存储层的唯一索引兜底
+        detail = "邮箱已被注册" if e.field == "email" else "用户名已存在"
+        raise HTTPException(status_code=400, detail=detail)
 
     # 创建token
     access_token = create_access_token(data={"sub": user_id})
@@ -124,14 +131,8 @@ async def register(user: UserRegister):
 @router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     """用户登录"""
-    users = load_users()
-
     # 查找用户
-    user = None
-    for u in users.values():
-        if u["username"] == credentials.username:
-            user = u
-            break
+    user = get_user_store().get_by_username(credentials.username)
 
     if not user:
         raise HTTPException(status_code=400, detail="用户名不存在")
@@ -156,17 +157,9 @@ async def get_current_user(request: Request):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="未登录")
 
-    token = authorization.replace("Bearer ", "")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="无效令牌")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="无效令牌")
-
-    users = load_users()
-    if user_id not in users:
+    user_id = decode_user_id(authorization.replace("Bearer ", ""))
+    user = get_user_store().get(user_id)
+    if user is None:
         raise HTTPException(status_code=401, detail="用户不存在")
 
-    return UserResponse(**users[user_id])
+    return UserResponse(**user)
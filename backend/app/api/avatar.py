@@ -1,15 +1,18 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
 from pydantic import BaseModel
 from typing import Optional
+import io
 import os
-import uuid
-from pathlib import Path
 from PIL import Image
-import shutil
+
+from app.db.database import get_character_store
+from app.db.locks import character_lock
+from app.db.media import get_media_store, hash_of_url
+from app.api.characters import verify_character_owner
 
 router = APIRouter()
 
-# 头像存储目录
+# 旧版头像存储目录（新上传的头像按内容哈希存放在 static/media）
 AVATAR_DIR = "static/avatars"
 os.makedirs(AVATAR_DIR, exist_ok=True)
 
@@ -44,36 +47,26 @@ async def upload_avatar_before_create(
             detail="图片大小不能超过 2MB"
         )
 
-    # 生成临时文件名
-    temp_id = uuid.uuid4().hex[:12]
     ext = file.content_type.split('/')[-1]
     if ext == 'jpeg':
         ext = 'jpg'
 
-    filename = f"temp_{temp_id}.{ext}"
-    filepath = os.path.join(AVATAR_DIR, filename)
-
-    # 保存文件
-    with open(filepath, 'wb') as f:
-        f.write(content)
-
-    # 调整头像大小
-    resize_avatar(filepath)
-
-    # 返回临时URL（用于创建角色时关联）
-    temp_url = f"/avatars/{filename}"
+    # 调整尺寸后按内容哈希保存，相同的头像只存一份；创建角色时再记录引用
+    temp_url = get_media_store().put(resize_avatar(content), ext)
 
     return {
         "url": temp_url,
-        "temp_id": temp_id,
+        "temp_id": os.path.basename(temp_url).split('.')[0],
         "message": "头像上传成功"
     }
 
 
-def resize_avatar(image_path: str, size: tuple = (200, 200)):
-    """调整头像尺寸"""
+def resize_avatar(content: bytes, size: tuple = (200, 200)) -> bytes:
+    """调整头像尺寸，返回调整后的图片数据，失败时返回原始数据"""
     try:
-        with Image.open(image_path) as img:
+        with Image.open(io.BytesIO(content)) as img:
+            image_format = img.format
+
             # 裁剪为正方形
             min_size = min(img.size)
             left = (img.size[0] - min_size) // 2
@@ -85,13 +78,15 @@ def resize_avatar(image_path: str, size: tuple = (200, 200)):
             # 调整大小
             img = img.resize(size, Image.Resampling.LANCZOS)
 
-            # 保存
-            img.save(image_path, quality=85)
+            output = io.BytesIO()
+            img.save(output, format=image_format, quality=85)
+            return output.getvalue()
     except Exception as e:
         print(f"头像调整失败: {e}")
+        return content
 
 
-@router.post("/characters/{character_id}/avatar")
+@router.post("/characters/{character_id}/avatar", dependencies=[Depends(verify_character_owner)])
 async def upload_avatar(
     character_id: str,
     file: UploadFile = File(...)
@@ -112,36 +107,29 @@ async def upload_avatar(
             detail="图片大小不能超过 5MB"
         )
 
-    # 生成唯一文件名
     ext = file.content_type.split('/')[-1]
     if ext == 'jpeg':
         ext = 'jpg'
 
-    filename = f"{character_id}_{uuid.uuid4().hex[:8]}.{ext}"
-    filepath = os.path.join(AVATAR_DIR, filename)
-
-    # 保存文件
-    with open(filepath, 'wb') as f:
-        f.write(content)
-
-    # 调整头像大小
-    resize_avatar(filepath)
-
-    # 返回 URL（相对路径）
-    avatar_url = f"/avatars/{filename}"
+    # 调整尺寸后按内容哈希保存（已有相同内容时不再写入）
+    media = get_media_store()
+    avatar_url = media.put(resize_avatar(content), ext)
 
     # 更新角色数据
-    from app.api.characters import load_characters, save_characters
-    characters = load_characters()
+    store = get_character_store()
+    async with character_lock(character_id):
+        character = store.get(character_id)
 
-    if character_id not in characters:
-        # 删除刚上传的文件
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        raise HTTPException(status_code=404, detail="角色不存在")
+        if character is None:
+            # 没有记录引用，文件由垃圾回收清理
+            raise HTTPException(status_code=404, detail="角色不存在")
 
-    characters[character_id]['avatar'] = avatar_url
-    save_characters(characters)
+        old_avatar = character.get('avatar')
+        character['avatar'] = avatar_url
+        store.save(character)
+        media.add_ref(avatar_url, character_id, "avatar")
+        if old_avatar != avatar_url:
+            media.remove_ref(old_avatar, character_id, "avatar")
 
     return AvatarResponse(
         url=avatar_url,
@@ -149,41 +137,41 @@ async def upload_avatar(
     )
 
 
-@router.delete("/characters/{character_id}/avatar")
+@router.delete("/characters/{character_id}/avatar", dependencies=[Depends(verify_character_owner)])
 async def delete_avatar(character_id: str):
     """删除角色头像"""
-    from app.api.characters import load_characters, save_characters
-    characters = load_characters()
+    store = get_character_store()
+    async with character_lock(character_id):
+        character = store.get(character_id)
 
-    if character_id not in characters:
-        raise HTTPException(status_code=404, detail="角色不存在")
+        if character is None:
+            raise HTTPException(status_code=404, detail="角色不存在")
 
-    character = characters[character_id]
-    old_avatar = character.get('avatar')
+        old_avatar = character.get('avatar')
 
-    # 删除旧头像文件
-    if old_avatar:
-        old_path = os.path.join("static", old_avatar.lstrip('/'))
-        if os.path.exists(old_path):
-            os.remove(old_path)
+        # 旧版头像文件直接删除，内容寻址的文件只删除引用，由垃圾回收清理
+        if old_avatar and hash_of_url(old_avatar) is None:
+            old_path = os.path.join("static", old_avatar.lstrip('/'))
+            if os.path.exists(old_path):
+                os.remove(old_path)
 
-    # 更新角色数据
-    character['avatar'] = None
-    save_characters(characters)
+        # 更新角色数据
+        character['avatar'] = None
+        store.save(character)
+        get_media_store().remove_ref(old_avatar, character_id, "avatar")
 
     return {"message": "头像已删除"}
 
 
-@router.get("/characters/{character_id}/avatar")
+@router.get("/characters/{character_id}/avatar", dependencies=[Depends(verify_character_owner)])
 async def get_avatar(character_id: str):
     """获取角色头像 URL"""
-    from app.api.characters import load_characters
-    characters = load_characters()
+    character = get_character_store().get(character_id)
 
-    if character_id not in characters:
+    if character is None:
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    avatar = characters[character_id].get('avatar')
+    avatar = character.get('avatar')
     if avatar:
         return {"url": avatar}
     else:
@@ -1,31 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from uuid import uuid4
 from datetime import datetime
-import json
-import os
 
-router = APIRouter()
-
-# 数据存储
-DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
-CHARACTERS_FILE = os.path.join(DATA_DIR, "characters.json")
-
-
-def load_characters():
-    """加载角色数据"""
-    if os.path.exists(CHARACTERS_FILE):
-        with open(CHARACTERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+from app.db.database import get_character_store
+from app.db.locks import character_lock
+from app.db.repository import DELETED_OWNER
+from app.db.media import get_media_store
+from app.api.auth import get_owner_id
+from app.services.cleanup import get_character_cleanup
 
-
-def save_characters(characters):
-    """保存角色数据"""
-    with open(CHARACTERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(characters, f, ensure_ascii=False, indent=2)
+router = APIRouter()
 
 
 # Pydantic 模型
@@ -61,34 +47,45 @@ class CharacterResponse(BaseModel):
     background: str
     relationship_type: str
     created_at: str
+    last_active_at: Optional[str] = None
+
+
+def check_character_owner(character_id: str, owner_id: str):
+    """角色不存在或属于其他用户时都返回 404，不暴露其他用户的角色"""
+    if get_character_store().get_owner(character_id) != owner_id:
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+
+async def verify_character_owner(character_id: str, owner_id: str = Depends(get_owner_id)):
+    """路由依赖：路径中的角色必须属于当前用户"""
+    check_character_owner(character_id, owner_id)
 
 
 @router.get("/characters")
-async def get_characters() -> List[CharacterResponse]:
-    """获取所有角色"""
-    characters = load_characters()
-    return [CharacterResponse(**char_data) for char_data in characters.values()]
+async def get_characters(owner_id: str = Depends(get_owner_id)) -> List[CharacterResponse]:
+    """获取当前用户的角色（只读元数据索引中该用户的分区，不加载聊天记录）"""
+    store = get_character_store()
+    return [CharacterResponse(**summary) for summary in store.list_summaries(owner_id)]
 
 
-@router.get("/characters/{character_id}")
+@router.get("/characters/{character_id}", dependencies=[Depends(verify_character_owner)])
 async def get_character(character_id: str) -> CharacterResponse:
     """获取单个角色详情"""
-    characters = load_characters()
-    if character_id not in characters:
+    character = get_character_store().get(character_id)
+    if character is None:
         raise HTTPException(status_code=404, detail="角色不存在")
-    return CharacterResponse(**characters[character_id])
+    return CharacterResponse(**character)
 
 
 @router.post("/characters")
-async def create_character(character: CharacterCreate) -> CharacterResponse:
-    """创建新角色"""
-    characters = load_characters()
-
+async def create_character(character: CharacterCreate, owner_id: str = Depends(get_owner_id)) -> CharacterResponse:
+    """创建新角色（归属当前用户）"""
     character_id = str(uuid4())
     now = datetime.now().isoformat()
 
     char_data = {
         "id": character_id,
+        "owner_id": owner_id,
         "name": character.name,
         "gender": character.gender,
         "age": character.age,
@@ -99,25 +96,45 @@ async def create_character(character: CharacterCreate) -> CharacterResponse:
         "background": character.background,
         "relationship_type": character.relationship_type,
         "created_at": now,
-        "chat_history": [],
         "memories": []
     }
 
-    characters[character_id] = char_data
-    save_characters(characters)
+    get_character_store().save(char_data)
+    # 创建前上传的头像在这里记录引用
+    get_media_store().add_ref(character.avatar, character_id, "avatar")
 
     return CharacterResponse(**char_data)
 
 
-@router.delete("/characters/{character_id}")
-async def delete_character(character_id: str):
-    """删除角色"""
-    characters = load_characters()
-
-    if character_id not in characters:
-        raise HTTPException(status_code=404, detail="角色不存在")
-
-    del characters[character_id]
-    save_characters(characters)
-
-    return {"message": "删除成功"}
+@router.delete("/characters/{character_id}", dependencies=[Depends(verify_character_owner)])
+async def delete_character(character_id: str, owner_id: str = Depends(get_owner_id)):
+    """
+    删除角色
+
+    角色立即从当前用户的列表和接口中移除；聊天记录、记忆、索引和媒体文件
+    由后台任务清理，进度可以通过 GET /characters/{character_id}/deletion 查询。
+    """
+    store = get_character_store()
+    async with character_lock(character_id):
+        character = store.get(character_id)
+        if character is None:
+            raise HTTPException(status_code=404, detail="角色不存在")
+
+        store.save({
+            **character,
+            "owner_id": DELETED_OWNER,
+            "deleted_owner_id": owner_id,
+            "deleted_at": datetime.now().isoformat()
+        })
+
+    job = get_character_cleanup().enqueue(character_id, owner_id)
+    return {"message": "删除成功", "cleanup": job}
+
+
+@router.get("/characters/{character_id}/deletion")
+async def get_deletion_status(character_id: str, owner_id: str = Depends(get_owner_id)):
+    """查询已删除角色的后台清理进度"""
+    job = get_character_cleanup().status(character_id)
+    if job is None or job["owner_id"] != owner_id:
+        raise HTTPException(status_code=404, detail="删除任务不存在")
+    return job
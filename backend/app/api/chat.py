@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional, AsyncGenerator
+from typing import List, Dict, Optional, Set, AsyncGenerator
 from datetime import datetime
-from openai import OpenAI
 import os
 import json
 import asyncio
 import base64
+import zlib
+from urllib.parse import quote
+
+from app.db.database import get_character_store
+from app.db.locks import character_lock
+from app.db.repository import owner_of
+from app.db.branches import MAIN_BRANCH, BranchHistory, get_branch_store, get_history
+from app.db.media import get_media_store
+from app.db.summaries import get_summary_store
+from app.api.auth import get_owner_id
+from app.api.characters import verify_character_owner
+from app.services.llm import get_llm_client
+from app.services.context import build_context
+from app.services.search import get_search_index
+from app.services.semantic_search import get_semantic_index
+from app.services.summary import schedule_summary
 
 router = APIRouter()
 
@@ -20,23 +36,10 @@ DEFAULT_MODEL = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
 VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o")  # 视觉模型
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1000"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.8"))
-MEMORY_LENGTH = 20
-
-DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
-CHARACTERS_FILE = os.path.join(DATA_DIR, "characters.json")
-
-
-def load_characters():
-    if os.path.exists(CHARACTERS_FILE):
-        with open(CHARACTERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-
-def save_characters(characters):
-    with open(CHARACTERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(characters, f, ensure_ascii=False, indent=2)
+# 流式回复被客户端中断时，是否保存用户消息和已生成的部分回复
+STREAM_SAVE_PARTIAL = os.getenv("STREAM_SAVE_PARTIAL", "false").lower() in ("1", "true", "yes")
+# 流式回复时检查客户端是否断开的间隔（秒）
+STREAM_DISCONNECT_CHECK_INTERVAL = float(os.getenv("STREAM_DISCONNECT_CHECK_INTERVAL", "0.5"))
 
 
 class ChatMessage(BaseModel):
@@ -57,80 +60,69 @@ class ChatResponse(BaseModel):
     timestamp: str
 
 
-def build_system_prompt(character: dict, memories: list = None) -> str:
-    """构建系统提示词"""
-    name = character.get("name", "AI伴侣")
-    gender = character.get("gender", "女性")
-    age = character.get("age", 25)
-    appearance = character.get("appearance", "")
-    personality = character.get("personality", {})
-    hobbies = character.get("hobbies", [])
-    background = character.get("background", "")
-    relationship_type = character.get("relationship_type", "朋友")
-
-    prompt = f"""你是{name}，一个{gender}性角色。
-
-基本信息：
-- 年龄：{age}岁
-- 外貌：{appearance if appearance else "普通"}
-
-性格特点：
-"""
-
-    for trait, desc in personality.items():
-        if desc:
-            prompt += f"- {trait}: {desc}\n"
-
-    prompt += f"\n爱好：{', '.join(hobbies) if hobbies else '暂无'}\n"
-    prompt += f"\n背景：{background if background else '未知'}\n"
+def _index_messages(history: BranchHistory, messages: List[Dict]):
+    """
+    安排更新新消息所在分支的滚动摘要；主线上的新消息还要写入全文索引并放入语义索引队列，
+    失败时不影响对话（检索前会补齐）
+    """
+    schedule_summary(history.character_id, history.branch_id)
+    if history.branch_id != MAIN_BRANCH:
+        return
+    character_id = history.character_id
+    index = get_search_index()
+    try:
+        index.add_messages(character_id, messages)
+    except Exception as e:
+        index.mark_stale(character_id)
+        print(f"更新搜索索引失败: {e}")
+    semantic = get_semantic_index()
+    if semantic is not None:
+        semantic.enqueue(character_id, messages)
 
-    # 添加记忆
-    if memories:
-        prompt += "\n【重要记忆】\n"
-        for mem in memories:
-            content = mem.get("content", "")
-            mtype = mem.get("metadata", {}).get("type", "")
-            prompt += f"- [{mtype}] {content[:200]}\n"
-        prompt += "\n请根据以上记忆来回复，展现你对用户的了解和关心。\n"
 
-    prompt += f"""
-你们的关系是：{relationship_type}
+def _search_memories(character_id: str, query) -> List[Dict]:
+    """检索和本轮对话相关的记忆，失败时不带记忆继续对话"""
+    try:
+        from app.services.memory import get_memory_service
+        memory_service = get_memory_service()
+        return memory_service.search_memories(
+            character_id=character_id,
+            query=query,
+            n_results=5,
+            min_importance=5
+        )
+    except Exception:
+        return []
 
-请用符合你性格特点的方式回复，保持自然、真实、有情感。
-回复要简洁温馨，不要太长。
-"""
 
-    return prompt
+def _branch_history(store, character_id: str, branch_id: Optional[str] = None) -> BranchHistory:
+    """读取分支（默认当前分支）看到的聊天记录"""
+    try:
+        return get_history(store, character_id, branch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="分支不存在")
 
 
 @router.post("/chat")
-async def chat(request: ChatRequest) -> ChatResponse:
+async def chat(request: ChatRequest, owner_id: str = Depends(get_owner_id)) -> ChatResponse:
     """发送消息，获取AI回复"""
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API Key 未配置")
 
-    characters = load_characters()
+    store = get_character_store()
+    character = store.get(request.character_id)
 
-    if request.character_id not in characters:
+    if character is None or owner_of(character) != owner_id:
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    character = characters[request.character_id]
-
-    # 构建消息列表
-    messages = [{"role": "system", "content": build_system_prompt(character)}]
-
-    # 添加历史对话
-    chat_history = character.get("chat_history", [])[-MEMORY_LENGTH:]
-    for chat in chat_history:
-        messages.append({"role": chat["role"], "content": chat["content"]})
-
-    # 添加用户消息
-    messages.append({"role": "user", "content": request.message})
+    # 构建消息列表：人设 + 历史对话（当前分支，按 token 预算取最近的）+ 用户消息
+    history = get_history(store, request.character_id)
+    messages = build_context(character, history, request.message)
 
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_llm_client()
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=DEFAULT_MODEL,
             messages=messages,
             max_tokens=MAX_TOKENS,
@@ -141,22 +133,20 @@ async def chat(request: ChatRequest) -> ChatResponse:
 
         # 更新对话历史
         timestamp = datetime.now().isoformat()
-        character["chat_history"].append({
-            "role": "user",
-            "content": request.message,
-            "timestamp": timestamp
-        })
-        character["chat_history"].append({
-            "role": "assistant",
-            "content": bot_response,
-            "timestamp": timestamp
-        })
-
-        # 只保留最近100条对话
-        if len(character["chat_history"]) > 100:
-            character["chat_history"] = character["chat_history"][-100:]
-
-        save_characters(characters)
+        async with character_lock(request.character_id):
+            saved = history.append_messages([
+                {
+                    "role": "user",
+                    "content": request.message,
+                    "timestamp": timestamp
+                },
+                {
+                    "role": "assistant",
+                    "content": bot_response,
+                    "timestamp": timestamp
+                }
+            ])
+        _index_messages(history, saved)
 
         return ChatResponse(
             character_id=request.character_id,
@@ -168,78 +158,96 @@ async def chat(request: ChatRequest) -> ChatResponse:
         raise HTTPException(status_code=500, detail=f"AI 服务错误: {str(e)}")
 
 
-@router.get("/chat/history/{character_id}")
+@router.get("/chat/history/{character_id}", dependencies=[Depends(verify_character_owner)])
 async def get_chat_history(
     character_id: str,
-    offset: int = 0,
-    limit: int = 50
+    before_seq: Optional[int] = None,
+    after_seq: Optional[int] = None,
+    since: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    branch: Optional[str] = Query(None, description="分支ID，不传则为当前分支")
 ) -> Dict:
-    """获取聊天历史（分页）"""
-    characters = load_characters()
-
-    if character_id not in characters:
+    """
+    获取聊天历史（按序号游标分页，最新的在前）
+
+    - 不带游标：最新的 limit 条
+    - before_seq：序号小于 before_seq 的 limit 条，用于向上翻页
+    - after_seq：序号大于 after_seq 的最早 limit 条，用于向下翻页
+    - since：增量同步，返回序号大于 since 的消息；
+      超过 limit 条时 truncated 为 true，客户端应重新加载
+    """
+    store = get_character_store()
+
+    if not store.exists(character_id):
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    chat_history = characters[character_id].get("chat_history", [])
-
-    # 返回分页数据
-    total = len(chat_history)
-    messages = chat_history[offset:offset + limit]
+    history = _branch_history(store, character_id, branch)
+
+    # 多读一条用来判断是否还有更多
+    has_more = False
+    truncated = False
+    if since is not None:
+        messages = history.get_messages_before(None, limit + 1)
+        newer = [m for m in messages if m["seq"] > since]
+        truncated = len(newer) > limit
+        messages = newer[-limit:]
+    elif after_seq is not None:
+        messages = history.get_messages_after(after_seq, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        messages = history.get_messages_before(before_seq, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[-limit:]
 
     return {
-        "messages": messages,
-        "total": total,
-        "has_more": offset + limit < total,
-        "next_offset": offset + limit if offset + limit < total else None
+        "messages": messages[::-1],
+        "branch_id": history.branch_id,
+        "total": history.count_messages(),
+        "last_seq": history.last_seq(),
+        "has_more": has_more,
+        "truncated": truncated,
+        "next_before_seq": messages[0]["seq"] if has_more and after_seq is None else None,
+        "next_after_seq": messages[-1]["seq"] if has_more and after_seq is not None else None,
     }
 
 
 @router.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
-    """流式发送消息，AI逐字回复"""
+async def chat_stream(request: ChatRequest, http_request: Request, owner_id: str = Depends(get_owner_id)):
+    """
+    流式发送消息，AI逐字回复
+
+    客户端断开后立即取消上游请求，不再为没人读的 token 付费；被取消的一轮不做记忆分析，
+    STREAM_SAVE_PARTIAL 开启时保存用户消息和已生成的部分回复，否则不保存。
+    """
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API Key 未配置")
 
-    characters = load_characters()
+    store = get_character_store()
+    character = store.get(request.character_id)
 
-    if request.character_id not in characters:
+    if character is None or owner_of(character) != owner_id:
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    character = characters[request.character_id]
-
     # 检索相关记忆
-    try:
-        from app.services.memory import get_memory_service
-        memory_service = get_memory_service()
-        memories = memory_service.search_memories(
-            character_id=request.character_id,
-            query=request.message,
-            n_results=5,
-            min_importance=5
-        )
-    except Exception:
-        memories = []
-
-    # 构建消息列表
-    messages = [{"role": "system", "content": build_system_prompt(character, memories)}]
-
-    # 添加历史对话
-    chat_history = character.get("chat_history", [])[-MEMORY_LENGTH:]
-    for chat in chat_history:
-        messages.append({"role": chat["role"], "content": chat["content"]})
+    memories = _search_memories(request.character_id, request.message)
 
-    # 添加用户消息
-    messages.append({"role": "user", "content": request.message})
+    # 构建消息列表：人设 + 历史对话（当前分支）+ 本轮记忆 + 用户消息，按 token 预算裁剪
+    history = get_history(store, request.character_id)
+    messages = build_context(character, history, request.message, memories)
 
     async def generate():
         """生成流式响应"""
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_llm_client()
         full_response = ""
         timestamp = datetime.now().isoformat()
+        stream = None
+        completed = False
+        error = None
 
         try:
             # 创建流式请求
-            stream = client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=DEFAULT_MODEL,
                 messages=messages,
                 max_tokens=MAX_TOKENS,
@@ -250,62 +258,115 @@ async def chat_stream(request: ChatRequest):
             # 发送开始信号
             yield f"data: START\n\n"
 
-            # 逐字发送
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
+            # 逐字发送；token 之间每隔一段时间检查客户端是否已断开，不必等到下一次发送失败
+            loop = asyncio.get_running_loop()
+            next_check = loop.time() + STREAM_DISCONNECT_CHECK_INTERVAL
+            async for chunk in stream:
+                if loop.time() >= next_check:
+                    if await http_request.is_disconnected():
+                        break
+                    next_check = loop.time() + STREAM_DISCONNECT_CHECK_INTERVAL
+                if chunk.choices and chunk.choices[0].delta.content:
                     content = chunk.choices[0].delta.content
                     full_response += content
                     yield f"data: {json.dumps({'content': content})}\n\n"
+            else:
+                completed = True
+        except Exception as e:
+            error = e
+        finally:
+            if not completed:
+                # 断开、出错或被取消：当前任务可能已处于取消状态，收尾放到后台任务中执行
+                partial = full_response if error is None else ""
+                _spawn(_abort_stream(stream, history, request.message, partial, timestamp))
+
+        if error is not None:
+            yield f"data: ERROR\n{json.dumps({'error': str(error)})}\n\n"
+            return
+        if not completed:
+            return
 
+        try:
             # 更新对话历史
-            character["chat_history"].append({
-                "role": "user",
-                "content": request.message,
-                "timestamp": timestamp
-            })
-            character["chat_history"].append({
-                "role": "assistant",
-                "content": full_response,
-                "timestamp": timestamp
-            })
-
-            # 只保留最近100条对话
-            if len(character["chat_history"]) > 100:
-                character["chat_history"] = character["chat_history"][-100:]
-
-            save_characters(characters)
-
-            # 异步存储重要记忆
-            try:
-                from app.services.memory import get_memory_service, analyze_and_store_memory
-                memory_service = get_memory_service()
-                analyze_and_store_memory(
-                    character_id=request.character_id,
-                    user_message=request.message,
-                    ai_response=full_response,
-                    personality=character.get("personality", {})
-                )
-            except Exception:
-                pass
-
-            # 发送结束信号
-            yield f"data: END\n\n"
-
+            async with character_lock(request.character_id):
+                saved = history.append_messages([
+                    {
+                        "role": "user",
+                        "content": request.message,
+                        "timestamp": timestamp
+                    },
+                    {
+                        "role": "assistant",
+                        "content": full_response,
+                        "timestamp": timestamp
+                    }
+                ])
+            _index_messages(history, saved)
         except Exception as e:
             yield f"data: ERROR\n{json.dumps({'error': str(e)})}\n\n"
+            return
+
+        # 后台分析并存储重要记忆，不拖慢结束信号
+        _spawn(_store_memories(request.character_id, request.message, full_response, character))
+
+        # 发送结束信号
+        yield f"data: END\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+# 请求之外运行的后台任务（保留引用，避免任务在完成前被回收）
+_background_tasks: Set[asyncio.Task] = set()
 
-    return asyncio.create_task(_stream_response(generate()))
 
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-async def _stream_response(generator: AsyncGenerator[str, None]):
-    """辅助函数，用于返回流式响应"""
-    from fastapi.responses import StreamingResponse
 
-    async def inner():
-        async for line in generator:
-            yield line
+async def _abort_stream(stream, history: BranchHistory, user_message: str, partial: str, timestamp: str):
+    """关闭上游连接（服务端随之停止生成）；STREAM_SAVE_PARTIAL 开启时保存已生成的部分回复"""
+    if stream is not None:
+        try:
+            await stream.close()
+        except Exception as e:
+            print(f"关闭上游流失败: {e}")
+
+    if not STREAM_SAVE_PARTIAL or not partial:
+        return
+    try:
+        async with character_lock(history.character_id):
+            saved = history.append_messages([
+                {
+                    "role": "user",
+                    "content": user_message,
+                    "timestamp": timestamp
+                },
+                {
+                    "role": "assistant",
+                    "content": partial,
+                    "timestamp": timestamp
+                }
+            ])
+        _index_messages(history, saved)
+    except Exception as e:
+        print(f"保存部分回复失败: {e}")
+
 
-    return StreamingResponse(inner(), media_type="text/event-stream")
+async def _store_memories(character_id: str, user_message: str, ai_response: str, character: dict):
+    """分析对话并存储重要记忆，失败时不影响对话"""
+    try:
+        from app.services.memory import analyze_and_store_memory
+        await analyze_and_store_memory(
+            character_id=character_id,
+            user_message=user_message,
+            ai_response=ai_response,
+            personality=character.get("personality", {})
+        )
+    except Exception:
+        pass
 
 
 class MultimodalMessage(BaseModel):
@@ -346,9 +407,9 @@ async def describe_image(image_url: str, character: dict) -> str:
         if not base64_image:
             return "图片编码失败"
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_llm_client()
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=VISION_MODEL,
             messages=[
                 {
@@ -374,18 +435,17 @@ async def describe_image(image_url: str, character: dict) -> str:
 
 
 @router.post("/chat/multimodal")
-async def multimodal_chat(request: MultimodalChatRequest):
+async def multimodal_chat(request: MultimodalChatRequest, owner_id: str = Depends(get_owner_id)):
     """发送多模态消息（文字+图片），AI 可以理解图片内容"""
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API Key 未配置")
 
-    characters = load_characters()
+    store = get_character_store()
+    character = store.get(request.character_id)
 
-    if request.character_id not in characters:
+    if character is None or owner_of(character) != owner_id:
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    character = characters[request.character_id]
-
     # 如果有图片，先描述图片
     image_description = ""
     if request.images:
@@ -399,32 +459,16 @@ async def multimodal_chat(request: MultimodalChatRequest):
         user_content = f"{image_description}\n用户消息: {request.message}"
 
     # 检索相关记忆
-    try:
-        from app.services.memory import get_memory_service
-        memory_service = get_memory_service()
-        memories = memory_service.search_memories(
-            character_id=request.character_id,
-            query=user_content,
-            n_results=5,
-            min_importance=5
-        )
-    except Exception:
-        memories = []
-
-    # 构建消息列表
-    messages = [{"role": "system", "content": build_system_prompt(character, memories)}]
+    memories = _search_memories(request.character_id, user_content)
 
-    # 添加历史对话
-    chat_history = character.get("chat_history", [])[-MEMORY_LENGTH:]
-    for chat in chat_history:
-        messages.append({"role": chat["role"], "content": chat["content"]})
+    # 历史对话（当前分支）
+    history = get_history(store, request.character_id)
 
-    # 添加用户消息（如果有视觉模型支持）
+    # 用户消息（如果有视觉模型支持，直接附上图片）
+    prompt_content = user_content
     if request.images and VISION_MODEL in ["gpt-4o", "gpt-4-turbo", "gpt-4-vision-preview"]:
         # 使用视觉模型
         try:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
             # 准备图片内容
             image_contents = []
             for img_url in request.images:
@@ -438,26 +482,22 @@ async def multimodal_chat(request: MultimodalChatRequest):
                     })
 
             if image_contents:
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": request.message},
-                        *image_contents
-                    ]
-                })
-            else:
-                messages.append({"role": "user", "content": user_content})
+                prompt_content = [
+                    {"type": "text", "text": request.message},
+                    *image_contents
+                ]
         except Exception:
-            messages.append({"role": "user", "content": user_content})
-    else:
-        messages.append({"role": "user", "content": user_content})
+            prompt_content = user_content
+
+    # 构建消息列表：人设 + 历史对话 + 本轮记忆 + 用户消息，按 token 预算裁剪
+    messages = build_context(character, history, prompt_content, memories)
 
     timestamp = datetime.now().isoformat()
 
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_llm_client()
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=DEFAULT_MODEL if not request.images else VISION_MODEL,
             messages=messages,
             max_tokens=MAX_TOKENS,
@@ -467,22 +507,26 @@ async def multimodal_chat(request: MultimodalChatRequest):
         bot_response = response.choices[0].message.content
 
         # 更新对话历史
-        character["chat_history"].append({
-            "role": "user",
-            "content": user_content,
-            "images": request.images,
-            "timestamp": timestamp
-        })
-        character["chat_history"].append({
-            "role": "assistant",
-            "content": bot_response,
-            "timestamp": timestamp
-        })
-
-        if len(character["chat_history"]) > 100:
-            character["chat_history"] = character["chat_history"][-100:]
-
-        save_characters(characters)
+        async with character_lock(request.character_id):
+            saved = history.append_messages([
+                {
+                    "role": "user",
+                    "content": user_content,
+                    "images": request.images,
+                    "timestamp": timestamp
+                },
+                {
+                    "role": "assistant",
+                    "content": bot_response,
+                    "timestamp": timestamp
+                }
+            ])
+            # 记录消息对图片的引用，消息删除前图片不会被清理
+            if saved:
+                media = get_media_store()
+                for img_url in request.images or []:
+                    media.add_ref(img_url, request.character_id, "message", f"{history.branch_id}:{saved[0]['seq']}")
+        _index_messages(history, saved)
 
         return {
             "character_id": request.character_id,
@@ -503,10 +547,10 @@ import subprocess
 async def transcribe_audio(audio_path: str) -> str:
     """使用 Whisper 或其他方式转录音频"""
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_llm_client()
 
         with open(audio_path, "rb") as audio_file:
-            response = client.audio.transcriptions.create(
+            response = await client.audio.transcriptions.create(
                 model="whisper-1",
                 file=audio_file
             )
@@ -550,133 +594,440 @@ async def voice_to_text(request: VoiceMessageRequest):
 
 # ============ 聊天历史管理 ============
 
-@router.get("/chat/history/{character_id}/search")
+def _load_hits(store, hits: List[Dict]) -> List[Dict]:
+    """按序号取回命中的消息，跳过索引中残留的已删除消息"""
+    results = []
+    for hit in hits:
+        messages = store.get_messages_after(hit["character_id"], hit["seq"] - 1, 1)
+        if not messages or messages[0]["seq"] != hit["seq"]:
+            continue
+        msg = messages[0]
+        result = {
+            "character_id": hit["character_id"],
+            "seq": msg["seq"],
+            "role": msg.get("role"),
+            "content": msg.get("content"),
+            "timestamp": msg.get("timestamp")
+        }
+        # 相关度分数、向量距离等附加字段
+        result.update((k, v) for k, v in hit.items() if k not in result)
+        results.append(result)
+    return results
+
+
+@router.get("/chat/history/{character_id}/search", dependencies=[Depends(verify_character_owner)])
 async def search_chat_history(
     character_id: str,
-    q: str = Query(..., description="搜索关键词")
+    q: str = Query(..., description="搜索关键词"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100)
 ):
-    """搜索聊天记录"""
-    characters = load_characters()
+    """搜索聊天记录（按相关度排序分页）"""
+    store = get_character_store()
 
-    if character_id not in characters:
+    if not store.exists(character_id):
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    chat_history = characters[character_id].get("chat_history", [])
+    index = get_search_index()
+    index.sync(store, character_id)
+    total, hits = index.search(q, [character_id], offset, limit)
 
-    # 搜索用户和助手的消息
-    results = []
-    for idx, msg in enumerate(chat_history):
-        if q.lower() in msg.get("content", "").lower():
-            results.append({
-                "index": idx,
-                "role": msg.get("role"),
-                "content": msg.get("content"),
-                "timestamp": msg.get("timestamp")
-            })
+    return {
+        "query": q,
+        "count": total,
+        "results": _load_hits(store, hits),
+        "has_more": offset + limit < total
+    }
+
+
+@router.get("/chat/history/{character_id}/semantic-search", dependencies=[Depends(verify_character_owner)])
+async def semantic_search_chat_history(
+    character_id: str,
+    q: str = Query(..., description="查询内容"),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """语义检索聊天记录（返回意思最接近的消息，按向量距离排序）"""
+    semantic = get_semantic_index()
+    if semantic is None:
+        raise HTTPException(status_code=503, detail="语义检索未启用")
+
+    store = get_character_store()
+
+    if not store.exists(character_id):
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    hits = await asyncio.to_thread(semantic.search, character_id, q, limit)
+    results = _load_hits(store, hits)
 
     return {
         "query": q,
         "count": len(results),
-        "results": results[-20:]  # 只返回最近的20条匹配
+        "results": results
     }
 
 
-@router.get("/chat/history/{character_id}/export")
-async def export_chat_history(character_id: str):
-    """导出聊天记录为 JSON"""
-    characters = load_characters()
+@router.post("/chat/history/{character_id}/semantic-index", dependencies=[Depends(verify_character_owner)])
+async def backfill_semantic_index(character_id: str):
+    """为已有的聊天记录补建语义索引（后台限速执行），返回任务状态"""
+    semantic = get_semantic_index()
+    if semantic is None:
+        raise HTTPException(status_code=503, detail="语义检索未启用")
+
+    store = get_character_store()
 
-    if character_id not in characters:
+    if not store.exists(character_id):
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    character = characters[character_id]
-    chat_history = character.get("chat_history", [])
+    return semantic.start_backfill(store, character_id)
+
+
+@router.get("/chat/search")
+async def search_all_chat_history(
+    q: str = Query(..., description="搜索关键词"),
+    character_ids: Optional[str] = Query(None, description="逗号分隔的角色ID，不传则搜索当前用户的全部角色"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    owner_id: str = Depends(get_owner_id)
+):
+    """跨角色搜索当前用户的聊天记录"""
+    store = get_character_store()
+
+    names = {c["id"]: c.get("name") for c in store.list_summaries(owner_id)}
+    if character_ids:
+        ids = [cid for cid in character_ids.split(",") if cid in names]
+    else:
+        ids = list(names)
+
+    # 新消息在写入时已经加入索引，只补齐本进程内还没补齐过的角色
+    index = get_search_index()
+    for cid in ids:
+        index.ensure_synced(store, cid)
+    total, hits = index.search(q, ids, offset, limit)
+
+    results = _load_hits(store, hits)
+    for result in results:
+        result["character_name"] = names.get(result["character_id"])
+
+    return {
+        "query": q,
+        "count": total,
+        "results": results,
+        "has_more": offset + limit < total
+    }
+
+
+# 导出时每批从存储读取的消息条数
+EXPORT_BATCH_SIZE = 500
 
-    # 格式化导出数据
-    export_data = {
+
+@router.get("/chat/history/{character_id}/export", dependencies=[Depends(verify_character_owner)])
+async def export_chat_history(
+    character_id: str,
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$", description="json 或 ndjson"),
+    gzip: bool = Query(False, description="是否 gzip 压缩传输")
+):
+    """
+    流式导出聊天记录
+
+    - json：{"character", "export_time", "total_messages", "messages": [...]}
+    - ndjson：第一行是角色信息，之后每行一条消息
+
+    按批从存储读取并立即发送，内存占用与记录总数无关。
+    """
+    store = get_character_store()
+    character = store.get(character_id)
+
+    if character is None:
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    header = {
         "character": {
             "name": character.get("name"),
             "gender": character.get("gender"),
             "relationship_type": character.get("relationship_type"),
         },
         "export_time": datetime.now().isoformat(),
-        "total_messages": len(chat_history),
-        "messages": chat_history
+        "total_messages": store.count_messages(character_id),
+    }
+
+    def dumps(data) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+    async def batches() -> AsyncGenerator[List[Dict], None]:
+        messages = store.iter_messages(character_id, EXPORT_BATCH_SIZE)
+        try:
+            while True:
+                # 每批在角色锁内读取，与追加、删除和压实互斥；批与批之间让出事件循环
+                async with character_lock(character_id):
+                    batch = next(messages, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            messages.close()
+
+    async def chunks() -> AsyncGenerator[str, None]:
+        if fmt == "ndjson":
+            yield dumps(header) + "\n"
+            async for batch in batches():
+                yield "".join(dumps(m) + "\n" for m in batch)
+        else:
+            yield dumps(header)[:-1] + ', "messages": ['
+            first = True
+            async for batch in batches():
+                body = ", ".join(dumps(m) for m in batch)
+                yield body if first else ", " + body
+                first = False
+            yield "]}"
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        # wbits=31 输出 gzip 格式
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        try:
+            async for chunk in chunks():
+                data = chunk.encode("utf-8")
+                if compressor is None:
+                    yield data
+                else:
+                    # 每批同步刷新一次，客户端不必等压缩缓冲区填满
+                    yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        except Exception as e:
+            # 响应头已经发出，无法再返回错误状态码：继续抛出让服务器中断连接，
+            # 客户端收到的是不完整的传输，而不是被截断却看似成功的文件
+            print(f"导出聊天记录失败: {e}")
+            raise
+        if compressor is not None:
+            yield compressor.flush()
+
+    extension = "ndjson" if fmt == "ndjson" else "json"
+    date = datetime.now().strftime("%Y-%m-%d")
+    filename = f"soulecho-{character.get('name') or 'chat'}-{date}.{extension}"
+    headers = {
+        # filename 只能是 ASCII，中文名放在 filename* 中
+        "Content-Disposition": (
+            f'attachment; filename="soulecho-{character_id}-{date}.{extension}"; '
+            f"filename*=UTF-8''{quote(filename)}"
+        )
     }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
 
-    return export_data
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
 
 
-@router.delete("/chat/history/{character_id}")
+@router.delete("/chat/history/{character_id}", dependencies=[Depends(verify_character_owner)])
 async def clear_chat_history(character_id: str):
     """清空聊天历史"""
-    characters = load_characters()
+    store = get_character_store()
 
-    if character_id not in characters:
+    if not store.exists(character_id):
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    characters[character_id]["chat_history"] = []
-    save_characters(characters)
+    async with character_lock(character_id):
+        store.clear_messages(character_id)
+        get_branch_store().remove_character(character_id)
+        get_summary_store().remove_character(character_id)
+        get_media_store().remove_refs(character_id, "message")
+        get_search_index().remove_character(character_id)
+
+    # 向量库的删除可能较慢，在锁外放到线程中执行，不阻塞其他请求
+    semantic = get_semantic_index()
+    if semantic is not None:
+        try:
+            await asyncio.to_thread(semantic.remove_character, character_id)
+        except Exception as e:
+            print(f"删除语义索引失败: {e}")
 
     return {"message": "聊天历史已清空", "character_id": character_id}
 
 
-@router.delete("/chat/history/{character_id}/message/{message_index}")
+@router.delete("/chat/history/{character_id}/message/{seq}", dependencies=[Depends(verify_character_owner)])
 async def delete_chat_message(
     character_id: str,
-    message_index: int
+    seq: int
 ):
-    """删除指定消息"""
-    characters = load_characters()
+    """
+    按序号删除当前分支中的指定消息（序号不随其他消息的删除而变化）
 
-    if character_id not in characters:
-        raise HTTPException(status_code=404, detail="角色不存在")
+    分叉点之前的消息由多个分支共享，删除后共享它的分支都不再看到。
+    """
+    store = get_character_store()
 
-    chat_history = characters[character_id].get("chat_history", [])
+    if not store.exists(character_id):
+        raise HTTPException(status_code=404, detail="角色不存在")
 
-    if message_index < 0 or message_index >= len(chat_history):
+    async with character_lock(character_id):
+        history = _branch_history(store, character_id)
+        deleted_msg = history.delete_message(seq)
+        if deleted_msg is not None:
+            # 已经折叠进摘要的消息被删除时丢弃摘要，之后重新生成
+            get_summary_store().invalidate(character_id, seq)
+            media = get_media_store()
+            for img_url in deleted_msg.get("images") or []:
+                media.remove_ref(img_url, character_id, "message", f"{history.branch_of(seq)}:{seq}")
+        on_main = deleted_msg is not None and history.branch_of(seq) == MAIN_BRANCH
+        if on_main:
+            get_search_index().remove_message(character_id, seq)
+
+    if deleted_msg is None:
         raise HTTPException(status_code=404, detail="消息不存在")
 
-    deleted_msg = chat_history.pop(message_index)
-    save_characters(characters)
+    # 序号不会复用，向量的删除可以在锁外放到线程中执行
+    semantic = get_semantic_index()
+    if on_main and semantic is not None:
+        try:
+            await asyncio.to_thread(semantic.remove_message, character_id, seq)
+        except Exception as e:
+            print(f"删除语义索引失败: {e}")
 
     return {"message": "消息已删除", "deleted_message": deleted_msg}
 
 
-@router.get("/chat/history/{character_id}/stats")
+@router.get("/chat/history/{character_id}/stats", dependencies=[Depends(verify_character_owner)])
 async def get_chat_stats(character_id: str):
     """获取聊天统计信息"""
-    characters = load_characters()
+    store = get_character_store()
 
-    if character_id not in characters:
+    if not store.exists(character_id):
         raise HTTPException(status_code=404, detail="角色不存在")
 
-    chat_history = characters[character_id].get("chat_history", [])
+    return store.get_stats(character_id)
 
-    # 统计
-    user_msgs = [m for m in chat_history if m.get("role") == "user"]
-    assistant_msgs = [m for m in chat_history if m.get("role") == "assistant"]
 
-    # 计算总字数
-    total_chars = sum(len(m.get("content", "")) for m in chat_history)
+# ============ 对话分支 ============
 
-    # 获取日期范围
-    timestamps = [m.get("timestamp") for m in chat_history if m.get("timestamp")]
-    dates = set()
-    for ts in timestamps:
-        try:
-            dates.add(ts[:10])
-        except:
-            pass
+class ForkRequest(BaseModel):
+    seq: int  # 分叉点：新分支保留序号不大于 seq 的消息，0 表示从空白开始
+    branch_id: Optional[str] = None  # 从哪个分支分叉，默认当前分支
+
+
+class SwitchBranchRequest(BaseModel):
+    branch_id: str  # 主线为 main
+
+
+@router.get("/chat/history/{character_id}/branches", dependencies=[Depends(verify_character_owner)])
+async def list_chat_branches(character_id: str):
+    """获取角色的对话分支和当前分支"""
+    if not get_character_store().exists(character_id):
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    branches = get_branch_store()
+    return {
+        "active": branches.active_branch(character_id),
+        "branches": branches.list_branches(character_id)
+    }
+
+
+@router.post("/chat/history/{character_id}/branches", dependencies=[Depends(verify_character_owner)])
+async def fork_chat_history(character_id: str, request: ForkRequest):
+    """在指定消息处分叉出新分支并切换过去（分叉点之前的记录与原分支共享，不复制）"""
+    store = get_character_store()
+
+    if not store.exists(character_id):
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    async with character_lock(character_id):
+        history = _branch_history(store, character_id, request.branch_id)
+        if request.seq != 0:
+            found = history.get_messages_after(request.seq - 1, 1)
+            if not found or found[0]["seq"] != request.seq:
+                raise HTTPException(status_code=404, detail="消息不存在")
+
+        branches = get_branch_store()
+        branch = branches.create_branch(character_id, history.branch_id, request.seq)
+        branches.set_active(character_id, branch["branch_id"])
+
+    return branch
+
+
+@router.put("/chat/history/{character_id}/branches/active", dependencies=[Depends(verify_character_owner)])
+async def switch_chat_branch(character_id: str, request: SwitchBranchRequest):
+    """切换当前分支，之后的对话在该分支上继续"""
+    if not get_character_store().exists(character_id):
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    branches = get_branch_store()
+    if request.branch_id != MAIN_BRANCH and branches.get_branch(character_id, request.branch_id) is None:
+        raise HTTPException(status_code=404, detail="分支不存在")
+
+    async with character_lock(character_id):
+        branches.set_active(character_id, request.branch_id)
+
+    return {"character_id": character_id, "branch_id": request.branch_id}
+
+
+@router.post("/chat/history/{character_id}/regenerate", dependencies=[Depends(verify_character_owner)])
+async def regenerate_response(character_id: str):
+    """
+    重新生成当前分支最后一条回复
+
+    在这条回复之前分叉出新分支，把新的回复写入新分支并切换过去；
+    原来的回复保留在原分支，可以随时切换回去。
+    """
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API Key 未配置")
+
+    store = get_character_store()
+    character = store.get(character_id)
+
+    if character is None:
+        raise HTTPException(status_code=404, detail="角色不存在")
+
+    history = _branch_history(store, character_id)
+    last = history.get_recent_messages(1)
+    if not last or last[-1]["role"] != "assistant":
+        raise HTTPException(status_code=400, detail="没有可以重新生成的回复")
+
+    # 在最后一条回复之前分叉，之前的消息作为上下文
+    previous = history.get_messages_before(last[-1]["seq"], 1)
+    fork_seq = previous[-1]["seq"] if previous else 0
+
+    # 和发送消息时一样，用回复所对应的用户消息检索相关记忆
+    memories = []
+    if previous and previous[-1]["role"] == "user":
+        memories = _search_memories(character_id, previous[-1]["content"])
+
+    messages = build_context(character, history, memories=memories, before_seq=last[-1]["seq"])
+
+    try:
+        client = get_llm_client()
+
+        response = await client.chat.completions.create(
+            model=DEFAULT_MODEL,
+            messages=messages,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE,
+        )
+
+        bot_response = response.choices[0].message.content
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"AI 服务错误: {str(e)}")
+
+    timestamp = datetime.now().isoformat()
+    async with character_lock(character_id):
+        # 生成期间角色被删除或聊天记录被清空时不再创建分支，避免留下孤立的分支
+        if not store.exists(character_id):
+            raise HTTPException(status_code=404, detail="角色不存在")
+        branches = get_branch_store()
+        if history.branch_id != MAIN_BRANCH and branches.get_branch(character_id, history.branch_id) is None:
+            raise HTTPException(status_code=404, detail="分支不存在")
+        branch = branches.create_branch(character_id, history.branch_id, fork_seq)
+        branch_history = get_history(store, character_id, branch["branch_id"])
+        saved = branch_history.append_messages([
+            {
+                "role": "assistant",
+                "content": bot_response,
+                "timestamp": timestamp
+            }
+        ])
+        branches.set_active(character_id, branch["branch_id"])
+    _index_messages(branch_history, saved)
 
     return {
-        "total_messages": len(chat_history),
-        "user_messages": len(user_msgs),
-        "assistant_messages": len(assistant_msgs),
-        "total_characters": total_chars,
-        "chat_days": len(dates),
-        "date_range": {
-            "start": min(dates) if dates else None,
-            "end": max(dates) if dates else None
-        } if dates else None
+        "character_id": character_id,
+        "branch_id": branch["branch_id"],
+        "seq": saved[0]["seq"],
+        "response": bot_response,
+        "timestamp": timestamp
     }
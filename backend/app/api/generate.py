@@ -3,6 +3,8 @@ from pydantic import BaseModel
 import os
 import json
 
+from app.services.llm import get_llm_client
+
 router = APIRouter()
 
 
@@ -23,12 +25,8 @@ class GenerateAppearanceResponse(BaseModel):
 
 
 def get_openai_client():
-    """获取 OpenAI 客户端，如果没配置 API key 则返回 None"""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return None
-    from openai import OpenAI
-    return OpenAI(api_key=api_key)
+    """获取共享的异步 OpenAI 客户端，如果没配置 API key 则返回 None"""
+    return get_llm_client()
 
 
 @router.post("/generate/name", response_model=GenerateNameResponse)
@@ -59,7 +57,7 @@ async def generate_name(request: GenerateRequest):
 }}
 """
 
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=os.getenv("MODEL_NAME", "gpt-3.5-turbo"),
         messages=[
             {
@@ -108,7 +106,7 @@ async def generate_appearance(request: GenerateRequest):
 }}
 """
 
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=os.getenv("MODEL_NAME", "gpt-3.5-turbo"),
         messages=[
             {
@@ -1,13 +1,14 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
 from pydantic import BaseModel
 from typing import Optional, List
 import os
-import uuid
-from pathlib import Path
+
+from app.db.media import get_media_store, media_url
+from app.api.characters import verify_character_owner
 
 router = APIRouter()
 
-# 图片存储目录
+# 旧版图片存储目录（新上传的图片按内容哈希存放在 static/media）
 IMAGES_DIR = "static/images"
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
@@ -21,7 +22,7 @@ class ImageResponse(BaseModel):
     message: str
 
 
-@router.post("/characters/{character_id}/images")
+@router.post("/characters/{character_id}/images", dependencies=[Depends(verify_character_owner)])
 async def upload_image(
     character_id: str,
     file: UploadFile = File(...)
@@ -40,18 +41,14 @@ async def upload_image(
             detail="图片大小不能超过 10MB"
         )
 
-    # 生成唯一文件名
     ext = file.content_type.split('/')[-1]
     if ext == 'jpeg':
         ext = 'jpg'
 
-    filename = f"{character_id}_{uuid.uuid4().hex[:8]}.{ext}"
-    filepath = os.path.join(IMAGES_DIR, filename)
-
-    with open(filepath, 'wb') as f:
-        f.write(content)
-
-    image_url = f"/images/{filename}"
+    # 按内容哈希保存，重复上传或发给多个角色的同一张图片只存一份
+    media = get_media_store()
+    image_url = media.put(content, ext)
+    media.add_ref(image_url, character_id, "image")
 
     return ImageResponse(
         url=image_url,
@@ -59,28 +56,22 @@ async def upload_image(
     )
 
 
-@router.delete("/characters/{character_id}/images/{filename}")
+@router.delete("/characters/{character_id}/images/{filename}", dependencies=[Depends(verify_character_owner)])
 async def delete_image(character_id: str, filename: str):
-    """删除图片"""
-    filepath = os.path.join(IMAGES_DIR, filename)
-    if os.path.exists(filepath):
+    """从角色图库中删除图片（只删除引用，其他角色或聊天记录仍在使用时保留文件）"""
+    content_hash, _, ext = filename.partition('.')
+    if get_media_store().remove_ref(media_url(content_hash, ext), character_id, "image"):
+        return {"message": "图片已删除"}
+
+    # 旧版按角色命名的图片
+    filepath = os.path.join(IMAGES_DIR, os.path.basename(filename))
+    if filename.startswith(character_id + "_") and os.path.exists(filepath):
         os.remove(filepath)
         return {"message": "图片已删除"}
     raise HTTPException(status_code=404, detail="图片不存在")
 
 
-@router.get("/characters/{character_id}/images")
+@router.get("/characters/{character_id}/images", dependencies=[Depends(verify_character_owner)])
 async def get_images(character_id: str):
-    """获取该角色的所有图片"""
-    if not os.path.exists(IMAGES_DIR):
-        return {"images": []}
-
-    images = []
-    for filename in os.listdir(IMAGES_DIR):
-        if filename.startswith(character_id + "_"):
-            images.append({
-                "url": f"/images/{filename}",
-                "filename": filename
-            })
-
-    return {"images": images}
+    """获取该角色的所有图片（从引用表读取，不扫描图片目录）"""
+    return {"images": get_media_store().list_refs(character_id, "image")}
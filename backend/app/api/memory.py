@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 
+from app.api.characters import verify_character_owner
+
 router = APIRouter()
 
 
@@ -26,7 +28,7 @@ class SearchMemoryRequest(BaseModel):
     min_importance: int = 0
 
 
-@router.get("/characters/{character_id}/memories")
+@router.get("/characters/{character_id}/memories", dependencies=[Depends(verify_character_owner)])
 async def get_memories(character_id: str, limit: int = 10):
     """获取最重要的记忆"""
     try:
@@ -43,7 +45,7 @@ async def get_memories(character_id: str, limit: int = 10):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/characters/{character_id}/memories")
+@router.post("/characters/{character_id}/memories", dependencies=[Depends(verify_character_owner)])
 async def add_memory(character_id: str, request: AddMemoryRequest):
     """添加记忆"""
     try:
@@ -65,7 +67,7 @@ async def add_memory(character_id: str, request: AddMemoryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/characters/{character_id}/memories/search")
+@router.post("/characters/{character_id}/memories/search", dependencies=[Depends(verify_character_owner)])
 async def search_memories(character_id: str, request: SearchMemoryRequest):
     """搜索相关记忆"""
     try:
@@ -87,7 +89,7 @@ async def search_memories(character_id: str, request: SearchMemoryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/characters/{character_id}/memories/{memory_id}")
+@router.delete("/characters/{character_id}/memories/{memory_id}", dependencies=[Depends(verify_character_owner)])
 async def delete_memory(character_id: str, memory_id: str):
     """删除记忆"""
     try:
@@ -106,7 +108,7 @@ async def delete_memory(character_id: str, memory_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/characters/{character_id}/memories")
+@router.delete("/characters/{character_id}/memories", dependencies=[Depends(verify_character_owner)])
 async def clear_memories(character_id: str):
     """清除所有记忆"""
     try:
@@ -125,7 +127,7 @@ async def clear_memories(character_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/characters/{character_id}/memories/count")
+@router.get("/characters/{character_id}/memories/count", dependencies=[Depends(verify_character_owner)])
 async def get_memory_count(character_id: str):
     """获取记忆数量"""
     try:
@@ -139,7 +141,7 @@ async def get_memory_count(character_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/characters/{character_id}/memories/consolidate")
+@router.post("/characters/{character_id}/memories/consolidate", dependencies=[Depends(verify_character_owner)])
 async def consolidate_memories(character_id: str):
     """合并相似记忆，清理冗余"""
     try:
@@ -162,7 +164,7 @@ async def consolidate_memories(character_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/characters/{character_id}/memories/all")
+@router.get("/characters/{character_id}/memories/all", dependencies=[Depends(verify_character_owner)])
 async def get_all_memories(character_id: str, limit: int = 100):
     """获取所有记忆（包括低重要性的）"""
     try:
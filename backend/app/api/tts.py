@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, List
 import os
 
+from app.api.auth import get_owner_id
+from app.api.characters import check_character_owner
+
 router = APIRouter()
 
 # 创建 audio 静态文件目录
@@ -18,6 +21,7 @@ class TTSRequest(BaseModel):
     rate: Optional[str] = "+0%"  # 语速
     volume: Optional[str] = "+0%"  # 音量
     pitch: Optional[str] = "+0Hz"  # 音调
+    character_id: Optional[str] = None  # 所属角色，删除角色时一并清理音频
 
 
 class TTSResponse(BaseModel):
@@ -35,8 +39,11 @@ class VoiceInfo(BaseModel):
 
 
 @router.post("/tts")
-async def text_to_speech(request: TTSRequest):
+async def text_to_speech(request: TTSRequest, owner_id: str = Depends(get_owner_id)):
     """文本转语音"""
+    if request.character_id:
+        check_character_owner(request.character_id, owner_id)
+
     if not request.text or not request.text.strip():
         raise HTTPException(status_code=400, detail="文本不能为空")
 
@@ -54,6 +61,7 @@ async def text_to_speech(request: TTSRequest):
             rate=request.rate,
             volume=request.volume,
             pitch=request.pitch,
+            character_id=request.character_id,
         )
 
         return TTSResponse(
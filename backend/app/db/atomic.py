@@ -0,0 +1,43 @@
+import os
+import json
+import secrets
+import threading
+from typing import Any
+
+
+def _fsync_dir(directory: str):
+    """同步目录项，保证 rename 本身落盘（Windows 不支持打开目录，直接跳过）"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: str, data: bytes):
+    """
+    原子替换文件内容
+
+    先写入同目录下的临时文件并 fsync，再 rename 覆盖目标文件。
+    读者要么看到旧文件，要么看到完整的新文件，不会读到写了一半的内容。
+    """
+    # 临时文件名带线程号和随机后缀，同一进程的多个线程同时写同一个文件时互不覆盖
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(tmp_path, 'xb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(os.path.dirname(path))
+
+
+def atomic_write_json(path: str, data: Any):
+    """原子写入 JSON 文件"""
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
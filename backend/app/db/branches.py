@@ -0,0 +1,386 @@
+import os
+import json
+import sqlite3
+import threading
+from uuid import uuid4
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.db.repository import CharacterStore
+from app.db.message import with_token_count
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 对话分支数据库（与角色存储后端无关）
+BRANCH_DB_PATH = os.getenv("BRANCH_DB_PATH", os.path.join("data", "branches.db"))
+
+# 主线：角色存储中的聊天记录
+MAIN_BRANCH = "main"
+
+SCHEMA = """
+-- fork_seq：分叉点，分支包含父分支中序号不大于 fork_seq 的消息；
+-- last_seq：分支最近分配的消息序号，删除消息后也不回退
+CREATE TABLE IF NOT EXISTS branches (
+    character_id TEXT NOT NULL,
+    branch_id TEXT NOT NULL,
+    parent_id TEXT NOT NULL,
+    fork_seq INTEGER NOT NULL,
+    last_seq INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (character_id, branch_id)
+);
+
+-- 分支自己的消息（分叉点之后），不复制父分支的记录
+CREATE TABLE IF NOT EXISTS branch_messages (
+    character_id TEXT NOT NULL,
+    branch_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (character_id, branch_id, seq)
+);
+
+-- 每个角色当前使用的分支，没有记录时为主线
+CREATE TABLE IF NOT EXISTS active_branches (
+    character_id TEXT PRIMARY KEY,
+    branch_id TEXT NOT NULL
+);
+"""
+
+
+class BranchStore:
+    """
+    对话分支（写时复制）
+
+    分支只记录父分支和分叉点 fork_seq，以及分叉之后自己的消息；分叉点之前的记录
+    读取时从父分支取，不复制。存储量随各分支新增的消息增长，与分支数量无关。
+
+    分支内的消息序号从分叉点接着分配，同一条分支链上的序号唯一，不同分支可能重复，
+    所以消息由 (分支, 序号) 确定。全文检索、语义检索、统计和导出只针对主线。
+    """
+
+    def __init__(self, path: str = BRANCH_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    # ============ 分支 ============
+
+    def get_branch(self, character_id: str, branch_id: str) -> Optional[Dict]:
+        """读取分支信息，主线和不存在的分支返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT branch_id, parent_id, fork_seq, last_seq, created_at FROM branches "
+                "WHERE character_id = ? AND branch_id = ?",
+                (character_id, branch_id)
+            ).fetchone()
+        return _branch_row(row) if row else None
+
+    def list_branches(self, character_id: str) -> List[Dict]:
+        """角色的全部分支（按创建时间排序，不含主线），附带各分支自己的消息条数"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT b.branch_id, b.parent_id, b.fork_seq, b.last_seq, b.created_at, "
+                "(SELECT COUNT(*) FROM branch_messages m "
+                " WHERE m.character_id = b.character_id AND m.branch_id = b.branch_id) "
+                "FROM branches b WHERE b.character_id = ? ORDER BY b.created_at, b.rowid",
+                (character_id,)
+            ).fetchall()
+        return [{**_branch_row(row), "own_messages": row[5]} for row in rows]
+
+    def create_branch(self, character_id: str, parent_id: str, fork_seq: int) -> Dict:
+        """
+        在 parent_id 的 fork_seq 处分叉
+
+        分叉点不在父分支自己的消息范围内时沿父分支链上移，保证分支链上的分叉点严格递增，
+        反复重新生成同一轮回复得到的是兄弟分支，而不是越来越深的分支链。
+        """
+        parent = self.get_branch(character_id, parent_id) if parent_id != MAIN_BRANCH else None
+        while parent is not None and fork_seq <= parent["fork_seq"]:
+            parent_id = parent["parent_id"]
+            parent = self.get_branch(character_id, parent_id) if parent_id != MAIN_BRANCH else None
+
+        branch = {
+            "branch_id": str(uuid4()),
+            "parent_id": parent_id,
+            "fork_seq": fork_seq,
+            "last_seq": fork_seq,
+            "created_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO branches (character_id, branch_id, parent_id, fork_seq, last_seq, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (character_id, branch["branch_id"], parent_id, fork_seq, fork_seq, branch["created_at"])
+            )
+        return branch
+
+    def active_branch(self, character_id: str) -> str:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT branch_id FROM active_branches WHERE character_id = ?", (character_id,)
+            ).fetchone()
+        return row[0] if row else MAIN_BRANCH
+
+    def set_active(self, character_id: str, branch_id: str):
+        with self._lock:
+            if branch_id == MAIN_BRANCH:
+                self.conn.execute("DELETE FROM active_branches WHERE character_id = ?", (character_id,))
+                return
+            self.conn.execute(
+                "INSERT INTO active_branches (character_id, branch_id) VALUES (?, ?) "
+                "ON CONFLICT (character_id) DO UPDATE SET branch_id = excluded.branch_id",
+                (character_id, branch_id)
+            )
+
+    def remove_character(self, character_id: str):
+        """删除角色的全部分支（清空聊天记录或删除角色时）"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM branch_messages WHERE character_id = ?", (character_id,))
+                self.conn.execute("DELETE FROM branches WHERE character_id = ?", (character_id,))
+                self.conn.execute("DELETE FROM active_branches WHERE character_id = ?", (character_id,))
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # ============ 分支自己的消息 ============
+
+    def messages_before(self, character_id: str, branch_id: str, before_seq: int, limit: int) -> List[Dict]:
+        """序号小于 before_seq 的最近 limit 条（时间正序）"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT data FROM branch_messages WHERE character_id = ? AND branch_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (character_id, branch_id, before_seq, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def messages_after(self, character_id: str, branch_id: str, after_seq: int, max_seq: int, limit: int) -> List[Dict]:
+        """序号在 (after_seq, max_seq] 之间的最早 limit 条（时间正序）"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT data FROM branch_messages WHERE character_id = ? AND branch_id = ? "
+                "AND seq > ? AND seq <= ? ORDER BY seq LIMIT ?",
+                (character_id, branch_id, after_seq, max_seq, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_messages(self, character_id: str, branch_id: str, max_seq: int) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM branch_messages WHERE character_id = ? AND branch_id = ? AND seq <= ?",
+                (character_id, branch_id, max_seq)
+            ).fetchone()[0]
+
+    def append_messages(self, character_id: str, branch_id: str, messages: List[Dict]) -> List[Dict]:
+        """追加到分支，序号接着分支的 last_seq 分配，返回带序号的消息"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT last_seq FROM branches WHERE character_id = ? AND branch_id = ?",
+                    (character_id, branch_id)
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("ROLLBACK")
+                    return []
+                seq = row[0]
+                records = []
+                for message in messages:
+                    seq += 1
+                    record = {**message, "seq": seq}
+                    self.conn.execute(
+                        "INSERT INTO branch_messages (character_id, branch_id, seq, data) VALUES (?, ?, ?, ?)",
+                        (character_id, branch_id, seq, json.dumps(record, ensure_ascii=False))
+                    )
+                    records.append(record)
+                self.conn.execute(
+                    "UPDATE branches SET last_seq = ? WHERE character_id = ? AND branch_id = ?",
+                    (seq, character_id, branch_id)
+                )
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return records
+
+    def delete_message(self, character_id: str, branch_id: str, seq: int) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM branch_messages WHERE character_id = ? AND branch_id = ? AND seq = ?",
+                (character_id, branch_id, seq)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "DELETE FROM branch_messages WHERE character_id = ? AND branch_id = ? AND seq = ?",
+                (character_id, branch_id, seq)
+            )
+        return json.loads(row[0])
+
+    def close(self):
+        self.conn.close()
+
+
+def _branch_row(row) -> Dict:
+    return {
+        "branch_id": row[0],
+        "parent_id": row[1],
+        "fork_seq": row[2],
+        "last_seq": row[3],
+        "created_at": row[4],
+    }
+
+
+class BranchHistory:
+    """
+    某个分支看到的聊天记录
+
+    从分支沿父分支链一直到主线，每一层贡献一段序号区间：主线 (0, f_n]，
+    中间的分支 (f_i, f_{i-1}]，当前分支 (f_0, ∞)。读取时按区间拼接各层的消息，
+    接口与 CharacterStore 中按序号读取的方法一致。
+    """
+
+    def __init__(self, store: CharacterStore, branches: BranchStore, character_id: str, branch_id: str):
+        self.store = store
+        self.branches = branches
+        self.character_id = character_id
+        self.branch_id = branch_id
+        # [(分支ID, 区间下界, 区间上界)]，从当前分支到主线；上界为 None 表示不限
+        self.levels = []
+        high = None
+        while branch_id != MAIN_BRANCH:
+            branch = branches.get_branch(character_id, branch_id)
+            if branch is None:
+                raise KeyError(branch_id)
+            self.levels.append((branch_id, branch["fork_seq"], high))
+            high = branch["fork_seq"]
+            branch_id = branch["parent_id"]
+        self.levels.append((MAIN_BRANCH, 0, high))
+
+    def branch_of(self, seq: int) -> str:
+        """序号 seq 的消息所在的分支（共享前缀中的消息属于祖先分支）"""
+        for branch_id, low, _ in self.levels:
+            if seq > low:
+                return branch_id
+        return MAIN_BRANCH
+
+    def _before(self, branch_id: str, before_seq: Optional[int], limit: int) -> List[Dict]:
+        if branch_id == MAIN_BRANCH:
+            return self.store.get_messages_before(self.character_id, before_seq, limit)
+        return self.branches.messages_before(self.character_id, branch_id, before_seq, limit)
+
+    def get_messages_before(self, before_seq: Optional[int], limit: int) -> List[Dict]:
+        """序号小于 before_seq 的最近 limit 条消息（时间正序），before_seq 为空时从最新一条开始"""
+        messages: List[Dict] = []
+        for branch_id, low, high in self.levels:
+            if len(messages) >= limit:
+                break
+            if before_seq is not None and before_seq <= low + 1:
+                continue
+            end = high + 1 if high is not None else None
+            if before_seq is not None:
+                end = before_seq if end is None else min(end, before_seq)
+            if end is None and branch_id != MAIN_BRANCH:
+                end = self.last_seq() + 1
+            messages = self._before(branch_id, end, limit - len(messages)) + messages
+        return messages
+
+    def get_messages_after(self, after_seq: int, limit: int) -> List[Dict]:
+        """序号大于 after_seq 的最早 limit 条消息（时间正序）"""
+        messages: List[Dict] = []
+        for branch_id, _, high in reversed(self.levels):
+            if len(messages) >= limit:
+                break
+            if high is not None and after_seq >= high:
+                continue
+            remaining = limit - len(messages)
+            if branch_id == MAIN_BRANCH:
+                batch = self.store.get_messages_after(self.character_id, after_seq, remaining)
+                if high is not None:
+                    batch = [m for m in batch if m["seq"] <= high]
+            else:
+                max_seq = high if high is not None else self.last_seq()
+                batch = self.branches.messages_after(self.character_id, branch_id, after_seq, max_seq, remaining)
+            messages.extend(batch)
+        return messages
+
+    def get_recent_messages(self, n: int) -> List[Dict]:
+        if n <= 0:
+            return []
+        return self.get_messages_before(None, n)
+
+    def count_messages(self) -> int:
+        total = 0
+        for branch_id, _, high in self.levels:
+            if branch_id == MAIN_BRANCH:
+                if high is None:
+                    total += self.store.count_messages(self.character_id)
+                else:
+                    total += self.store.seq_position(self.character_id, high + 1)
+            else:
+                max_seq = high if high is not None else self.last_seq()
+                total += self.branches.count_messages(self.character_id, branch_id, max_seq)
+        return total
+
+    def last_seq(self) -> int:
+        if self.branch_id == MAIN_BRANCH:
+            return self.store.last_seq(self.character_id)
+        branch = self.branches.get_branch(self.character_id, self.branch_id)
+        if branch is None:
+            # 分支在读取过程中被删除（清空聊天记录或删除角色）
+            raise KeyError(self.branch_id)
+        return branch["last_seq"]
+
+    def append_messages(self, messages: List[Dict]) -> List[Dict]:
+        if not messages:
+            return []
+        # token 数在写入时算好，组装上下文时直接使用
+        messages = [with_token_count(m) for m in messages]
+        if self.branch_id == MAIN_BRANCH:
+            return self.store.append_messages(self.character_id, messages)
+        return self.branches.append_messages(self.character_id, self.branch_id, messages)
+
+    def delete_message(self, seq: int) -> Optional[Dict]:
+        """删除消息；共享前缀中的消息从所属的祖先分支删除，所有共享它的分支都不再看到"""
+        branch_id = self.branch_of(seq)
+        if branch_id == MAIN_BRANCH:
+            return self.store.delete_message(self.character_id, seq)
+        return self.branches.delete_message(self.character_id, branch_id, seq)
+
+
+# 全局实例
+_branch_store: Optional[BranchStore] = None
+
+
+def get_branch_store() -> BranchStore:
+    """获取对话分支存储实例"""
+    global _branch_store
+    if _branch_store is None:
+        _branch_store = BranchStore()
+    return _branch_store
+
+
+def close_branch_store():
+    """关闭对话分支存储"""
+    global _branch_store
+    if _branch_store is not None:
+        _branch_store.close()
+        _branch_store = None
+
+
+def get_history(store: CharacterStore, character_id: str, branch_id: Optional[str] = None) -> BranchHistory:
+    """读取角色某个分支（默认当前分支）的聊天记录，分支不存在时抛出 KeyError"""
+    branches = get_branch_store()
+    if branch_id is None:
+        branch_id = branches.active_branch(character_id)
+    return BranchHistory(store, branches, character_id, branch_id)
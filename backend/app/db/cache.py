@@ -0,0 +1,295 @@
+import asyncio
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Set
+
+from app.db.repository import CharacterStore, HOT_WINDOW, make_summary, owner_of
+from app.db.message import Message
+
+
+class CachedCharacterStore(CharacterStore):
+    """
+    写回式角色缓存
+
+    角色资料和最近 HOT_WINDOW 条聊天记录常驻内存，读取不再访问磁盘；
+    翻到更早的记录时先写回该角色的待写数据，再交给底层存储读取。修改只标记为脏，
+    由定时任务或累积到阈值时批量写回底层存储，突发的多轮对话合并成一次写入。
+    清空、删除等破坏性操作先写回该角色的待写数据，再直接落盘。
+
+    缓存的聊天记录以紧凑的 Message 对象保存，读取时转换为字典。
+    缓存是进程内的，只适用于单个进程写同一份数据的部署方式。
+    """
+
+    def __init__(self, backend: CharacterStore, flush_threshold: int = 200, max_characters: int = 1000):
+        self.backend = backend
+        self.flush_threshold = flush_threshold
+        self.max_characters = max_characters
+        self._lock = threading.RLock()
+        self._profiles: "OrderedDict[str, Dict]" = OrderedDict()
+        self._tails: Dict[str, List[Message]] = {}
+        self._counts: Dict[str, int] = {}
+        self._last_seqs: Dict[str, int] = {}
+        self._dirty_profiles: Set[str] = set()
+        self._pending: Dict[str, List[Message]] = {}
+        self._pending_count = 0
+
+    # ============ 缓存管理 ============
+
+    def _load(self, character_id: str) -> Optional[Dict]:
+        """读取角色资料到缓存，返回缓存中的对象"""
+        profile = self._profiles.get(character_id)
+        if profile is not None:
+            self._profiles.move_to_end(character_id)
+            return profile
+
+        profile = self.backend.get(character_id)
+        if profile is None:
+            return None
+        self._profiles[character_id] = profile
+        self._evict()
+        return profile
+
+    def _tail(self, character_id: str) -> List[Message]:
+        """读取最近的聊天记录和总条数到缓存"""
+        tail = self._tails.get(character_id)
+        if tail is None:
+            tail = [Message.from_dict(m) for m in self.backend.get_recent_messages(character_id, HOT_WINDOW)]
+            self._tails[character_id] = tail
+            self._counts[character_id] = self.backend.count_messages(character_id)
+            self._last_seqs[character_id] = self.backend.last_seq(character_id)
+        return tail
+
+    def _drop_history(self, character_id: str):
+        self._tails.pop(character_id, None)
+        self._counts.pop(character_id, None)
+        self._last_seqs.pop(character_id, None)
+
+    def _evict(self):
+        """超出容量时淘汰最久未使用且没有待写数据的角色"""
+        for character_id in list(self._profiles):
+            if len(self._profiles) <= self.max_characters:
+                break
+            if character_id in self._dirty_profiles or character_id in self._pending:
+                continue
+            del self._profiles[character_id]
+            self._drop_history(character_id)
+
+    def _flush_character(self, character_id: str):
+        """写回单个角色的待写数据"""
+        if character_id in self._dirty_profiles:
+            profile = self._profiles.get(character_id)
+            if profile is not None:
+                self.backend.save(profile)
+            self._dirty_profiles.discard(character_id)
+
+        pending = self._pending.get(character_id)
+        if pending:
+            # 写入成功后才移出待写队列，失败时留待下次重试
+            self.backend.append_messages(character_id, [m.to_dict() for m in pending])
+            del self._pending[character_id]
+            self._pending_count -= len(pending)
+
+    def flush(self):
+        """把所有脏数据批量写回底层存储"""
+        with self._lock:
+            for character_id in list(self._dirty_profiles | set(self._pending)):
+                self._flush_character(character_id)
+
+    # ============ 角色资料 ============
+
+    def exists(self, character_id: str) -> bool:
+        with self._lock:
+            return self._load(character_id) is not None
+
+    def get(self, character_id: str) -> Optional[Dict]:
+        with self._lock:
+            profile = self._load(character_id)
+            return dict(profile) if profile is not None else None
+
+    def get_owner(self, character_id: str) -> Optional[str]:
+        with self._lock:
+            profile = self._load(character_id)
+            return owner_of(profile) if profile is not None else None
+
+    def list_summaries(self, owner_id: str) -> List[Dict]:
+        with self._lock:
+            summaries = self.backend.list_summaries(owner_id)
+            listed = {summary["id"] for summary in summaries}
+            # 尚未写回的修改中换了所属用户的角色（如已删除的角色）
+            for character_id in self._dirty_profiles:
+                if character_id not in listed and owner_of(self._profiles[character_id]) == owner_id:
+                    summaries.append({"id": character_id, "last_active_at": None})
+            # 用缓存中尚未写回的修改覆盖索引中的旧值
+            for summary in summaries:
+                character_id = summary["id"]
+                if character_id in self._dirty_profiles:
+                    summary.update(make_summary(self._profiles[character_id]))
+                pending = self._pending.get(character_id)
+                if pending:
+                    summary["last_active_at"] = pending[-1].to_dict().get("timestamp")
+            summaries = [s for s in summaries if owner_of(s) == owner_id]
+            summaries.sort(key=lambda s: s.get("created_at") or "")
+            return summaries
+
+    def save(self, character: Dict):
+        with self._lock:
+            character_id = character["id"]
+            if character_id not in self._profiles and not self.backend.exists(character_id):
+                # 新角色直接落盘，之后的修改才走写回
+                self.backend.save(character)
+                self._profiles[character_id] = dict(character)
+                self._tails[character_id] = []
+                self._counts[character_id] = 0
+                self._last_seqs[character_id] = 0
+                self._evict()
+                return
+            self._profiles[character_id] = dict(character)
+            self._profiles.move_to_end(character_id)
+            self._dirty_profiles.add(character_id)
+
+    def delete(self, character_id: str) -> bool:
+        with self._lock:
+            self._profiles.pop(character_id, None)
+            self._drop_history(character_id)
+            self._dirty_profiles.discard(character_id)
+            pending = self._pending.pop(character_id, None)
+            if pending:
+                self._pending_count -= len(pending)
+            return self.backend.delete(character_id)
+
+    # ============ 聊天记录 ============
+
+    def last_seq(self, character_id: str) -> int:
+        with self._lock:
+            if self._load(character_id) is None:
+                return 0
+            self._tail(character_id)
+            return self._last_seqs[character_id]
+
+    def seq_position(self, character_id: str, seq: int) -> int:
+        with self._lock:
+            if self._load(character_id) is None:
+                return 0
+            tail = self._tail(character_id)
+            count = self._counts[character_id]
+            if tail and (len(tail) == count or seq >= tail[0].seq):
+                return count - len(tail) + bisect_left([m.seq for m in tail], seq)
+            self._flush_character(character_id)
+            return self.backend.seq_position(character_id, seq)
+
+    def count_messages(self, character_id: str) -> int:
+        with self._lock:
+            if self._load(character_id) is None:
+                return 0
+            self._tail(character_id)
+            return self._counts[character_id]
+
+    def get_messages(self, character_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            if self._load(character_id) is None:
+                return []
+            tail = self._tail(character_id)
+            tail_start = self._counts[character_id] - len(tail)
+            offset = max(offset, 0)
+            if offset >= tail_start:
+                end = None if limit is None else offset + limit - tail_start
+                return [m.to_dict() for m in tail[offset - tail_start:end]]
+            # 超出缓存范围：先写回待写数据，保证底层存储是完整的
+            self._flush_character(character_id)
+            return self.backend.get_messages(character_id, offset, limit)
+
+    def get_recent_messages(self, character_id: str, n: int) -> List[Dict]:
+        with self._lock:
+            if n <= 0 or self._load(character_id) is None:
+                return []
+            tail = self._tail(character_id)
+            if n <= len(tail) or len(tail) == self._counts[character_id]:
+                return [m.to_dict() for m in tail[-n:]]
+            self._flush_character(character_id)
+            return self.backend.get_recent_messages(character_id, n)
+
+    def iter_messages(self, character_id: str, batch_size: int = 500) -> Iterator[List[Dict]]:
+        # 先写回该角色的待写数据，再由底层存储按批读取（SQLite 后端在同一个读事务中读完）
+        with self._lock:
+            if self._load(character_id) is None:
+                return
+            self._flush_character(character_id)
+        yield from self.backend.iter_messages(character_id, batch_size)
+
+    def append_messages(self, character_id: str, messages: List[Dict]) -> List[Dict]:
+        with self._lock:
+            if not messages or self._load(character_id) is None:
+                return []
+            tail = self._tail(character_id)
+            # 序号在缓存中预先分配，写回时底层存储保留原值
+            seq = self._last_seqs[character_id]
+            numbered = []
+            for message in messages:
+                if "seq" not in message:
+                    seq += 1
+                    message = {**message, "seq": seq}
+                seq = max(seq, message["seq"])
+                numbered.append(message)
+            self._last_seqs[character_id] = seq
+            # 缓存和待写队列共用同一批 Message 对象
+            compact = [Message.from_dict(m) for m in numbered]
+            tail.extend(compact)
+            if len(tail) > HOT_WINDOW:
+                del tail[:-HOT_WINDOW]
+            self._counts[character_id] += len(compact)
+
+            self._pending.setdefault(character_id, []).extend(compact)
+            self._pending_count += len(compact)
+            if self._pending_count >= self.flush_threshold:
+                self.flush()
+            return [m.to_dict() for m in compact]
+
+    def get_stats(self, character_id: str) -> Dict:
+        with self._lock:
+            # 统计由底层存储维护，先写回待写的消息
+            self._flush_character(character_id)
+            return self.backend.get_stats(character_id)
+
+    def clear_messages(self, character_id: str):
+        with self._lock:
+            self._flush_character(character_id)
+            self.backend.clear_messages(character_id)
+            self._tails[character_id] = []
+            self._counts[character_id] = 0
+
+    def delete_message(self, character_id: str, seq: int) -> Optional[Dict]:
+        with self._lock:
+            self._flush_character(character_id)
+            deleted = self.backend.delete_message(character_id, seq)
+            if deleted is not None and character_id in self._tails:
+                tail = [m for m in self._tails[character_id] if m.seq != seq]
+                self._tails[character_id] = tail
+                self._counts[character_id] -= 1
+                if not tail and self._counts[character_id] > 0:
+                    # 缓存的最近记录被删光但更早的还在：下次读取时重新加载
+                    self._drop_history(character_id)
+            return deleted
+
+    def compact_messages(self, character_id: str) -> int:
+        with self._lock:
+            # 压实不改变逻辑位置，缓存的最近记录仍然有效
+            return self.backend.compact_messages(character_id)
+
+    def characters_to_compact(self, threshold: int) -> List[str]:
+        with self._lock:
+            return self.backend.characters_to_compact(threshold)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+
+async def flush_periodically(store: CachedCharacterStore, interval: float):
+    """定时写回缓存中的脏数据"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"写回角色缓存失败: {e}")
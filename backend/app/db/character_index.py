@@ -0,0 +1,101 @@
+import os
+import json
+import threading
+from typing import Dict, List, Optional, Set
+
+from app.db.atomic import atomic_write_bytes
+from app.db.repository import owner_of
+
+
+class CharacterIndex:
+    """
+    角色元数据索引（JSON 后端）
+
+    列表接口需要的字段常驻内存，持久化为只追加的 JSONL：
+    每行是 {"id": ..., 字段...} 的增量更新，或 {"id": ..., "deleted": true}。
+    启动时按顺序回放；冗余行过多时整体压缩重写一次。
+    内存中按所属用户（owner_id）分区，列出某个用户的角色只访问该分区。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._owners: Dict[str, Set[str]] = {}
+        self._lines = 0
+        self._load()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _load(self):
+        if not self.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时写了一半的最后一行
+                    continue
+                self._apply(record)
+                self._lines += 1
+
+        if self._lines > 2 * len(self._entries) + 100:
+            self.compact()
+
+    def _apply(self, record: Dict):
+        character_id = record["id"]
+        entry = self._entries.get(character_id)
+        if entry is not None:
+            self._owners[owner_of(entry)].discard(character_id)
+        if record.get("deleted"):
+            self._entries.pop(character_id, None)
+            return
+        entry = self._entries.setdefault(character_id, {})
+        entry.update(record)
+        self._owners.setdefault(owner_of(entry), set()).add(character_id)
+
+    def _append(self, record: Dict):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._lines += 1
+
+    def put(self, entry: Dict):
+        """新增或更新条目（只写入变化的字段）"""
+        with self._lock:
+            current = self._entries.get(entry["id"], {})
+            changed = {k: v for k, v in entry.items() if k not in current or current[k] != v}
+            if not changed:
+                return
+            changed["id"] = entry["id"]
+            self._apply(changed)
+            self._append(changed)
+
+    def remove(self, character_id: str):
+        """删除条目"""
+        with self._lock:
+            if character_id not in self._entries:
+                return
+            record = {"id": character_id, "deleted": True}
+            self._apply(record)
+            self._append(record)
+
+    def get(self, character_id: str) -> Optional[Dict]:
+        """读取单个条目"""
+        with self._lock:
+            entry = self._entries.get(character_id)
+            return dict(entry) if entry is not None else None
+
+    def list(self, owner_id: str) -> List[Dict]:
+        """某个用户的条目（按创建时间排序）"""
+        with self._lock:
+            entries = [dict(self._entries[i]) for i in self._owners.get(owner_id, ())]
+        entries.sort(key=lambda e: e.get("created_at", ""))
+        return entries
+
+    def compact(self):
+        """只保留每个角色的最新状态，重写索引文件"""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self._entries.values())
+        atomic_write_bytes(self.path, data.encode('utf-8'))
+        self._lines = len(self._entries)
@@ -0,0 +1,65 @@
+from typing import Dict, Iterable, Optional
+
+
+def message_day(message: Dict) -> Optional[str]:
+    """消息所在日期（时间戳的前 10 位），没有时间戳时返回 None"""
+    timestamp = message.get("timestamp")
+    return timestamp[:10] if timestamp else None
+
+
+def empty_stats() -> Dict:
+    """
+    空的聊天统计聚合
+
+    - roles：各角色的消息条数
+    - characters：总字数
+    - days：每天的消息条数（删除消息时递减，减到 0 即移除该日期）
+    """
+    return {"roles": {}, "characters": 0, "days": {}}
+
+
+def add_messages(stats: Dict, messages: Iterable[Dict], sign: int = 1):
+    """把消息计入统计；sign 为 -1 时从统计中扣除"""
+    roles = stats["roles"]
+    days = stats["days"]
+    for message in messages:
+        role = message.get("role", "")
+        roles[role] = roles.get(role, 0) + sign
+        if roles[role] <= 0:
+            del roles[role]
+        stats["characters"] += sign * len(message.get("content") or "")
+        day = message_day(message)
+        if day:
+            days[day] = days.get(day, 0) + sign
+            if days[day] <= 0:
+                del days[day]
+
+
+def remove_message(stats: Dict, message: Dict):
+    """从统计中扣除一条消息"""
+    add_messages(stats, [message], -1)
+
+
+def format_stats(role_counts: Dict[str, int], total_characters: int,
+                 chat_days: int, first_day: Optional[str], last_day: Optional[str]) -> Dict:
+    """统计接口的返回格式"""
+    return {
+        "total_messages": sum(role_counts.values()),
+        "user_messages": role_counts.get("user", 0),
+        "assistant_messages": role_counts.get("assistant", 0),
+        "total_characters": total_characters,
+        "chat_days": chat_days,
+        "date_range": {
+            "start": first_day,
+            "end": last_day
+        } if chat_days else None
+    }
+
+
+def summarize(stats: Dict) -> Dict:
+    """把聚合数据转换为统计接口的返回格式"""
+    days = stats["days"]
+    return format_stats(
+        stats["roles"], stats["characters"], len(days),
+        min(days) if days else None, max(days) if days else None
+    )
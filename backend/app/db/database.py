@@ -1,13 +1,160 @@
 import os
-import json
+import asyncio
+from typing import Optional
+
+from app.db.repository import CharacterStore, UserStore
+from app.db.json_stream import iter_items
 
 DATA_DIR = "data"
+# 旧版单文件存储，仅用于迁移
 CHARACTERS_FILE = os.path.join(DATA_DIR, "characters.json")
+# 按角色分片的存储目录（JSON 后端）
+CHARACTERS_DIR = os.path.join(DATA_DIR, "characters")
+# 聊天记录日志目录（JSON 后端）
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+# 用户数据，与 auth 模块原来的做法一致使用绝对路径
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 旧版单文件用户数据，仅用于迁移
+USERS_FILE = os.path.join(BACKEND_DIR, "data", "users.json")
+# 按用户分片的存储目录（JSON 后端）
+USERS_DIR = os.path.join(BACKEND_DIR, "data", "users")
+
+# 存储后端：json（开发用）或 sqlite（生产用）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR, "soulecho.db"))
+
+# 写回缓存配置
+STORAGE_CACHE = os.getenv("STORAGE_CACHE", "true").lower() in ("1", "true", "yes")
+CACHE_FLUSH_INTERVAL = float(os.getenv("CACHE_FLUSH_INTERVAL", "1.0"))  # 秒
+CACHE_FLUSH_THRESHOLD = int(os.getenv("CACHE_FLUSH_THRESHOLD", "200"))  # 待写消息条数
+CACHE_MAX_CHARACTERS = int(os.getenv("CACHE_MAX_CHARACTERS", "1000"))
+
+# 删除标记压实配置：累积到阈值条数的角色由后台任务定时重写聊天记录
+COMPACT_THRESHOLD = int(os.getenv("COMPACT_THRESHOLD", "50"))
+COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "60"))  # 秒
+
+_character_store: Optional[CharacterStore] = None
+_user_store: Optional[UserStore] = None
+_sqlite_db = None
+
+
+def _get_sqlite_db():
+    global _sqlite_db
+    if _sqlite_db is None:
+        from app.db.sqlite_store import SqliteDatabase
+        _sqlite_db = SqliteDatabase(SQLITE_PATH)
+    return _sqlite_db
+
+
+def get_character_store() -> CharacterStore:
+    """获取角色存储单例"""
+    global _character_store
+    if _character_store is None:
+        if STORAGE_BACKEND == "sqlite":
+            from app.db.sqlite_store import SqliteCharacterStore
+            _character_store = SqliteCharacterStore(_get_sqlite_db())
+        else:
+            from app.db.json_store import JsonCharacterStore
+            _character_store = JsonCharacterStore(CHARACTERS_DIR, HISTORY_DIR)
+
+        if STORAGE_CACHE:
+            from app.db.cache import CachedCharacterStore
+            _character_store = CachedCharacterStore(
+                _character_store,
+                flush_threshold=CACHE_FLUSH_THRESHOLD,
+                max_characters=CACHE_MAX_CHARACTERS
+            )
+    return _character_store
+
+
+def get_user_store() -> UserStore:
+    """获取用户存储单例"""
+    global _user_store
+    if _user_store is None:
+        if STORAGE_BACKEND == "sqlite":
+            from app.db.sqlite_store import SqliteUserStore
+            _user_store = SqliteUserStore(_get_sqlite_db())
+        else:
+            from app.db.json_store import JsonUserStore
+            _user_store = JsonUserStore(USERS_DIR)
+    return _user_store
+
+
+def _migrate_legacy_characters(store: CharacterStore):
+    """把旧版 characters.json 导入当前存储后端"""
+    if not os.path.exists(CHARACTERS_FILE):
+        return
+
+    # 逐个角色流式解析，不把整个文件读入内存（大文件建议先用 python -m app.db.migrate 迁移）
+    for _, character in iter_items(CHARACTERS_FILE):
+        if store.exists(character["id"]):
+            continue
+        store.save(character)
+        store.append_messages(character["id"], character.get("chat_history", []))
+
+    # 迁移完成后改名，避免下次启动重复导入
+    os.replace(CHARACTERS_FILE, CHARACTERS_FILE + ".migrated")
+
+
+def _migrate_legacy_users(store: UserStore):
+    """把旧版 users.json 导入当前存储后端"""
+    if not os.path.exists(USERS_FILE):
+        return
+
+    for _, user in iter_items(USERS_FILE):
+        if store.get(user["id"]) or store.get_by_username(user["username"]) or store.get_by_email(user["email"]):
+            continue
+        store.create(user)
+
+    # 迁移完成后改名，避免下次启动重复导入
+    os.replace(USERS_FILE, USERS_FILE + ".migrated")
 
 
 def init_db():
     """初始化数据库"""
     os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(CHARACTERS_FILE):
-        with open(CHARACTERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f, ensure_ascii=False)
+    _migrate_legacy_characters(get_character_store())
+    _migrate_legacy_users(get_user_store())
+
+    # 旧版按角色命名的聊天图片登记到内容寻址的媒体存储
+    from app.db.media import get_media_store
+    get_media_store().import_legacy(os.path.join("static", "images"), "image")
+
+
+async def run_cache_flusher():
+    """后台定时写回角色缓存（未启用缓存时直接返回）"""
+    from app.db.cache import CachedCharacterStore, flush_periodically
+    store = get_character_store()
+    if isinstance(store, CachedCharacterStore):
+        await flush_periodically(store, CACHE_FLUSH_INTERVAL)
+
+
+async def run_compactor():
+    """后台定时压实删除标记较多的角色的聊天记录"""
+    from app.db.locks import character_lock
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        store = get_character_store()
+        try:
+            character_ids = store.characters_to_compact(COMPACT_THRESHOLD)
+        except Exception as e:
+            print(f"查询待压实角色失败: {e}")
+            continue
+        for character_id in character_ids:
+            # 与追加、删除消息互斥；重写文件在线程池中进行，不阻塞事件循环
+            async with character_lock(character_id):
+                try:
+                    await asyncio.to_thread(store.compact_messages, character_id)
+                except Exception as e:
+                    print(f"压实聊天记录失败: {e}")
+
+
+def close_db():
+    """写回缓存并关闭数据库连接"""
+    global _character_store, _user_store, _sqlite_db
+    for store in (_character_store, _user_store):
+        if store is not None:
+            store.close()
+    _character_store = None
+    _user_store = None
+    _sqlite_db = None
@@ -0,0 +1,152 @@
+import os
+import json
+import struct
+from typing import Dict, List, Set
+
+from app.db.atomic import atomic_write_bytes
+
+# 索引文件中每条记录的偏移量占 8 字节（小端无符号整数）
+_OFFSET = struct.Struct("<Q")
+
+
+class HistoryLog:
+    """
+    只追加的聊天记录日志
+
+    每个 key（角色）对应两个文件：
+    - {key}.jsonl：每行一条 JSON 记录，只在末尾追加
+    - {key}.idx：定长偏移索引，第 i 条记录的起始偏移位于 i * 8 处
+
+    追加一轮对话只需一次文件末尾写入；按位置读取只需在索引中定位后 seek，
+    不需要解析整个文件。
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        # 本进程内已校验过索引一致性的 key
+        self._checked: Set[str] = set()
+
+    def _log_path(self, key: str) -> str:
+        return os.path.join(self.base_dir, f"{key}.jsonl")
+
+    def _idx_path(self, key: str) -> str:
+        return os.path.join(self.base_dir, f"{key}.idx")
+
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _rebuild_index(self, key: str):
+        """扫描日志重建索引，并截掉末尾写了一半的记录"""
+        offsets = []
+        valid_size = 0
+        with open(self._log_path(key), "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offsets.append(valid_size)
+                valid_size += len(line)
+        with open(self._log_path(key), "r+b") as f:
+            f.truncate(valid_size)
+        atomic_write_bytes(self._idx_path(key), b"".join(_OFFSET.pack(o) for o in offsets))
+
+    def _check(self, key: str):
+        """首次访问时校验索引与日志是否一致（进程崩溃可能只写了其中一个）"""
+        if key in self._checked:
+            return
+        log_path = self._log_path(key)
+        if os.path.exists(log_path):
+            idx_size = os.path.getsize(self._idx_path(key)) if os.path.exists(self._idx_path(key)) else 0
+            log_size = os.path.getsize(log_path)
+            consistent = idx_size % _OFFSET.size == 0
+            if consistent and idx_size:
+                with open(self._idx_path(key), "rb") as f:
+                    f.seek(idx_size - _OFFSET.size)
+                    last_offset = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+                with open(log_path, "rb") as f:
+                    f.seek(last_offset)
+                    last_line = f.readline()
+                consistent = last_line.endswith(b"\n") and last_offset + len(last_line) == log_size
+            elif consistent:
+                consistent = log_size == 0
+            if not consistent:
+                self._rebuild_index(key)
+        self._checked.add(key)
+
+    def count(self, key: str) -> int:
+        """记录条数"""
+        self._check(key)
+        idx_path = self._idx_path(key)
+        if not os.path.exists(idx_path):
+            return 0
+        return os.path.getsize(idx_path) // _OFFSET.size
+
+    def read(self, key: str, start: int, end: int) -> List[Dict]:
+        """读取第 [start, end) 条记录"""
+        total = self.count(key)
+        start = max(start, 0)
+        end = min(end, total)
+        if start >= end:
+            return []
+
+        # 多读一个偏移量作为结束位置，最后一条记录则读到文件末尾
+        n_offsets = end - start + (1 if end < total else 0)
+        with open(self._idx_path(key), "rb") as f:
+            f.seek(start * _OFFSET.size)
+            raw = f.read(n_offsets * _OFFSET.size)
+        offsets = [o[0] for o in _OFFSET.iter_unpack(raw)]
+
+        with open(self._log_path(key), "rb") as f:
+            f.seek(offsets[0])
+            if end < total:
+                data = f.read(offsets[-1] - offsets[0])
+            else:
+                data = f.read()
+
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    def append(self, key: str, records: List[Dict]):
+        """在日志末尾追加记录"""
+        if not records:
+            return
+        self._check(key)
+        with open(self._log_path(key), "ab") as log_file:
+            offset = log_file.tell()
+            offsets = []
+            chunks = []
+            for record in records:
+                encoded = self._encode(record)
+                offsets.append(offset)
+                chunks.append(encoded)
+                offset += len(encoded)
+            log_file.write(b"".join(chunks))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        # 先落盘日志再写索引，崩溃时最多丢失索引尾部，可由 _check 重建
+        with open(self._idx_path(key), "ab") as idx_file:
+            idx_file.write(b"".join(_OFFSET.pack(o) for o in offsets))
+            idx_file.flush()
+            os.fsync(idx_file.fileno())
+
+    def rewrite(self, key: str, records: List[Dict]):
+        """用给定记录整体替换日志（用于截断和删除）"""
+        offsets = []
+        chunks = []
+        offset = 0
+        for record in records:
+            encoded = self._encode(record)
+            offsets.append(offset)
+            chunks.append(encoded)
+            offset += len(encoded)
+
+        atomic_write_bytes(self._log_path(key), b"".join(chunks))
+        atomic_write_bytes(self._idx_path(key), b"".join(_OFFSET.pack(o) for o in offsets))
+        self._checked.add(key)
+
+    def delete(self, key: str):
+        """删除日志和索引"""
+        for path in (self._log_path(key), self._idx_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._checked.discard(key)
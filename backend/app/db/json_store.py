@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Set
+
+from app.db.repository import CharacterStore, UserStore, DuplicateUserError, make_summary, owner_of
+from app.db.tiered_history import TieredHistory
+from app.db.character_index import CharacterIndex
+from app.db.atomic import atomic_write_bytes, atomic_write_json
+from app.db.chat_stats import empty_stats, add_messages, remove_message, summarize
+
+# 角色ID只允许字母、数字、下划线和短横线，防止路径穿越
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def is_valid_id(record_id: str) -> bool:
+    """检查ID能否安全地用作文件名"""
+    return bool(record_id) and bool(_ID_PATTERN.match(record_id))
+
+
+class JsonCharacterStore(CharacterStore):
+    """
+    按角色分片的 JSON 存储，适合开发环境
+
+    角色资料存放在 {base_dir}/{id}.json，聊天记录存放在分层存储中（只追加的热日志
+    加压缩的冷数据段），追加一轮对话不会重写角色资料或已有记录。列表从 {base_dir}/_index.jsonl
+    元数据索引读取（按所属用户分区），不打开各个角色文件。聊天统计的聚合数据存放在 {base_dir}/_stats/{id}.json，
+    随追加和删除增量更新。删除消息只追加删除标记，由后台任务压实。
+    """
+
+    def __init__(self, base_dir: str, history_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self.history = TieredHistory(history_dir)
+        self.index = CharacterIndex(os.path.join(base_dir, "_index.jsonl"))
+        # 本进程内已确认聊天记录带有序号的角色
+        self._seq_checked: Set[str] = set()
+        self.stats_dir = os.path.join(base_dir, "_stats")
+        os.makedirs(self.stats_dir, exist_ok=True)
+        self._stats: Dict[str, Dict] = {}
+        self._migrate_embedded_history()
+        if not self.index.exists():
+            self._rebuild_index()
+        self.history.load_tombstones()
+
+    def _path(self, character_id: str) -> str:
+        return os.path.join(self.base_dir, f"{character_id}.json")
+
+    def _dump(self, data: Dict):
+        atomic_write_json(self._path(data["id"]), data)
+
+    def exists(self, character_id: str) -> bool:
+        return is_valid_id(character_id) and os.path.exists(self._path(character_id))
+
+    def get(self, character_id: str) -> Optional[Dict]:
+        if not self.exists(character_id):
+            return None
+        with open(self._path(character_id), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # 内嵌的旧格式聊天记录在创建存储时已经迁移，读取没有副作用
+        data.pop("chat_history", None)
+        return data
+
+    def _migrate_embedded_history(self):
+        """
+        旧格式把聊天记录内嵌在角色文件中，创建存储时（启动阶段，还没有并发请求）一次性迁移到分层存储
+
+        迁移完成后写入标记文件，之后启动不再扫描角色文件。每个角色先写聊天记录再重写角色文件，
+        中途崩溃时下次启动重新迁移该角色（先删除已写入的部分）。
+        """
+        marker = os.path.join(self.base_dir, "_history_migrated")
+        if os.path.exists(marker):
+            return
+        for filename in os.listdir(self.base_dir):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(self.base_dir, filename), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if "chat_history" not in data:
+                continue
+            history = data.pop("chat_history")
+            self.history.delete(data["id"])
+            self.history.append(data["id"], [{**m, "seq": i + 1} for i, m in enumerate(history)])
+            self._dump(data)
+        atomic_write_bytes(marker, b"")
+
+    def _rebuild_index(self):
+        """扫描所有角色文件重建元数据索引（索引文件缺失时）"""
+        for filename in os.listdir(self.base_dir):
+            if not filename.endswith(".json"):
+                continue
+            character_id = filename[:-len(".json")]
+            character = self.get(character_id)
+            if character is None:
+                continue
+            entry = make_summary(character)
+            last = self.get_recent_messages(character_id, 1)
+            entry["last_active_at"] = last[0].get("timestamp") if last else None
+            self.index.put(entry)
+        self.index.compact()
+
+    def get_owner(self, character_id: str) -> Optional[str]:
+        entry = self.index.get(character_id)
+        return owner_of(entry) if entry is not None else None
+
+    def list_summaries(self, owner_id: str) -> List[Dict]:
+        return [
+            {**make_summary(entry), "last_active_at": entry.get("last_active_at")}
+            for entry in self.index.list(owner_id)
+        ]
+
+    def save(self, character: Dict):
+        character_id = character["id"]
+        if not is_valid_id(character_id):
+            raise ValueError(f"非法的角色ID: {character_id}")
+        self._dump({k: v for k, v in character.items() if k != "chat_history"})
+        self.index.put(make_summary(character))
+
+    def delete(self, character_id: str) -> bool:
+        if not self.exists(character_id):
+            return False
+        os.remove(self._path(character_id))
+        self.history.delete(character_id)
+        self.index.remove(character_id)
+        self._seq_checked.discard(character_id)
+        self._stats.pop(character_id, None)
+        if os.path.exists(self._stats_path(character_id)):
+            os.remove(self._stats_path(character_id))
+        return True
+
+    def _ensure_seq(self, character_id: str):
+        """旧版记录没有序号，首次访问时按顺序补齐，并把最大序号记入元数据索引"""
+        if character_id in self._seq_checked:
+            return
+        last = self.history.read_recent(character_id, 1)
+        if last and "seq" not in last[0]:
+            records = self.history.read(character_id, 0, self.history.count(character_id))
+            self.history.rewrite(character_id, [{**r, "seq": i + 1} for i, r in enumerate(records)])
+            last = self.history.read_recent(character_id, 1)
+        entry = self.index.get(character_id) or {}
+        if "last_seq" not in entry:
+            self.index.put({"id": character_id, "last_seq": last[0]["seq"] if last else 0})
+        self._seq_checked.add(character_id)
+
+    def last_seq(self, character_id: str) -> int:
+        if not self.exists(character_id):
+            return 0
+        self._ensure_seq(character_id)
+        # 追加记录后、写入索引前崩溃时，以日志中的最后一条为准
+        last = self.history.read_recent(character_id, 1)
+        return max(self.index.get(character_id).get("last_seq", 0), last[0]["seq"] if last else 0)
+
+    def seq_position(self, character_id: str, seq: int) -> int:
+        if not self.exists(character_id):
+            return 0
+        self._ensure_seq(character_id)
+        return self.history.position_of_seq(character_id, seq)
+
+    def count_messages(self, character_id: str) -> int:
+        if not self.exists(character_id):
+            return 0
+        return self.history.count(character_id)
+
+    def get_messages(self, character_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        if not self.exists(character_id):
+            return []
+        self._ensure_seq(character_id)
+        end = self.history.count(character_id) if limit is None else offset + limit
+        return self.history.read(character_id, offset, end)
+
+    def get_recent_messages(self, character_id: str, n: int) -> List[Dict]:
+        if n <= 0 or not self.exists(character_id):
+            return []
+        self._ensure_seq(character_id)
+        return self.history.read_recent(character_id, n)
+
+    def _stats_path(self, character_id: str) -> str:
+        return os.path.join(self.stats_dir, f"{character_id}.json")
+
+    def _load_stats(self, character_id: str) -> Dict:
+        """读取统计聚合；与聊天记录对不上时（写入记录后、更新统计前崩溃）全量重建"""
+        stats = self._stats.get(character_id)
+        if stats is not None:
+            return stats
+
+        if os.path.exists(self._stats_path(character_id)):
+            with open(self._stats_path(character_id), 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+        count = self.history.count(character_id)
+        if (stats is None or sum(stats["roles"].values()) != count
+                or stats.get("last_seq") != self.last_seq(character_id)):
+            stats = empty_stats()
+            add_messages(stats, self.history.read(character_id, 0, count))
+            stats["last_seq"] = self.last_seq(character_id)
+            atomic_write_json(self._stats_path(character_id), stats)
+        self._stats[character_id] = stats
+        return stats
+
+    def _save_stats(self, character_id: str, stats: Dict):
+        stats["last_seq"] = self.last_seq(character_id)
+        atomic_write_json(self._stats_path(character_id), stats)
+
+    def get_stats(self, character_id: str) -> Dict:
+        if not self.exists(character_id):
+            return summarize(empty_stats())
+        return summarize(self._load_stats(character_id))
+
+    def append_messages(self, character_id: str, messages: List[Dict]) -> List[Dict]:
+        if not messages or not self.exists(character_id):
+            return []
+        # 先加载统计，避免把本次追加的记录算两次
+        stats = self._load_stats(character_id)
+        seq = self.last_seq(character_id)
+        records = []
+        for message in messages:
+            if "seq" not in message:
+                seq += 1
+                message = {**message, "seq": seq}
+            seq = max(seq, message["seq"])
+            records.append(message)
+        self.history.append(character_id, records)
+        self.index.put({
+            "id": character_id,
+            "last_active_at": records[-1].get("timestamp"),
+            "last_seq": seq,
+        })
+        add_messages(stats, records)
+        self._save_stats(character_id, stats)
+        return records
+
+    def _pin_last_seq(self, character_id: str):
+        """删除记录前把当前最大序号写入索引，保证序号不回退"""
+        self.index.put({"id": character_id, "last_seq": self.last_seq(character_id)})
+
+    def clear_messages(self, character_id: str):
+        if not self.exists(character_id):
+            return
+        self._pin_last_seq(character_id)
+        self.history.delete(character_id)
+        self._stats[character_id] = empty_stats()
+        self._save_stats(character_id, self._stats[character_id])
+
+    def delete_message(self, character_id: str, seq: int) -> Optional[Dict]:
+        if not self.exists(character_id):
+            return None
+        self._ensure_seq(character_id)
+        stats = self._load_stats(character_id)
+        deleted = self.history.delete_seq(character_id, seq)
+        if deleted is not None:
+            remove_message(stats, deleted)
+            self._save_stats(character_id, stats)
+        return deleted
+
+    def compact_messages(self, character_id: str) -> int:
+        if not self.exists(character_id):
+            return 0
+        self._pin_last_seq(character_id)
+        return self.history.compact(character_id)
+
+    def characters_to_compact(self, threshold: int) -> List[str]:
+        # 删除标记在角色首次被访问时加载，重启后未访问过的角色等下次删除时再压实
+        return self.history.compacting_keys(threshold)
+
+
+class JsonUserStore(UserStore):
+    """
+    按用户分片的 JSON 用户存储，适合开发环境
+
+    每个用户存放在 {base_dir}/{id}.json；用户名和邮箱的唯一索引保存在只追加的
+    {base_dir}/_index.jsonl 中，启动时加载到内存，查找为 O(1)，注册只追加一行。
+    """
+
+    INDEX_FILE = "_index.jsonl"
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._by_username: Dict[str, str] = {}
+        self._by_email: Dict[str, str] = {}
+        self._load_index()
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.base_dir, f"{user_id}.json")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.base_dir, self.INDEX_FILE)
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return
+        with open(self._index_path(), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时写了一半的最后一行
+                    continue
+                # 用户文件不存在说明注册没有完成，忽略这条索引
+                if os.path.exists(self._path(entry["id"])):
+                    self._by_username[entry["username"]] = entry["id"]
+                    self._by_email[entry["email"]] = entry["id"]
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        if not is_valid_id(user_id) or not os.path.exists(self._path(user_id)):
+            return None
+        with open(self._path(user_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_by_username(self, username: str) -> Optional[Dict]:
+        user_id = self._by_username.get(username)
+        return self.get(user_id) if user_id else None
+
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        user_id = self._by_email.get(email)
+        return self.get(user_id) if user_id else None
+
+    def create(self, user: Dict):
+        if not is_valid_id(user["id"]):
+            raise ValueError(f"非法的用户ID: {user['id']}")
+        with self._lock:
+            if user["username"] in self._by_username:
+                raise DuplicateUserError("username")
+            if user["email"] in self._by_email:
+                raise DuplicateUserError("email")
+
+            atomic_write_json(self._path(user["id"]), user)
+            entry = {"id": user["id"], "username": user["username"], "email": user["email"]}
+            with open(self._index_path(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._by_username[user["username"]] = user["id"]
+            self._by_email[user["email"]] = user["id"]
@@ -0,0 +1,78 @@
+import re
+import json
+from typing import Any, Iterator, TextIO, Tuple
+
+# 每次从文件读取的字符数；单个值超出缓冲区时按倍数扩大
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class _Reader:
+    """带缓冲的 JSON 文本读取，已解析的部分在下次读取时丢弃"""
+
+    def __init__(self, f: TextIO, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _read_more(self, size: int) -> bool:
+        chunk = self.f.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._read_more(self.chunk_size):
+                return
+
+    def peek(self) -> str:
+        """跳过空白后的下一个字符，文件结束时返回空字符串"""
+        self._skip_whitespace()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"JSON 格式错误：位置 {self.pos} 处应为 {char!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """解析下一个完整的 JSON 值，缓冲区不够时继续读取"""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # 每次至少读入与当前缓冲区等量的数据，避免大值被反复从头解析
+                if not self._read_more(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def iter_items(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    逐个读取顶层 JSON 对象的键值对
+
+    旧版 characters.json / users.json 是 {id: 记录} 的大对象，这里每次只解析一条记录，
+    内存占用取决于单条记录的大小，与文件大小无关。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            yield key, reader.value()
+            if reader.peek() == "}":
+                return
+            reader.expect(",")
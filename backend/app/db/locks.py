@@ -0,0 +1,19 @@
+import asyncio
+from weakref import WeakValueDictionary
+
+# 每个角色一把锁；没有协程持有时由垃圾回收自动清理
+_character_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+def character_lock(character_id: str) -> asyncio.Lock:
+    """
+    获取角色的异步锁
+
+    只在读-改-写存储的短暂区间内持有，不要在持锁期间等待 AI 生成，
+    这样不同角色的请求互不阻塞，同一角色的写入也不会相互覆盖。
+    """
+    lock = _character_locks.get(character_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _character_locks[character_id] = lock
+    return lock
@@ -0,0 +1,262 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+
+from app.db.atomic import atomic_write_bytes
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 媒体文件按内容哈希存放在 {MEDIA_DIR}/{哈希前两位}/{哈希}.{扩展名}，通过 /media/ 访问
+MEDIA_DIR = "static/media"
+os.makedirs(MEDIA_DIR, exist_ok=True)
+MEDIA_URL_PREFIX = "/media/"
+
+# 引用表数据库（与角色存储后端无关）
+MEDIA_DB_PATH = os.getenv("MEDIA_DB_PATH", os.path.join("data", "media.db"))
+
+# 垃圾回收：没有引用且超过 MEDIA_GC_GRACE 秒未被上传或引用的文件，每隔 MEDIA_GC_INTERVAL 秒清理一次；
+# 宽限期用于创建角色前上传的头像（此时还没有角色引用它）
+MEDIA_GC_INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", "3600"))
+MEDIA_GC_GRACE = float(os.getenv("MEDIA_GC_GRACE", "86400"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+
+-- kind：avatar（角色头像）、image（角色图库）、message（聊天消息中的图片，ref_id 为 "{分支}:{序号}"）
+CREATE TABLE IF NOT EXISTS media_refs (
+    hash TEXT NOT NULL,
+    character_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ref_id TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (hash, character_id, kind, ref_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_refs_character ON media_refs (character_id, kind);
+
+-- 一次性任务的完成标记
+CREATE TABLE IF NOT EXISTS media_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def media_url(content_hash: str, ext: str) -> str:
+    return f"{MEDIA_URL_PREFIX}{content_hash[:2]}/{content_hash}.{ext}"
+
+
+def hash_of_url(url: Optional[str]) -> Optional[str]:
+    """从媒体地址中取出内容哈希，不是内容寻址的地址（旧版头像、图片等）返回 None"""
+    if not url or not url.startswith(MEDIA_URL_PREFIX):
+        return None
+    name = os.path.basename(url)
+    content_hash = name.split(".", 1)[0]
+    if len(content_hash) != 64 or url != media_url(content_hash, name.split(".", 1)[-1]):
+        return None
+    return content_hash
+
+
+class MediaStore:
+    """
+    内容寻址的媒体存储
+
+    上传的文件以 SHA-256 命名，写入前先查哈希，相同内容只保存一份；文件内容不可变，
+    地址可以永久缓存。角色头像、图库和聊天消息对文件的引用记在 media_refs 中，
+    没有引用的文件由 collect_garbage() 删除。
+    """
+
+    def __init__(self, path: str = MEDIA_DB_PATH, media_dir: str = MEDIA_DIR):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.media_dir = media_dir
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def _path(self, content_hash: str, ext: str) -> str:
+        return os.path.join(self.media_dir, content_hash[:2], f"{content_hash}.{ext}")
+
+    # ============ 文件 ============
+
+    def _store(self, content_hash: str, ext: str, size: int, write: Callable[[str], None]) -> str:
+        """相同内容不存在时调用 write(目标路径) 写入文件，登记后返回地址"""
+        path = self._path(content_hash, ext)
+        with self._lock:
+            row = self.conn.execute("SELECT ext FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            if row is not None and os.path.exists(self._path(content_hash, row[0])):
+                ext = row[0]
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write(path)
+            self.conn.execute(
+                "INSERT INTO blobs (hash, ext, size, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO UPDATE SET ext = excluded.ext, last_used = excluded.last_used",
+                (content_hash, ext, size, time.time())
+            )
+        return media_url(content_hash, ext)
+
+    def put(self, content: bytes, ext: str) -> str:
+        """保存文件并返回地址；相同内容已存在时不再写入"""
+        content_hash = hashlib.sha256(content).hexdigest()
+        return self._store(content_hash, ext, len(content), lambda path: atomic_write_bytes(path, content))
+
+    def put_file(self, source: str, ext: str) -> str:
+        """
+        登记已有的文件并返回地址；相同内容已存在时不再写入
+
+        通过硬链接放到内容寻址路径，不复制数据；文件系统不支持硬链接时退回到复制。
+        """
+        sha = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+
+        def link(path: str):
+            try:
+                os.link(source, path)
+            except FileExistsError:
+                # 上次写入后崩溃在登记之前，文件内容与哈希一致，直接登记
+                pass
+            except OSError:
+                with open(source, 'rb') as f:
+                    atomic_write_bytes(path, f.read())
+
+        return self._store(sha.hexdigest(), ext, os.path.getsize(source), link)
+
+    # ============ 引用 ============
+
+    def add_ref(self, url: Optional[str], character_id: str, kind: str, ref_id: str = ""):
+        """记录引用（不是内容寻址的地址时忽略）"""
+        content_hash = hash_of_url(url)
+        if content_hash is None:
+            return
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO media_refs (hash, character_id, kind, ref_id) VALUES (?, ?, ?, ?)",
+                (content_hash, character_id, kind, ref_id)
+            )
+            self.conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (time.time(), content_hash))
+
+    def remove_ref(self, url: Optional[str], character_id: str, kind: str, ref_id: str = "") -> bool:
+        """删除引用，返回引用是否存在；文件由垃圾回收删除"""
+        content_hash = hash_of_url(url)
+        if content_hash is None:
+            return False
+        with self._lock:
+            cursor = self.conn.execute(
+                "DELETE FROM media_refs WHERE hash = ? AND character_id = ? AND kind = ? AND ref_id = ?",
+                (content_hash, character_id, kind, ref_id)
+            )
+        return cursor.rowcount > 0
+
+    def remove_refs(self, character_id: str, kind: Optional[str] = None):
+        """删除角色的全部引用（某一类或所有类）"""
+        with self._lock:
+            if kind is None:
+                self.conn.execute("DELETE FROM media_refs WHERE character_id = ?", (character_id,))
+            else:
+                self.conn.execute(
+                    "DELETE FROM media_refs WHERE character_id = ? AND kind = ?", (character_id, kind)
+                )
+
+    def list_refs(self, character_id: str, kind: str) -> List[Dict]:
+        """角色某一类引用的文件 [{"url", "filename"}]，只查引用表，不扫描目录"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT b.hash, b.ext FROM media_refs r JOIN blobs b ON b.hash = r.hash "
+                "WHERE r.character_id = ? AND r.kind = ? ORDER BY r.rowid",
+                (character_id, kind)
+            ).fetchall()
+        urls = [media_url(content_hash, ext) for content_hash, ext in rows]
+        return [{"url": url, "filename": os.path.basename(url)} for url in urls]
+
+    def import_legacy(self, directory: str, kind: str):
+        """
+        把旧版按 "{角色ID}_{随机串}" 命名的文件登记到内容寻址存储（只执行一次）
+
+        旧文件保留在原处，聊天记录中的旧地址仍然可用；内容寻址的文件是它的硬链接，
+        不额外占用磁盘空间。删除角色时旧文件由清理任务删除。
+        """
+        marker = f"legacy:{directory}"
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM media_meta WHERE key = ?", (marker,)).fetchone():
+                return
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                character_id, sep, rest = filename.rpartition("_")
+                if not sep or "." not in rest or filename.startswith("temp_"):
+                    continue
+                url = self.put_file(os.path.join(directory, filename), rest.rsplit(".", 1)[-1])
+                self.add_ref(url, character_id, kind)
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO media_meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+
+    # ============ 垃圾回收 ============
+
+    def collect_garbage(self, grace: float = MEDIA_GC_GRACE) -> int:
+        """删除没有引用、且超过宽限期未被上传或引用的文件，返回删除的文件数"""
+        removed = 0
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT hash, ext FROM blobs WHERE last_used < ? "
+                "AND NOT EXISTS (SELECT 1 FROM media_refs r WHERE r.hash = blobs.hash)",
+                (time.time() - grace,)
+            ).fetchall()
+            for content_hash, ext in rows:
+                # 先删记录再删文件：中途崩溃只会留下孤立文件，不会留下指向不存在文件的记录
+                self.conn.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+                try:
+                    os.remove(self._path(content_hash, ext))
+                except FileNotFoundError:
+                    pass
+                removed += 1
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+# 全局实例
+_media_store: Optional[MediaStore] = None
+
+
+def get_media_store() -> MediaStore:
+    """获取媒体存储实例"""
+    global _media_store
+    if _media_store is None:
+        _media_store = MediaStore()
+    return _media_store
+
+
+def close_media_store():
+    """关闭媒体存储"""
+    global _media_store
+    if _media_store is not None:
+        _media_store.close()
+        _media_store = None
+
+
+async def run_media_gc():
+    """后台定时清理没有引用的媒体文件"""
+    while True:
+        await asyncio.sleep(MEDIA_GC_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(get_media_store().collect_garbage)
+            if removed:
+                print(f"清理了 {removed} 个无引用的媒体文件")
+        except Exception as e:
+            print(f"清理媒体文件失败: {e}")
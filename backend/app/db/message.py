@@ -0,0 +1,144 @@
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# 存储记录中单独存放的字段，其余字段放进 extra
+_CORE_FIELDS = ("seq", "role", "content", "timestamp", "tokens")
+
+# 每条消息在对话格式中的固定开销（角色标记、分隔符）
+MESSAGE_OVERHEAD = 4
+
+# 中日韩文字（含全角标点）| 拉丁字母单词 | 数字串 | 空白 | 其他单个字符
+_TOKEN_PATTERN = re.compile(
+    r"([\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef])"
+    r"|([A-Za-z]+)|(\d+)|(\s+)|(.)",
+    re.S
+)
+
+
+def _intern_role(role: str) -> str:
+    """角色只有少数几种取值，驻留后所有消息共用同一个字符串对象"""
+    return sys.intern(role) if isinstance(role, str) else role
+
+
+def encode_timestamp(value: Any) -> Any:
+    """
+    ISO 时间字符串转换为整数（1970-01-01 起的微秒数，不涉及时区）
+
+    只转换能原样还原的不带时区的时间（datetime.now().isoformat() 的格式），
+    带时区或其他格式的值保留原样。
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is not None or parsed.isoformat() != value:
+        return value
+    return (parsed - _EPOCH) // _MICROSECOND
+
+
+def decode_timestamp(value: Any) -> Any:
+    """还原为 ISO 时间字符串"""
+    if isinstance(value, int):
+        return (_EPOCH + timedelta(microseconds=value)).isoformat()
+    return value
+
+
+def estimate_tokens(text: Any) -> int:
+    """
+    离线估算文本的 token 数（不依赖分词库）
+
+    按 GPT 系列 BPE 分词的经验值：汉字、假名、韩文和全角标点各约 1 个，常见英文单词 1 个、长单词约每 6 个字母 1 个，
+    数字约每 3 位 1 个，其他符号各 1 个，空白并入相邻的词。
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        group = match.lastindex
+        if group == 1 or group == 5:
+            tokens += 1
+        elif group == 2:
+            tokens += 1 + (len(match.group(2)) - 1) // 6
+        elif group == 3:
+            tokens += (len(match.group(3)) + 2) // 3
+    return tokens
+
+
+def with_token_count(record: Dict) -> Dict:
+    """写入前为消息记录附上 tokens（内容的 token 数），之后组装上下文时不必重新估算"""
+    if record.get("tokens") is not None:
+        return record
+    return {**record, "tokens": estimate_tokens(record.get("content", ""))}
+
+
+def message_tokens(record: Dict) -> int:
+    """消息计入上下文的 token 数；旧记录没有 tokens 时现场估算"""
+    tokens = record.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(record.get("content", ""))
+    return tokens + MESSAGE_OVERHEAD
+
+
+class Message:
+    """
+    内存中的紧凑聊天消息
+
+    用 __slots__ 代替字典，角色字符串驻留，时间戳存为整数；images 等可选字段
+    只在有值时放进 extra（为空或 null 时不占空间）。与存储记录（dict）互相转换：
+    from_dict() / to_dict()，to_dict() 的结果可以直接写入任一存储后端。
+    """
+
+    __slots__ = ("seq", "role", "content", "ts", "tokens", "extra")
+
+    def __init__(self, seq: Optional[int], role: str, content: Any,
+                 ts: Any = None, extra: Optional[Dict] = None, tokens: Optional[int] = None):
+        self.seq = seq
+        self.role = _intern_role(role)
+        self.content = content
+        self.ts = ts
+        self.tokens = tokens
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> "Message":
+        extra = None
+        for key, value in record.items():
+            if key in _CORE_FIELDS or value is None or value == []:
+                continue
+            if extra is None:
+                extra = {}
+            extra[key] = value
+        return cls(
+            record.get("seq"),
+            record.get("role", ""),
+            record.get("content", ""),
+            encode_timestamp(record.get("timestamp")),
+            extra,
+            record.get("tokens"),
+        )
+
+    def to_dict(self) -> Dict:
+        record = {}
+        if self.seq is not None:
+            record["seq"] = self.seq
+        record["role"] = self.role
+        record["content"] = self.content
+        if self.ts is not None:
+            record["timestamp"] = decode_timestamp(self.ts)
+        if self.tokens is not None:
+            record["tokens"] = self.tokens
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    def __repr__(self) -> str:
+        return f"Message({self.to_dict()!r})"
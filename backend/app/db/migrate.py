@@ -0,0 +1,198 @@
+"""
+旧版 characters.json / users.json 迁移工具
+
+在 backend 目录下运行：
+
+    python -m app.db.migrate [--backend json|sqlite] [--workers 4]
+
+- 源文件按条流式解析，内存中只保留正在迁移的少量角色
+- 多个角色并行写入目标存储（STORAGE_BACKEND / SQLITE_PATH 指定的后端）
+- 每完成一条记录写入进度文件，中断后重新运行会跳过已完成的记录
+- 结束时重新扫描源文件，逐个核对角色、消息条数和用户
+- 只读取源文件、不改名，可以先在线上数据的快照上演练
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.db import database
+from app.db.json_stream import iter_items
+from app.db.repository import CharacterStore, UserStore, DuplicateUserError
+
+# 每次追加到目标存储的消息条数
+MIGRATE_BATCH_SIZE = 500
+
+
+def open_stores(backend: str) -> Tuple[CharacterStore, UserStore]:
+    """直接打开底层存储，不经过写回缓存，写入即落盘"""
+    if backend == "sqlite":
+        from app.db.sqlite_store import SqliteDatabase, SqliteCharacterStore, SqliteUserStore
+        db = SqliteDatabase(database.SQLITE_PATH)
+        return SqliteCharacterStore(db), SqliteUserStore(db)
+
+    from app.db.json_store import JsonCharacterStore, JsonUserStore
+    return JsonCharacterStore(database.CHARACTERS_DIR, database.HISTORY_DIR), JsonUserStore(database.USERS_DIR)
+
+
+class MigrationState:
+    """
+    迁移进度
+
+    只追加的 JSONL，每行是一条已完成的记录 {"kind": "character" | "user", "id": ..., ...}。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: Dict[Tuple[str, str], Dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时写了一半的最后一行
+                        continue
+                    self.done[(entry["kind"], entry["id"])] = entry
+
+    def get(self, kind: str, record_id: str) -> Optional[Dict]:
+        return self.done.get((kind, record_id))
+
+    def mark(self, entry: Dict):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.done[(entry["kind"], entry["id"])] = entry
+
+
+def _migrate_character(store: CharacterStore, state: MigrationState, character_id: str, character: Dict):
+    """写入一个角色及其聊天记录，完成后记入进度"""
+    # 进度中没有却已存在：上次迁移到一半中断，删除后重新写入
+    if store.exists(character_id):
+        store.delete(character_id)
+
+    history = character.pop("chat_history", None) or []
+    store.save({**character, "id": character_id})
+    for i in range(0, len(history), MIGRATE_BATCH_SIZE):
+        store.append_messages(character_id, history[i:i + MIGRATE_BATCH_SIZE])
+    state.mark({"kind": "character", "id": character_id, "messages": len(history)})
+
+
+def migrate_characters(path: str, store: CharacterStore, state: MigrationState, workers: int) -> int:
+    """并行迁移角色，返回本次迁移的角色数"""
+    migrated = 0
+    pending: Set[Future] = set()
+
+    def collect(finished: Set[Future]):
+        nonlocal migrated
+        for future in finished:
+            # 出错时抛出，已完成的部分保留在进度中
+            future.result()
+            migrated += 1
+            if migrated % 100 == 0:
+                print(f"已迁移 {migrated} 个角色")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for character_id, character in iter_items(path):
+            if state.get("character", character_id):
+                continue
+            # 限制同时在途的角色数，内存中最多保留 2 * workers 个角色
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending.add(executor.submit(_migrate_character, store, state, character_id, character))
+        collect(wait(pending)[0])
+    return migrated
+
+
+def migrate_users(path: str, store: UserStore, state: MigrationState) -> int:
+    """迁移用户（数量少，按顺序写入以便检查用户名和邮箱唯一），返回本次迁移的用户数"""
+    migrated = 0
+    for user_id, user in iter_items(path):
+        if state.get("user", user_id):
+            continue
+        entry = {"kind": "user", "id": user_id}
+        if store.get(user_id) is None:
+            try:
+                store.create({**user, "id": user_id})
+            except DuplicateUserError as e:
+                print(f"跳过用户 {user_id}：{e}")
+                entry["skipped"] = e.field
+        state.mark(entry)
+        migrated += 1
+    return migrated
+
+
+def verify(characters_path: Optional[str], users_path: Optional[str],
+           character_store: CharacterStore, user_store: UserStore, state: MigrationState) -> List[str]:
+    """重新流式扫描源文件，核对目标存储中的角色、消息条数和用户，返回发现的问题"""
+    problems = []
+    if characters_path:
+        for character_id, character in iter_items(characters_path):
+            expected = len(character.get("chat_history") or [])
+            if not character_store.exists(character_id):
+                problems.append(f"角色 {character_id} 不存在")
+                continue
+            actual = character_store.count_messages(character_id)
+            if actual != expected:
+                problems.append(f"角色 {character_id} 消息条数不一致：源文件 {expected}，目标 {actual}")
+    if users_path:
+        for user_id, _ in iter_items(users_path):
+            entry = state.get("user", user_id)
+            if entry is not None and entry.get("skipped"):
+                continue
+            if user_store.get(user_id) is None:
+                problems.append(f"用户 {user_id} 不存在")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把旧版 characters.json / users.json 迁移到当前存储后端")
+    parser.add_argument("--characters", default=database.CHARACTERS_FILE, help="旧版角色文件")
+    parser.add_argument("--users", default=database.USERS_FILE, help="旧版用户文件")
+    parser.add_argument("--backend", default=database.STORAGE_BACKEND, choices=["json", "sqlite"], help="目标存储后端")
+    parser.add_argument("--workers", type=int, default=4, help="并行迁移的角色数")
+    parser.add_argument("--state", default=os.path.join(database.DATA_DIR, "migration_state.jsonl"), help="进度文件")
+    args = parser.parse_args(argv)
+
+    characters_path = args.characters if os.path.exists(args.characters) else None
+    users_path = args.users if os.path.exists(args.users) else None
+    if characters_path is None and users_path is None:
+        print("没有找到需要迁移的文件")
+        return 0
+
+    character_store, user_store = open_stores(args.backend)
+    state = MigrationState(args.state)
+    try:
+        if characters_path:
+            print(f"迁移角色：{characters_path}")
+            print(f"本次迁移 {migrate_characters(characters_path, character_store, state, args.workers)} 个角色")
+        if users_path:
+            print(f"迁移用户：{users_path}")
+            print(f"本次迁移 {migrate_users(users_path, user_store, state)} 个用户")
+
+        problems = verify(characters_path, users_path, character_store, user_store, state)
+    finally:
+        character_store.close()
+        user_store.close()
+
+    if problems:
+        for problem in problems:
+            print(problem)
+        print(f"校验失败：{len(problems)} 处不一致")
+        return 1
+    print("校验通过")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
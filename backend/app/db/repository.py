@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+
+# 聊天记录分层存储：最近 HOT_WINDOW 条保持未压缩（热数据），
+# 更早的记录每累积 SEGMENT_SIZE 条压缩成一个不可变的冷数据段
+HOT_WINDOW = 100
+SEGMENT_SIZE = 500
+
+# 未登录的请求共用的分区；按用户分区之前创建的角色（没有 owner_id）也归入这里
+ANONYMOUS_OWNER = "anonymous"
+
+# 已删除、等待后台清理的角色移入这个分区，立即从用户的列表和接口中消失
+DELETED_OWNER = "__deleted__"
+
+# 角色列表（元数据索引）包含的字段，不含聊天记录等大字段
+SUMMARY_FIELDS = (
+    "id", "owner_id", "name", "gender", "age", "appearance", "avatar", "personality",
+    "hobbies", "background", "relationship_type", "created_at",
+)
+
+
+def make_summary(profile: Dict) -> Dict:
+    """从角色资料中取出列表需要的字段"""
+    return {field: profile.get(field) for field in SUMMARY_FIELDS}
+
+
+def owner_of(profile: Dict) -> str:
+    """角色所属的分区（用户ID）"""
+    return profile.get("owner_id") or ANONYMOUS_OWNER
+
+
+class DuplicateUserError(ValueError):
+    """用户名或邮箱已被占用"""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field} 已存在")
+        self.field = field
+
+
+class CharacterStore(ABC):
+    """角色存储接口：角色资料与聊天记录分开读写"""
+
+    # ============ 角色资料 ============
+
+    @abstractmethod
+    def exists(self, character_id: str) -> bool:
+        """角色是否存在"""
+
+    @abstractmethod
+    def get(self, character_id: str) -> Optional[Dict]:
+        """读取角色资料（不含聊天记录），不存在时返回 None"""
+
+    @abstractmethod
+    def get_owner(self, character_id: str) -> Optional[str]:
+        """角色所属的用户ID（从元数据索引读取），角色不存在时返回 None"""
+
+    @abstractmethod
+    def list_summaries(self, owner_id: str) -> List[Dict]:
+        """
+        从元数据索引读取某个用户的角色列表（按创建时间排序）
+
+        索引按用户分区，只访问该用户自己的条目；每项包含 SUMMARY_FIELDS
+        和最后活跃时间 last_active_at，不读取聊天记录。
+        """
+
+    @abstractmethod
+    def save(self, character: Dict):
+        """新建或更新角色资料"""
+
+    @abstractmethod
+    def delete(self, character_id: str) -> bool:
+        """删除角色及其聊天记录，返回是否删除成功"""
+
+    # ============ 聊天记录 ============
+
+    @abstractmethod
+    def count_messages(self, character_id: str) -> int:
+        """聊天记录条数"""
+
+    @abstractmethod
+    def get_messages(self, character_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """按时间正序分页读取聊天记录"""
+
+    @abstractmethod
+    def get_recent_messages(self, character_id: str, n: int) -> List[Dict]:
+        """读取最近 n 条聊天记录（时间正序）"""
+
+    @abstractmethod
+    def last_seq(self, character_id: str) -> int:
+        """最近分配的消息序号，没有消息时为 0；清空或删除消息后也不回退"""
+
+    @abstractmethod
+    def seq_position(self, character_id: str, seq: int) -> int:
+        """序号小于 seq 的消息条数，即 seq 在时间正序记录中的位置"""
+
+    def get_messages_before(self, character_id: str, before_seq: Optional[int], limit: int) -> List[Dict]:
+        """读取序号小于 before_seq 的最近 limit 条消息（时间正序），before_seq 为空时从最新一条开始"""
+        if before_seq is None:
+            end = self.count_messages(character_id)
+        else:
+            end = self.seq_position(character_id, before_seq)
+        start = max(end - limit, 0)
+        return self.get_messages(character_id, start, end - start)
+
+    def get_messages_after(self, character_id: str, after_seq: int, limit: int) -> List[Dict]:
+        """读取序号大于 after_seq 的最早 limit 条消息（时间正序）"""
+        start = self.seq_position(character_id, after_seq + 1)
+        return self.get_messages(character_id, start, limit)
+
+    def iter_messages(self, character_id: str, batch_size: int = 500) -> Iterator[List[Dict]]:
+        """
+        按批迭代聊天记录（时间正序），每批最多 batch_size 条，内存占用与记录总数无关
+
+        只迭代开始时已存在的消息，迭代过程中新追加的消息不包含在内。
+        """
+        last_seq = self.last_seq(character_id)
+        after_seq = 0
+        while after_seq < last_seq:
+            batch = self.get_messages_after(character_id, after_seq, batch_size)
+            batch = [m for m in batch if m["seq"] <= last_seq]
+            if not batch:
+                break
+            yield batch
+            after_seq = batch[-1]["seq"]
+
+    @abstractmethod
+    def append_messages(self, character_id: str, messages: List[Dict]) -> List[Dict]:
+        """
+        追加聊天记录，热数据超出窗口时把旧记录滚动压缩为冷数据段
+
+        每条消息分配按角色单调递增的序号 seq；已带 seq 的消息（写回缓存预先分配）保留原值。
+        返回带序号的消息，角色不存在时返回空列表。
+        """
+
+    @abstractmethod
+    def get_stats(self, character_id: str) -> Dict:
+        """聊天统计，由追加和删除时增量维护的聚合数据得出，不扫描聊天记录"""
+
+    @abstractmethod
+    def clear_messages(self, character_id: str):
+        """清空聊天记录"""
+
+    @abstractmethod
+    def delete_message(self, character_id: str, seq: int) -> Optional[Dict]:
+        """
+        按序号删除一条聊天记录，返回被删除的消息
+
+        只写入删除标记，读取时过滤，其他消息的序号不受影响；
+        记录由 compact_messages() 在后台物理删除。
+        """
+
+    @abstractmethod
+    def compact_messages(self, character_id: str) -> int:
+        """物理删除带删除标记的聊天记录，返回删除的条数"""
+
+    @abstractmethod
+    def characters_to_compact(self, threshold: int) -> List[str]:
+        """删除标记不少于 threshold 条、需要压实的角色"""
+
+    def close(self):
+        """释放底层资源"""
+
+
+class UserStore(ABC):
+    """用户存储接口"""
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[Dict]:
+        """按ID读取用户"""
+
+    @abstractmethod
+    def get_by_username(self, username: str) -> Optional[Dict]:
+        """按用户名读取用户"""
+
+    @abstractmethod
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        """按邮箱读取用户"""
+
+    @abstractmethod
+    def create(self, user: Dict):
+        """新建用户，用户名或邮箱重复时抛出 DuplicateUserError"""
+
+    def close(self):
+        """释放底层资源"""
@@ -0,0 +1,14 @@
+import gzip
+import json
+from typing import Dict, List
+
+
+def encode_segment(records: List[Dict]) -> bytes:
+    """把一段聊天记录压缩为 gzip 格式的 JSONL"""
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    return gzip.compress(data.encode("utf-8"))
+
+
+def decode_segment(data: bytes) -> List[Dict]:
+    """解压冷数据段"""
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
@@ -0,0 +1,666 @@
+import os
+import json
+import sqlite3
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app.db.repository import (
+    CharacterStore, UserStore, DuplicateUserError, HOT_WINDOW, SEGMENT_SIZE, ANONYMOUS_OWNER,
+    make_summary, owner_of
+)
+from app.db.segments import encode_segment, decode_segment
+from app.db.chat_stats import message_day, format_stats
+from app.db.tombstones import to_physical, to_logical
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    id TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL DEFAULT 'anonymous',
+    created_at TEXT NOT NULL,
+    last_seq INTEGER NOT NULL DEFAULT 0,
+    last_active_at TEXT,
+    archived_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_characters_created_at ON characters(created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    character_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    images TEXT,
+    timestamp TEXT,
+    tokens INTEGER,
+    PRIMARY KEY (character_id, seq)
+) WITHOUT ROWID;
+
+-- 冷数据：较早的聊天记录按段压缩存放，segment_no 按时间递增
+CREATE TABLE IF NOT EXISTS message_segments (
+    character_id TEXT NOT NULL,
+    segment_no INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    last_seq INTEGER NOT NULL DEFAULT 0,
+    data BLOB NOT NULL,
+    PRIMARY KEY (character_id, segment_no)
+) WITHOUT ROWID;
+
+-- 冷数据段中已删除、尚未压实的消息，position 是该消息在冷数据中的物理位置
+CREATE TABLE IF NOT EXISTS message_tombstones (
+    character_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (character_id, seq)
+) WITHOUT ROWID;
+
+-- 聊天统计聚合，随追加和删除消息增量维护
+CREATE TABLE IF NOT EXISTS chat_stats (
+    character_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    chars INTEGER NOT NULL,
+    PRIMARY KEY (character_id, role)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS chat_days (
+    character_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (character_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    avatar TEXT,
+    created_at TEXT NOT NULL
+);
+"""
+
+
+class SqliteDatabase:
+    """SQLite 连接管理：WAL 模式，每个线程一个连接"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """为旧版数据库补充新增的列"""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(characters)")}
+        if "last_active_at" not in columns:
+            self.conn.execute("ALTER TABLE characters ADD COLUMN last_active_at TEXT")
+        if "archived_count" not in columns:
+            self.conn.execute("ALTER TABLE characters ADD COLUMN archived_count INTEGER NOT NULL DEFAULT 0")
+        if "owner_id" not in columns:
+            # 分区之前的角色归入匿名分区
+            self.conn.execute(
+                f"ALTER TABLE characters ADD COLUMN owner_id TEXT NOT NULL DEFAULT '{ANONYMOUS_OWNER}'"
+            )
+        # 角色列表按用户分区查询
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_characters_owner ON characters(owner_id, created_at)"
+        )
+
+        # 消息的 token 数在写入时计算，旧记录为 NULL，读取时现场估算
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if "tokens" not in columns:
+            self.conn.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(message_segments)")}
+        if "last_seq" not in columns:
+            self.conn.execute("ALTER TABLE message_segments ADD COLUMN last_seq INTEGER NOT NULL DEFAULT 0")
+            for row in self.conn.execute("SELECT character_id, segment_no, data FROM message_segments").fetchall():
+                self.conn.execute(
+                    "UPDATE message_segments SET last_seq = ? WHERE character_id = ? AND segment_no = ?",
+                    (decode_segment(row["data"])[-1]["seq"], row["character_id"], row["segment_no"])
+                )
+
+        # 统计表是后加的：为已有聊天记录但还没有统计的角色补算一次
+        rows = self.conn.execute(
+            "SELECT id FROM characters c WHERE last_seq > 0 "
+            "AND NOT EXISTS (SELECT 1 FROM chat_stats s WHERE s.character_id = c.id)"
+        ).fetchall()
+        for row in rows:
+            with self.transaction() as conn:
+                messages = []
+                for segment in conn.execute(
+                    "SELECT data FROM message_segments WHERE character_id = ? ORDER BY segment_no", (row["id"],)
+                ):
+                    messages.extend(decode_segment(segment["data"]))
+                messages.extend(_row_to_message(r) for r in conn.execute(
+                    "SELECT * FROM messages WHERE character_id = ? ORDER BY seq", (row["id"],)
+                ))
+                _update_stats(conn, row["id"], messages, 1)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 自动提交模式，事务由 transaction() 显式管理
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # WAL 模式下读写互不阻塞，写入只需 NORMAL 级别的同步
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务：BEGIN IMMEDIATE 保证读-改-写期间不被其他写者插入"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _row_to_message(row: sqlite3.Row) -> Dict:
+    message = {
+        "seq": row["seq"],
+        "role": row["role"],
+        "content": row["content"],
+    }
+    if row["timestamp"] is not None:
+        message["timestamp"] = row["timestamp"]
+    if row["images"] is not None:
+        message["images"] = json.loads(row["images"])
+    if row["tokens"] is not None:
+        message["tokens"] = row["tokens"]
+    return message
+
+
+def _update_stats(conn: sqlite3.Connection, character_id: str, messages: List[Dict], sign: int):
+    """把消息计入（sign=1）或扣出（sign=-1）统计聚合，在调用方的事务内执行"""
+    roles: Dict[str, List[int]] = {}
+    days: Dict[str, int] = {}
+    for message in messages:
+        role = roles.setdefault(message.get("role", ""), [0, 0])
+        role[0] += 1
+        role[1] += len(message.get("content") or "")
+        day = message_day(message)
+        if day:
+            days[day] = days.get(day, 0) + 1
+
+    for role, (count, chars) in roles.items():
+        conn.execute(
+            "INSERT INTO chat_stats (character_id, role, count, chars) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (character_id, role) DO UPDATE "
+            "SET count = count + excluded.count, chars = chars + excluded.chars",
+            (character_id, role, sign * count, sign * chars)
+        )
+    for day, count in days.items():
+        conn.execute(
+            "INSERT INTO chat_days (character_id, day, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (character_id, day) DO UPDATE SET count = count + excluded.count",
+            (character_id, day, sign * count)
+        )
+    if sign < 0:
+        conn.execute("DELETE FROM chat_stats WHERE character_id = ? AND count <= 0", (character_id,))
+        conn.execute("DELETE FROM chat_days WHERE character_id = ? AND count <= 0", (character_id,))
+
+
+def _clear_stats(conn: sqlite3.Connection, character_id: str):
+    conn.execute("DELETE FROM chat_stats WHERE character_id = ?", (character_id,))
+    conn.execute("DELETE FROM chat_days WHERE character_id = ?", (character_id,))
+
+
+class SqliteCharacterStore(CharacterStore):
+    """
+    SQLite 角色存储，聊天记录按 (character_id, seq) 建索引
+
+    删除热数据中的消息直接删除对应行；冷数据段不可变，删除其中的消息只写入删除标记，
+    读取时过滤，由 compact_messages() 重写数据段。对外的位置都是过滤后的逻辑位置。
+    """
+
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def exists(self, character_id: str) -> bool:
+        row = self.db.conn.execute(
+            "SELECT 1 FROM characters WHERE id = ?", (character_id,)
+        ).fetchone()
+        return row is not None
+
+    def get(self, character_id: str) -> Optional[Dict]:
+        row = self.db.conn.execute(
+            "SELECT data FROM characters WHERE id = ?", (character_id,)
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_owner(self, character_id: str) -> Optional[str]:
+        row = self.db.conn.execute(
+            "SELECT owner_id FROM characters WHERE id = ?", (character_id,)
+        ).fetchone()
+        return row["owner_id"] if row else None
+
+    def list_summaries(self, owner_id: str) -> List[Dict]:
+        rows = self.db.conn.execute(
+            "SELECT data, last_active_at FROM characters WHERE owner_id = ? ORDER BY created_at",
+            (owner_id,)
+        ).fetchall()
+        summaries = []
+        for row in rows:
+            summary = make_summary(json.loads(row["data"]))
+            summary["last_active_at"] = row["last_active_at"]
+            summaries.append(summary)
+        return summaries
+
+    def save(self, character: Dict):
+        data = {k: v for k, v in character.items() if k != "chat_history"}
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO characters (id, owner_id, created_at, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET owner_id = excluded.owner_id, data = excluded.data",
+                (data["id"], owner_of(data), data.get("created_at", ""), json.dumps(data, ensure_ascii=False))
+            )
+
+    def delete(self, character_id: str) -> bool:
+        with self.db.transaction() as conn:
+            cursor = conn.execute("DELETE FROM characters WHERE id = ?", (character_id,))
+            conn.execute("DELETE FROM messages WHERE character_id = ?", (character_id,))
+            conn.execute("DELETE FROM message_segments WHERE character_id = ?", (character_id,))
+            conn.execute("DELETE FROM message_tombstones WHERE character_id = ?", (character_id,))
+            _clear_stats(conn, character_id)
+        return cursor.rowcount > 0
+
+    def _archived_count(self, conn: sqlite3.Connection, character_id: str) -> int:
+        row = conn.execute(
+            "SELECT archived_count FROM characters WHERE id = ?", (character_id,)
+        ).fetchone()
+        return row["archived_count"] if row else 0
+
+    def _hot_count(self, conn: sqlite3.Connection, character_id: str) -> int:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE character_id = ?", (character_id,)
+        ).fetchone()
+        return row[0]
+
+    def _tombstones(self, conn: sqlite3.Connection, character_id: str) -> Tuple[List[int], Set[int]]:
+        """冷数据中的删除标记：(按升序排列的物理位置, 序号集合)"""
+        rows = conn.execute(
+            "SELECT seq, position FROM message_tombstones WHERE character_id = ? ORDER BY position",
+            (character_id,)
+        ).fetchall()
+        return [row["position"] for row in rows], {row["seq"] for row in rows}
+
+    def last_seq(self, character_id: str) -> int:
+        row = self.db.conn.execute(
+            "SELECT last_seq FROM characters WHERE id = ?", (character_id,)
+        ).fetchone()
+        return row["last_seq"] if row else 0
+
+    def seq_position(self, character_id: str, seq: int) -> int:
+        conn = self.db.conn
+        position = 0
+        segments = conn.execute(
+            "SELECT segment_no, count, last_seq FROM message_segments WHERE character_id = ? ORDER BY segment_no",
+            (character_id,)
+        ).fetchall()
+        for segment in segments:
+            if segment["last_seq"] < seq:
+                position += segment["count"]
+                continue
+            row = conn.execute(
+                "SELECT data FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                (character_id, segment["segment_no"])
+            ).fetchone()
+            position += bisect_left([r["seq"] for r in decode_segment(row["data"])], seq)
+            return to_logical(self._tombstones(conn, character_id)[0], position)
+
+        row = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE character_id = ? AND seq < ?",
+            (character_id, seq)
+        ).fetchone()
+        return to_logical(self._tombstones(conn, character_id)[0], position) + row[0]
+
+    def count_messages(self, character_id: str) -> int:
+        conn = self.db.conn
+        row = conn.execute(
+            "SELECT COUNT(*) FROM message_tombstones WHERE character_id = ?", (character_id,)
+        ).fetchone()
+        return self._archived_count(conn, character_id) - row[0] + self._hot_count(conn, character_id)
+
+    def get_messages(self, character_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        conn = self.db.conn
+        offset = max(offset, 0)
+        archived = self._archived_count(conn, character_id)
+        positions, deleted = self._tombstones(conn, character_id)
+        live_archived = archived - len(positions)
+        end = None if limit is None else offset + limit
+        messages = []
+
+        # 冷数据段：换算成物理位置后按段大小定位，只解压涉及到的段
+        if offset < live_archived:
+            start = to_physical(positions, offset)
+            stop = archived if end is None or end >= live_archived else to_physical(positions, end)
+            position = 0
+            segments = conn.execute(
+                "SELECT segment_no, count FROM message_segments WHERE character_id = ? ORDER BY segment_no",
+                (character_id,)
+            ).fetchall()
+            for segment in segments:
+                seg_start, seg_end = position, position + segment["count"]
+                position = seg_end
+                if seg_end <= start:
+                    continue
+                if seg_start >= stop:
+                    break
+                row = conn.execute(
+                    "SELECT data FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                    (character_id, segment["segment_no"])
+                ).fetchone()
+                records = decode_segment(row["data"])[max(start - seg_start, 0):min(stop, seg_end) - seg_start]
+                messages.extend(r for r in records if r["seq"] not in deleted)
+
+        # 热数据
+        if end is None or end > live_archived:
+            hot_offset = max(offset - live_archived, 0)
+            hot_limit = -1 if end is None else end - live_archived - hot_offset
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE character_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (character_id, hot_limit, hot_offset)
+            ).fetchall()
+            messages.extend(_row_to_message(row) for row in rows)
+        return messages
+
+    def get_recent_messages(self, character_id: str, n: int) -> List[Dict]:
+        if n <= 0:
+            return []
+        conn = self.db.conn
+        if n > self._hot_count(conn, character_id):
+            total = self.count_messages(character_id)
+            return self.get_messages(character_id, max(total - n, 0), n)
+        rows = conn.execute(
+            "SELECT * FROM messages WHERE character_id = ? ORDER BY seq DESC LIMIT ?",
+            (character_id, n)
+        ).fetchall()
+        return [_row_to_message(row) for row in reversed(rows)]
+
+    def iter_messages(self, character_id: str, batch_size: int = 500) -> Iterator[List[Dict]]:
+        """
+        在同一个读事务中按批读取（WAL 快照）
+
+        使用单独的连接，迭代期间其他连接的删除和压实不会造成遗漏或重复，也不阻塞写入。
+        """
+        conn = sqlite3.connect(self.db.path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN")
+            _, deleted = self._tombstones(conn, character_id)
+            batch: List[Dict] = []
+            segments = conn.execute(
+                "SELECT segment_no FROM message_segments WHERE character_id = ? ORDER BY segment_no",
+                (character_id,)
+            ).fetchall()
+            for segment in segments:
+                row = conn.execute(
+                    "SELECT data FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                    (character_id, segment["segment_no"])
+                ).fetchone()
+                for record in decode_segment(row["data"]):
+                    if record["seq"] in deleted:
+                        continue
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+
+            cursor = conn.execute(
+                "SELECT * FROM messages WHERE character_id = ? ORDER BY seq", (character_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    batch.append(_row_to_message(row))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def append_messages(self, character_id: str, messages: List[Dict]) -> List[Dict]:
+        if not messages:
+            return []
+        stored = []
+        with self.db.transaction() as conn:
+            # 序号按角色单调递增，清空记录后也不复用
+            row = conn.execute(
+                "SELECT last_seq FROM characters WHERE id = ?", (character_id,)
+            ).fetchone()
+            if row is None:
+                return []
+            seq = row["last_seq"]
+            for message in messages:
+                message_seq = message.get("seq")
+                if message_seq is None:
+                    seq += 1
+                    message_seq = seq
+                seq = max(seq, message_seq)
+                stored.append({**message, "seq": message_seq})
+                images = message.get("images")
+                conn.execute(
+                    "INSERT INTO messages (character_id, seq, role, content, images, timestamp, tokens) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (character_id, message_seq, message["role"], message.get("content", ""),
+                     json.dumps(images, ensure_ascii=False) if images is not None else None,
+                     message.get("timestamp"), message.get("tokens"))
+                )
+            conn.execute(
+                "UPDATE characters SET last_seq = ?, last_active_at = ? WHERE id = ?",
+                (seq, messages[-1].get("timestamp"), character_id)
+            )
+            _update_stats(conn, character_id, messages, 1)
+
+            hot_count = self._hot_count(conn, character_id)
+            if hot_count >= HOT_WINDOW + SEGMENT_SIZE:
+                self._roll(conn, character_id, hot_count - HOT_WINDOW)
+        return stored
+
+    def _roll(self, conn: sqlite3.Connection, character_id: str, n_roll: int):
+        """把最早的 n_roll 条热数据压缩为一个冷数据段（在调用方的事务内）"""
+        rows = conn.execute(
+            "SELECT * FROM messages WHERE character_id = ? ORDER BY seq LIMIT ?",
+            (character_id, n_roll)
+        ).fetchall()
+        records = [_row_to_message(row) for row in rows]
+        row = conn.execute(
+            "SELECT COALESCE(MAX(segment_no), 0) FROM message_segments WHERE character_id = ?",
+            (character_id,)
+        ).fetchone()
+        conn.execute(
+            "INSERT INTO message_segments (character_id, segment_no, count, last_seq, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (character_id, row[0] + 1, len(records), records[-1]["seq"], encode_segment(records))
+        )
+        conn.execute(
+            "DELETE FROM messages WHERE character_id = ? AND seq <= ?",
+            (character_id, records[-1]["seq"])
+        )
+        conn.execute(
+            "UPDATE characters SET archived_count = archived_count + ? WHERE id = ?",
+            (len(records), character_id)
+        )
+
+    def get_stats(self, character_id: str) -> Dict:
+        conn = self.db.conn
+        rows = conn.execute(
+            "SELECT role, count, chars FROM chat_stats WHERE character_id = ?", (character_id,)
+        ).fetchall()
+        days = conn.execute(
+            "SELECT COUNT(*), MIN(day), MAX(day) FROM chat_days WHERE character_id = ?", (character_id,)
+        ).fetchone()
+        return format_stats(
+            {row["role"]: row["count"] for row in rows},
+            sum(row["chars"] for row in rows),
+            days[0], days[1], days[2]
+        )
+
+    def clear_messages(self, character_id: str):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE character_id = ?", (character_id,))
+            conn.execute("DELETE FROM message_segments WHERE character_id = ?", (character_id,))
+            conn.execute("DELETE FROM message_tombstones WHERE character_id = ?", (character_id,))
+            conn.execute("UPDATE characters SET archived_count = 0 WHERE id = ?", (character_id,))
+            _clear_stats(conn, character_id)
+
+    def delete_message(self, character_id: str, seq: int) -> Optional[Dict]:
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM messages WHERE character_id = ? AND seq = ?", (character_id, seq)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "DELETE FROM messages WHERE character_id = ? AND seq = ?", (character_id, seq)
+                )
+                deleted = _row_to_message(row)
+            else:
+                deleted = self._tombstone(conn, character_id, seq)
+                if deleted is None:
+                    return None
+            _update_stats(conn, character_id, [deleted], -1)
+            return deleted
+
+    def _tombstone(self, conn: sqlite3.Connection, character_id: str, seq: int) -> Optional[Dict]:
+        """为冷数据段中的消息写入删除标记（在调用方的事务内），返回该消息"""
+        position = 0
+        segments = conn.execute(
+            "SELECT segment_no, count, last_seq FROM message_segments WHERE character_id = ? ORDER BY segment_no",
+            (character_id,)
+        ).fetchall()
+        for segment in segments:
+            if segment["last_seq"] < seq:
+                position += segment["count"]
+                continue
+            row = conn.execute(
+                "SELECT data FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                (character_id, segment["segment_no"])
+            ).fetchone()
+            records = decode_segment(row["data"])
+            i = bisect_left([r["seq"] for r in records], seq)
+            if i == len(records) or records[i]["seq"] != seq:
+                return None
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO message_tombstones (character_id, seq, position) VALUES (?, ?, ?)",
+                (character_id, seq, position + i)
+            )
+            # 已经删除过
+            return records[i] if cursor.rowcount else None
+        return None
+
+    def compact_messages(self, character_id: str) -> int:
+        with self.db.transaction() as conn:
+            positions, deleted = self._tombstones(conn, character_id)
+            if not deleted:
+                return 0
+            position = 0
+            segments = conn.execute(
+                "SELECT segment_no, count FROM message_segments WHERE character_id = ? ORDER BY segment_no",
+                (character_id,)
+            ).fetchall()
+            for segment in segments:
+                seg_start, seg_end = position, position + segment["count"]
+                position = seg_end
+                # 只重写含有删除标记的段
+                if bisect_left(positions, seg_start) == bisect_left(positions, seg_end):
+                    continue
+                row = conn.execute(
+                    "SELECT data FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                    (character_id, segment["segment_no"])
+                ).fetchone()
+                records = [r for r in decode_segment(row["data"]) if r["seq"] not in deleted]
+                if records:
+                    conn.execute(
+                        "UPDATE message_segments SET count = ?, last_seq = ?, data = ? "
+                        "WHERE character_id = ? AND segment_no = ?",
+                        (len(records), records[-1]["seq"], encode_segment(records),
+                         character_id, segment["segment_no"])
+                    )
+                else:
+                    conn.execute(
+                        "DELETE FROM message_segments WHERE character_id = ? AND segment_no = ?",
+                        (character_id, segment["segment_no"])
+                    )
+            conn.execute(
+                "UPDATE characters SET archived_count = archived_count - ? WHERE id = ?",
+                (len(deleted), character_id)
+            )
+            conn.execute("DELETE FROM message_tombstones WHERE character_id = ?", (character_id,))
+        return len(deleted)
+
+    def characters_to_compact(self, threshold: int) -> List[str]:
+        rows = self.db.conn.execute(
+            "SELECT character_id FROM message_tombstones GROUP BY character_id HAVING COUNT(*) >= ?",
+            (threshold,)
+        ).fetchall()
+        return [row["character_id"] for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+class SqliteUserStore(UserStore):
+    """SQLite 用户存储，用户名和邮箱带唯一索引"""
+
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def _fetch(self, column: str, value: str) -> Optional[Dict]:
+        row = self.db.conn.execute(
+            f"SELECT * FROM users WHERE {column} = ?", (value,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        return self._fetch("id", user_id)
+
+    def get_by_username(self, username: str) -> Optional[Dict]:
+        return self._fetch("username", username)
+
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        return self._fetch("email", email)
+
+    def create(self, user: Dict):
+        try:
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (id, username, email, password, avatar, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user["id"], user["username"], user["email"], user["password"],
+                     user.get("avatar"), user["created_at"])
+                )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateUserError("email" if "email" in str(e) else "username")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.db.branches import BranchHistory
+from app.db.message import estimate_tokens
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 滚动摘要数据库（与角色存储后端无关）
+SUMMARY_DB_PATH = os.getenv("SUMMARY_DB_PATH", os.path.join("data", "summaries.db"))
+
+SCHEMA = """
+-- covered_seq：摘要已经包含的最后一条消息的序号，之后的消息以原文放进上下文
+CREATE TABLE IF NOT EXISTS summaries (
+    character_id TEXT NOT NULL,
+    branch_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    covered_seq INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (character_id, branch_id)
+);
+"""
+
+
+class SummaryStore:
+    """
+    对话的滚动摘要
+
+    每个分支一份摘要，记录已经折叠进摘要的最后一条消息的序号。分支还没有自己的摘要时，
+    沿用祖先分支中只覆盖了共享前缀的摘要。
+
+    摘要由后台任务生成，期间聊天记录可能被删除或清空：删除和清空会让角色的代数加一，
+    用旧代数生成的摘要不再写入。
+    """
+
+    def __init__(self, path: str = SUMMARY_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def generation(self, character_id: str) -> int:
+        with self._lock:
+            return self._generations.get(character_id, 0)
+
+    def _bump(self, character_id: str):
+        self._generations[character_id] = self._generations.get(character_id, 0) + 1
+
+    def get(self, character_id: str, branch_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT branch_id, summary, covered_seq, tokens, updated_at FROM summaries "
+                "WHERE character_id = ? AND branch_id = ?",
+                (character_id, branch_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "branch_id": row[0],
+            "summary": row[1],
+            "covered_seq": row[2],
+            "tokens": row[3],
+            "updated_at": row[4],
+        }
+
+    def for_history(self, history: BranchHistory) -> Optional[Dict]:
+        """
+        分支可用的摘要
+
+        分支自己的摘要优先；否则取祖先分支的摘要中覆盖到的序号不超过共享前缀（分叉点）的、最新的一份。
+        """
+        best = None
+        for branch_id, _, high in history.levels:
+            summary = self.get(history.character_id, branch_id)
+            if summary is None or (high is not None and summary["covered_seq"] > high):
+                continue
+            if branch_id == history.branch_id:
+                return summary
+            if best is None or summary["covered_seq"] > best["covered_seq"]:
+                best = summary
+        return best
+
+    def save(self, character_id: str, branch_id: str, summary: str, covered_seq: int, generation: int) -> bool:
+        """保存摘要；生成期间聊天记录被删除或清空过（代数变化）时放弃，返回是否写入"""
+        with self._lock:
+            if self._generations.get(character_id, 0) != generation:
+                return False
+            self.conn.execute(
+                "INSERT INTO summaries (character_id, branch_id, summary, covered_seq, tokens, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (character_id, branch_id) DO UPDATE SET summary = excluded.summary, "
+                "covered_seq = excluded.covered_seq, tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (character_id, branch_id, summary, covered_seq, estimate_tokens(summary), datetime.now().isoformat())
+            )
+        return True
+
+    def invalidate(self, character_id: str, seq: int):
+        """删除消息后，丢弃已经包含这条消息的摘要（之后重新生成）"""
+        with self._lock:
+            self._bump(character_id)
+            self.conn.execute(
+                "DELETE FROM summaries WHERE character_id = ? AND covered_seq >= ?", (character_id, seq)
+            )
+
+    def remove_character(self, character_id: str):
+        with self._lock:
+            self._bump(character_id)
+            self.conn.execute("DELETE FROM summaries WHERE character_id = ?", (character_id,))
+
+    def close(self):
+        self.conn.close()
+
+
+# 全局实例
+_summary_store: Optional[SummaryStore] = None
+
+
+def get_summary_store() -> SummaryStore:
+    """获取摘要存储实例"""
+    global _summary_store
+    if _summary_store is None:
+        _summary_store = SummaryStore()
+    return _summary_store
+
+
+def close_summary_store():
+    """关闭摘要存储"""
+    global _summary_store
+    if _summary_store is not None:
+        _summary_store.close()
+        _summary_store = None
@@ -0,0 +1,366 @@
+import os
+import json
+import shutil
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from app.db.atomic import atomic_write_bytes, atomic_write_json
+from app.db.history_log import HistoryLog
+from app.db.repository import HOT_WINDOW, SEGMENT_SIZE
+from app.db.segments import encode_segment, decode_segment
+from app.db.tombstones import to_physical, to_logical
+
+# 内存中最多缓存的已解压冷数据段数量
+SEGMENT_CACHE_SIZE = 8
+
+
+class TieredHistory:
+    """
+    分层聊天记录存储（JSON 后端）
+
+    每个角色一个目录 {base_dir}/{id}/：
+    - hot_{n}.jsonl / hot_{n}.idx：热数据，只追加的日志
+    - seg_*.jsonl.gz：不可变的压缩冷数据段，翻页或导出时才解压
+    - tomb_{n}.jsonl / tomb_{n}.idx：删除标记，只追加的日志
+    - manifest.json：当前热日志和删除标记的编号、冷数据段列表
+
+    热数据超过 HOT_WINDOW + SEGMENT_SIZE 条时，把较早的部分压缩成新数据段，
+    剩余记录写入新一代热日志，最后原子替换 manifest 作为唯一提交点；
+    中途崩溃只会留下未被引用的文件，已提交的数据不受影响。
+
+    删除一条记录只追加一条删除标记（序号和物理位置），读取时过滤掉；对外的位置
+    都是过滤后的逻辑位置。compact() 重写含有删除标记的数据段和热日志，
+    并随 manifest 一起切换到新一代（空的）删除标记日志。
+    """
+
+    def __init__(self, base_dir: str, hot_window: int = HOT_WINDOW, segment_size: int = SEGMENT_SIZE):
+        self.base_dir = base_dir
+        self.hot_window = hot_window
+        self.segment_size = segment_size
+        os.makedirs(base_dir, exist_ok=True)
+        self.log = HistoryLog(base_dir)
+        self._manifests: Dict[str, Dict] = {}
+        self._segment_cache: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._tombs: Dict[str, Dict] = {}
+
+    # ============ 内部工具 ============
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.base_dir, key)
+
+    def _manifest_path(self, key: str) -> str:
+        return os.path.join(self._dir(key), "manifest.json")
+
+    def _manifest(self, key: str) -> Dict:
+        manifest = self._manifests.get(key)
+        if manifest is not None:
+            return manifest
+
+        if os.path.exists(self._manifest_path(key)):
+            with open(self._manifest_path(key), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"hot": 0, "segments": [], "archived": 0, "tombstones": 0}
+            self._migrate_flat_log(key)
+        self._manifests[key] = manifest
+        return manifest
+
+    def _migrate_flat_log(self, key: str):
+        """把旧版 {base_dir}/{id}.jsonl 单文件日志移动到角色目录下作为第 0 代热日志"""
+        legacy_log = os.path.join(self.base_dir, f"{key}.jsonl")
+        if not os.path.exists(legacy_log):
+            return
+        os.makedirs(self._dir(key), exist_ok=True)
+        legacy_idx = os.path.join(self.base_dir, f"{key}.idx")
+        if os.path.exists(legacy_idx):
+            os.replace(legacy_idx, os.path.join(self._dir(key), "hot_0.idx"))
+        os.replace(legacy_log, os.path.join(self._dir(key), "hot_0.jsonl"))
+
+    def _commit(self, key: str, manifest: Dict):
+        """原子写入 manifest（提交点）"""
+        os.makedirs(self._dir(key), exist_ok=True)
+        atomic_write_json(self._manifest_path(key), manifest)
+        self._manifests[key] = manifest
+
+    @staticmethod
+    def _hot_key(key: str, manifest: Dict) -> str:
+        return f"{key}/hot_{manifest['hot']}"
+
+    @staticmethod
+    def _tomb_key(key: str, manifest: Dict) -> str:
+        return f"{key}/tomb_{manifest.get('tombstones', 0)}"
+
+    def _tombstones(self, key: str) -> Dict:
+        """尚未压实的删除标记：{"positions": 按升序排列的物理位置, "seqs": 序号集合}"""
+        tombs = self._tombs.get(key)
+        if tombs is None:
+            tomb_key = self._tomb_key(key, self._manifest(key))
+            entries = self.log.read(tomb_key, 0, self.log.count(tomb_key))
+            tombs = {
+                "positions": sorted(e["position"] for e in entries),
+                "seqs": {e["seq"] for e in entries},
+            }
+            self._tombs[key] = tombs
+        return tombs
+
+    def _segment_path(self, key: str, filename: str) -> str:
+        return os.path.join(self._dir(key), filename)
+
+    def _load_segment(self, key: str, filename: str) -> List[Dict]:
+        """解压冷数据段（带 LRU 缓存）"""
+        path = self._segment_path(key, filename)
+        records = self._segment_cache.get(path)
+        if records is not None:
+            self._segment_cache.move_to_end(path)
+            return records
+
+        with open(path, 'rb') as f:
+            records = decode_segment(f.read())
+        self._segment_cache[path] = records
+        while len(self._segment_cache) > SEGMENT_CACHE_SIZE:
+            self._segment_cache.popitem(last=False)
+        return records
+
+    def _write_segment(self, key: str, records: List[Dict]) -> Dict:
+        """写入新的冷数据段文件，返回 manifest 条目"""
+        filename = f"seg_{uuid4().hex[:12]}.jsonl.gz"
+        os.makedirs(self._dir(key), exist_ok=True)
+        atomic_write_bytes(self._segment_path(key, filename), encode_segment(records))
+        return {"file": filename, "count": len(records), "last_seq": records[-1].get("seq", 0)}
+
+    def _remove_file(self, key: str, filename: str):
+        path = self._segment_path(key, filename)
+        self._segment_cache.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # ============ 读取 ============
+
+    def _physical_count(self, key: str) -> int:
+        manifest = self._manifest(key)
+        return manifest["archived"] + self.log.count(self._hot_key(key, manifest))
+
+    def count(self, key: str) -> int:
+        """记录总条数（冷 + 热，不含已删除的记录）"""
+        return self._physical_count(key) - len(self._tombstones(key)["seqs"])
+
+    def read(self, key: str, start: int, end: int) -> List[Dict]:
+        """读取第 [start, end) 条记录（逻辑位置），只解压涉及到的冷数据段"""
+        tombs = self._tombstones(key)
+        if not tombs["seqs"]:
+            return self._read_physical(key, start, end)
+        start = max(start, 0)
+        if start >= end:
+            return []
+        positions = tombs["positions"]
+        records = self._read_physical(key, to_physical(positions, start), to_physical(positions, end))
+        return [r for r in records if r.get("seq") not in tombs["seqs"]]
+
+    def _read_physical(self, key: str, start: int, end: int) -> List[Dict]:
+        """按物理位置读取第 [start, end) 条记录（包括带删除标记的）"""
+        manifest = self._manifest(key)
+        start = max(start, 0)
+        records = []
+
+        position = 0
+        for segment in manifest["segments"]:
+            seg_start, seg_end = position, position + segment["count"]
+            position = seg_end
+            if seg_end <= start:
+                continue
+            if seg_start >= end:
+                break
+            data = self._load_segment(key, segment["file"])
+            records.extend(data[max(start - seg_start, 0):min(end, seg_end) - seg_start])
+
+        archived = manifest["archived"]
+        if end > archived:
+            hot_key = self._hot_key(key, manifest)
+            records.extend(self.log.read(hot_key, max(start - archived, 0), end - archived))
+        return records
+
+    def read_recent(self, key: str, n: int) -> List[Dict]:
+        """读取最近 n 条记录"""
+        total = self.count(key)
+        return self.read(key, max(total - n, 0), total)
+
+    def position_of_seq(self, key: str, seq: int) -> int:
+        """seq 小于给定值的记录条数（记录按 seq 递增排列，不含已删除的记录）"""
+        return to_logical(self._tombstones(key)["positions"], self._physical_position(key, seq))
+
+    def _physical_position(self, key: str, seq: int) -> int:
+        manifest = self._manifest(key)
+        position = 0
+        for segment in manifest["segments"]:
+            if segment.get("last_seq", 0) < seq:
+                position += segment["count"]
+                continue
+            records = self._load_segment(key, segment["file"])
+            return position + bisect_left([r["seq"] for r in records], seq)
+
+        # 热日志：按位置二分，每次只读一条记录
+        hot_key = self._hot_key(key, manifest)
+        low, high = 0, self.log.count(hot_key)
+        while low < high:
+            mid = (low + high) // 2
+            if self.log.read(hot_key, mid, mid + 1)[0]["seq"] < seq:
+                low = mid + 1
+            else:
+                high = mid
+        return position + low
+
+    # ============ 写入 ============
+
+    def append(self, key: str, records: List[Dict]):
+        """追加记录，必要时把旧的热数据滚动为冷数据段"""
+        if not records:
+            return
+        manifest = self._manifest(key)
+        os.makedirs(self._dir(key), exist_ok=True)
+        hot_key = self._hot_key(key, manifest)
+        self.log.append(hot_key, records)
+
+        hot_count = self.log.count(hot_key)
+        if hot_count >= self.hot_window + self.segment_size:
+            self._roll(key, manifest, hot_count)
+
+    def _roll(self, key: str, manifest: Dict, hot_count: int):
+        """把热日志中窗口以外的记录压缩成冷数据段"""
+        old_hot_key = self._hot_key(key, manifest)
+        records = self.log.read(old_hot_key, 0, hot_count)
+        n_roll = hot_count - self.hot_window
+
+        segment = self._write_segment(key, records[:n_roll])
+        # 滚动不改变记录的物理位置，删除标记原样保留
+        new_manifest = {
+            **manifest,
+            "hot": manifest["hot"] + 1,
+            "segments": manifest["segments"] + [segment],
+            "archived": manifest["archived"] + n_roll,
+        }
+        self.log.rewrite(self._hot_key(key, new_manifest), records[n_roll:])
+        self._commit(key, new_manifest)
+        self.log.delete(old_hot_key)
+
+    def rewrite(self, key: str, records: List[Dict]):
+        """用给定记录整体替换，重新切分冷数据段和热日志"""
+        manifest = self._manifest(key)
+        old_hot_key = self._hot_key(key, manifest)
+        n_cold = max(len(records) - self.hot_window, 0) // self.segment_size * self.segment_size
+
+        segments = [
+            self._write_segment(key, records[i:i + self.segment_size])
+            for i in range(0, n_cold, self.segment_size)
+        ]
+        new_manifest = {
+            "hot": manifest["hot"] + 1,
+            "segments": segments,
+            "archived": n_cold,
+            "tombstones": manifest.get("tombstones", 0) + 1,
+        }
+        self.log.rewrite(self._hot_key(key, new_manifest), records[n_cold:])
+        self._commit(key, new_manifest)
+        self._tombs[key] = {"positions": [], "seqs": set()}
+
+        self.log.delete(old_hot_key)
+        self.log.delete(self._tomb_key(key, manifest))
+        for segment in manifest["segments"]:
+            self._remove_file(key, segment["file"])
+
+    def delete_seq(self, key: str, seq: int) -> Optional[Dict]:
+        """按序号删除一条记录：只追加一条删除标记，不移动其他记录"""
+        tombs = self._tombstones(key)
+        if seq in tombs["seqs"]:
+            return None
+        position = self._physical_position(key, seq)
+        records = self._read_physical(key, position, position + 1)
+        if not records or records[0].get("seq") != seq:
+            return None
+
+        self.log.append(self._tomb_key(key, self._manifest(key)), [{"seq": seq, "position": position}])
+        insort(tombs["positions"], position)
+        tombs["seqs"].add(seq)
+        return records[0]
+
+    def tombstone_count(self, key: str) -> int:
+        """尚未压实的删除标记数量"""
+        return len(self._tombstones(key)["seqs"])
+
+    def load_tombstones(self):
+        """加载磁盘上尚未压实的删除标记（启动时调用），重启前留下的删除标记也会被 compacting_keys() 看到"""
+        for key in os.listdir(self.base_dir):
+            directory = self._dir(key)
+            if not os.path.isdir(directory):
+                continue
+            if any(name.startswith("tomb_") and name.endswith(".jsonl") for name in os.listdir(directory)):
+                self._tombstones(key)
+
+    def compacting_keys(self, threshold: int) -> List[str]:
+        """已加载的（启动时加载的和本进程写入的）删除标记不少于 threshold 条的 key"""
+        return [key for key, tombs in self._tombs.items() if len(tombs["seqs"]) >= threshold]
+
+    def compact(self, key: str) -> int:
+        """
+        物理删除带删除标记的记录，返回删除的条数
+
+        只重写含有删除标记的冷数据段和热日志，其余数据段原样保留；
+        新文件写好后原子替换 manifest，同时切换到新一代删除标记日志。
+        """
+        tombs = self._tombstones(key)
+        if not tombs["seqs"]:
+            return 0
+        manifest = self._manifest(key)
+        positions, seqs = tombs["positions"], tombs["seqs"]
+
+        segments = []
+        replaced = []
+        position = 0
+        for segment in manifest["segments"]:
+            seg_start, seg_end = position, position + segment["count"]
+            position = seg_end
+            if bisect_left(positions, seg_start) == bisect_left(positions, seg_end):
+                segments.append(segment)
+                continue
+            records = [r for r in self._load_segment(key, segment["file"]) if r["seq"] not in seqs]
+            if records:
+                segments.append(self._write_segment(key, records))
+            replaced.append(segment["file"])
+
+        new_manifest = {
+            **manifest,
+            "segments": segments,
+            "archived": sum(segment["count"] for segment in segments),
+            "tombstones": manifest.get("tombstones", 0) + 1,
+        }
+        old_hot_key = self._hot_key(key, manifest)
+        if positions[-1] >= manifest["archived"]:
+            # 热日志中也有删除标记：写入新一代热日志
+            records = self.log.read(old_hot_key, 0, self.log.count(old_hot_key))
+            new_manifest["hot"] = manifest["hot"] + 1
+            self.log.rewrite(self._hot_key(key, new_manifest), [r for r in records if r["seq"] not in seqs])
+        self._commit(key, new_manifest)
+        removed = len(seqs)
+        self._tombs[key] = {"positions": [], "seqs": set()}
+
+        # 提交之后再清理不再被引用的文件
+        self.log.delete(self._tomb_key(key, manifest))
+        if new_manifest["hot"] != manifest["hot"]:
+            self.log.delete(old_hot_key)
+        for filename in replaced:
+            self._remove_file(key, filename)
+        return removed
+
+    def delete(self, key: str):
+        """删除角色的全部记录"""
+        manifest = self._manifests.pop(key, None) or {"hot": 0}
+        self._tombs.pop(key, None)
+        self.log.delete(self._hot_key(key, manifest))
+        self.log.delete(self._tomb_key(key, manifest))
+        for path in list(self._segment_cache):
+            if path.startswith(self._dir(key) + os.sep):
+                del self._segment_cache[path]
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+        # 旧版单文件日志
+        self.log.delete(key)
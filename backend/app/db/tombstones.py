@@ -0,0 +1,21 @@
+from bisect import bisect_left
+from typing import List
+
+
+def to_physical(positions: List[int], logical: int) -> int:
+    """
+    逻辑位置（过滤删除标记后的第几条）换算为物理位置
+
+    positions 是已删除记录的物理位置，按升序排列。
+    """
+    physical = logical
+    for position in positions:
+        if position > physical:
+            break
+        physical += 1
+    return physical
+
+
+def to_logical(positions: List[int], physical: int) -> int:
+    """物理位置之前未被删除的记录条数"""
+    return physical - bisect_left(positions, physical)
@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -9,7 +10,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.api import characters, chat, tts, avatar, memory, image, generate, auth
-from app.db.database import init_db
+from app.db.database import init_db, close_db, run_cache_flusher, run_compactor
+from app.db.branches import close_branch_store
+from app.db.media import MEDIA_DIR, close_media_store, run_media_gc
+from app.db.summaries import close_summary_store
+from app.services.llm import get_llm_client, close_llm_client
+from app.services.search import close_search_index
+from app.services.semantic_search import run_semantic_indexer
+from app.services.cleanup import run_character_cleanup
+from app.services.summary import run_summarizer
 
 
 @asynccontextmanager
@@ -17,9 +26,31 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时初始化数据库
     init_db()
-    yield
-    # 关闭时清理资源
-    pass
+    # 所有 LLM 调用共用一个异步客户端和连接池
+    get_llm_client()
+    tasks = [
+        asyncio.create_task(run_cache_flusher()),
+        asyncio.create_task(run_compactor()),
+        asyncio.create_task(run_semantic_indexer()),
+        asyncio.create_task(run_character_cleanup()),
+        asyncio.create_task(run_media_gc()),
+        asyncio.create_task(run_summarizer()),
+    ]
+    try:
+        yield
+    finally:
+        # 关闭时先停止后台任务并等它们退出，再把缓存中剩余的数据落盘
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 取消不会中断已经放到线程中执行的工作（媒体垃圾回收、清理步骤等），等它们结束后再关闭存储
+        await asyncio.get_running_loop().shutdown_default_executor()
+        close_db()
+        close_search_index()
+        close_branch_store()
+        close_media_store()
+        close_summary_store()
+        await close_llm_client()
 
 
 app = FastAPI(
@@ -71,6 +102,17 @@ if os.path.exists(images_dir):
     app.mount("/images", StaticFiles(directory=images_dir), name="images")
 
 
+# 内容寻址的媒体文件（按内容哈希命名，内容不变，可以永久缓存）
+class ImmutableStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+app.mount("/media", ImmutableStaticFiles(directory=MEDIA_DIR), name="media")
+
+
 @app.get("/")
 async def root():
     return {
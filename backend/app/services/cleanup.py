@@ -0,0 +1,209 @@
+import os
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.db.database import get_character_store
+from app.db.locks import character_lock
+from app.db.branches import get_branch_store
+from app.db.media import get_media_store
+from app.db.summaries import get_summary_store
+from app.db.repository import DELETED_OWNER, owner_of
+from app.services.search import get_search_index
+from app.services.semantic_search import get_semantic_index
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 清理失败时的重试次数和首次重试间隔（秒，之后每次翻倍）
+CLEANUP_MAX_ATTEMPTS = int(os.getenv("CLEANUP_MAX_ATTEMPTS", "5"))
+CLEANUP_RETRY_DELAY = float(os.getenv("CLEANUP_RETRY_DELAY", "5"))
+
+# 以 "{角色ID}_" 开头命名的旧版媒体文件目录：头像、聊天图片、合成语音
+MEDIA_DIRS = ("static/avatars", "static/images", "static/audio")
+
+# 内存中保留的已结束任务状态条数
+CLEANUP_KEEP_FINISHED = 1000
+
+# 清理步骤按顺序执行，每步都可以重复执行；角色资料最后删除，
+# 中途失败或进程重启时仍能从删除分区找回未完成的角色
+CLEANUP_STEPS = ("memory", "semantic", "search", "branches", "summaries", "media", "store")
+
+
+def _remove_media(character_id: str, profile: Optional[Dict]):
+    """删除角色对内容寻址文件的引用（文件由垃圾回收清理），以及旧版的头像、聊天图片和合成语音"""
+    get_media_store().remove_refs(character_id)
+
+    prefix = character_id + "_"
+    for directory in MEDIA_DIRS:
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            if filename.startswith(prefix):
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    # 旧版创建角色前上传的头像以 temp_ 命名，按资料中的地址删除
+    avatar = (profile or {}).get("avatar")
+    if avatar and avatar.startswith("/avatars/"):
+        path = os.path.join(MEDIA_DIRS[0], os.path.basename(avatar))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _drop_memories(character_id: str):
+    """删除角色的长期记忆集合"""
+    try:
+        from app.services.memory import get_memory_service
+    except ImportError:
+        # 未安装 chromadb，没有记忆数据
+        return
+    get_memory_service().delete_collections(character_id)
+
+
+def _new_job(character_id: str, owner_id: str, created_at: Optional[str]) -> Dict:
+    return {
+        "character_id": character_id,
+        "owner_id": owner_id,
+        "status": "pending",
+        "completed_steps": [],
+        "attempts": 0,
+        "error": None,
+        "created_at": created_at,
+        "finished_at": None,
+    }
+
+
+class CharacterCleanup:
+    """
+    删除角色后的级联清理
+
+    删除接口只把角色移入删除分区（用户立即看不到），然后把清理任务放入队列立即返回；
+    后台任务依次删除记忆集合、语义和全文索引、对话分支和摘要、媒体文件，最后删除角色资料
+    和聊天记录。失败的步骤按指数退避重试，已完成的步骤不再重复执行。
+    进程重启后从删除分区重新排队未完成的角色。
+    """
+
+    def __init__(self):
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self.jobs: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def enqueue(self, character_id: str, owner_id: str) -> Dict:
+        """把角色放入清理队列，返回任务状态；已在队列中时直接返回"""
+        job = self.jobs.get(character_id)
+        if job is not None and job["status"] in ("pending", "running", "retrying"):
+            return job
+
+        job = _new_job(character_id, owner_id, datetime.now().isoformat())
+        self.jobs[character_id] = job
+        self.jobs.move_to_end(character_id)
+        self._prune()
+        self.queue.put_nowait(character_id)
+        return job
+
+    def status(self, character_id: str) -> Optional[Dict]:
+        """
+        任务状态
+
+        任务状态只保存在内存中；进程重启后、任务重新排队之前，
+        从删除分区中仍未清理完的角色推出一个等待中的状态。
+        """
+        job = self.jobs.get(character_id)
+        if job is not None:
+            return job
+        profile = get_character_store().get(character_id)
+        if profile is None or owner_of(profile) != DELETED_OWNER:
+            return None
+        return _new_job(character_id, profile.get("deleted_owner_id") or DELETED_OWNER, profile.get("deleted_at"))
+
+    def _prune(self):
+        finished = [cid for cid, job in self.jobs.items() if job["status"] in ("done", "failed")]
+        for character_id in finished[:max(len(finished) - CLEANUP_KEEP_FINISHED, 0)]:
+            del self.jobs[character_id]
+
+    def recover(self):
+        """重新排队删除分区中尚未清理完的角色（启动时调用）"""
+        for summary in get_character_store().list_summaries(DELETED_OWNER):
+            profile = get_character_store().get(summary["id"]) or {}
+            self.enqueue(summary["id"], profile.get("deleted_owner_id") or DELETED_OWNER)
+
+    async def _step(self, step: str, character_id: str, profile: Optional[Dict]):
+        if step == "memory":
+            await asyncio.to_thread(_drop_memories, character_id)
+        elif step == "semantic":
+            semantic = get_semantic_index()
+            if semantic is not None:
+                await asyncio.to_thread(semantic.remove_character, character_id)
+        elif step == "search":
+            get_search_index().remove_character(character_id)
+        elif step == "branches":
+            get_branch_store().remove_character(character_id)
+        elif step == "summaries":
+            get_summary_store().remove_character(character_id)
+        elif step == "media":
+            await asyncio.to_thread(_remove_media, character_id, profile)
+        elif step == "store":
+            async with character_lock(character_id):
+                get_character_store().delete(character_id)
+
+    async def _run_job(self, job: Dict):
+        character_id = job["character_id"]
+        job["status"] = "running"
+        job["attempts"] += 1
+        profile = get_character_store().get(character_id)
+        for step in CLEANUP_STEPS:
+            if step in job["completed_steps"]:
+                continue
+            try:
+                await self._step(step, character_id, profile)
+            except Exception as e:
+                job["error"] = f"{step}: {e}"
+                print(f"清理角色 {character_id} 失败（第 {job['attempts']} 次）: {job['error']}")
+                if job["attempts"] >= CLEANUP_MAX_ATTEMPTS:
+                    job["status"] = "failed"
+                    job["finished_at"] = datetime.now().isoformat()
+                else:
+                    job["status"] = "retrying"
+                    delay = CLEANUP_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                    asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, character_id)
+                return
+            job["completed_steps"].append(step)
+
+        job["status"] = "done"
+        job["error"] = None
+        job["finished_at"] = datetime.now().isoformat()
+
+    async def run(self):
+        """后台任务：逐个执行队列中的清理任务"""
+        while True:
+            character_id = await self.queue.get()
+            job = self.jobs.get(character_id)
+            if job is None or job["status"] in ("done", "failed"):
+                continue
+            await self._run_job(job)
+
+
+# 全局实例
+_character_cleanup: Optional[CharacterCleanup] = None
+
+
+def get_character_cleanup() -> CharacterCleanup:
+    """获取角色清理队列实例"""
+    global _character_cleanup
+    if _character_cleanup is None:
+        _character_cleanup = CharacterCleanup()
+    return _character_cleanup
+
+
+async def run_character_cleanup():
+    """后台清理任务：先找回上次未完成的角色，再处理新的删除"""
+    cleanup = get_character_cleanup()
+    try:
+        cleanup.recover()
+    except Exception as e:
+        print(f"恢复角色清理任务失败: {e}")
+    await cleanup.run()
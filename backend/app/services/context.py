@@ -0,0 +1,120 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db.branches import BranchHistory
+from app.db.message import MESSAGE_OVERHEAD, estimate_tokens, message_tokens
+from app.db.summaries import get_summary_store
+from app.services.prompt import MEMORY_FOOTER, MEMORY_HEADER, SUMMARY_HEADER, get_prompt_compiler, memory_line
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 发给模型的上下文（人设 + 记忆 + 对话摘要 + 历史对话 + 用户消息）的 token 预算，不含回复的 MAX_TOKENS
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+# 记忆最多占用的 token 数
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "500"))
+# 历史对话最多取的条数（预算很大时的上限）
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "200"))
+# 从存储按批向前读取历史对话，每批条数
+CONTEXT_BATCH_SIZE = 16
+
+# 每张图片按高清模式的典型开销计算
+IMAGE_TOKENS = 765
+
+
+def content_tokens(content: Any) -> int:
+    """用户消息的 token 数，content 可以是文字或多模态的片段列表"""
+    if content is None:
+        return 0
+    if isinstance(content, list):
+        tokens = MESSAGE_OVERHEAD
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += estimate_tokens(part.get("text", ""))
+        return tokens
+    return estimate_tokens(content) + MESSAGE_OVERHEAD
+
+
+def pack_memories(memories: Optional[List[Dict]], budget: int) -> Tuple[List[Dict], int]:
+    """按检索顺序（相关度从高到低）选取放得下的记忆，返回 (记忆, 占用的 token 数)"""
+    if not memories:
+        return [], 0
+    used = estimate_tokens(MEMORY_HEADER) + estimate_tokens(MEMORY_FOOTER) + MESSAGE_OVERHEAD
+    packed = []
+    for memory in memories:
+        cost = estimate_tokens(memory_line(memory))
+        if used + cost > budget:
+            continue
+        packed.append(memory)
+        used += cost
+    if not packed:
+        return [], 0
+    return packed, used
+
+
+def pack_history(
+    history: BranchHistory,
+    budget: int,
+    before_seq: Optional[int] = None,
+    max_messages: int = CONTEXT_MAX_MESSAGES,
+    after_seq: int = 0
+) -> List[Dict]:
+    """
+    从最新一条（或 before_seq 之前）开始向前取历史对话，直到用完 token 预算或到达 after_seq
+
+    每条消息的 token 数在写入时已经算好，按批读取、放不下就停止，
+    开销只和实际放进上下文的条数有关。返回时间正序的消息。
+    """
+    kept: List[Dict] = []
+    used = 0
+    while len(kept) < max_messages:
+        limit = min(CONTEXT_BATCH_SIZE, max_messages - len(kept))
+        batch = history.get_messages_before(before_seq, limit)
+        for message in reversed(batch):
+            cost = message_tokens(message)
+            if message["seq"] <= after_seq or used + cost > budget:
+                return kept[::-1]
+            used += cost
+            kept.append(message)
+        if len(batch) < limit:
+            break
+        before_seq = batch[0]["seq"]
+    return kept[::-1]
+
+
+def build_context(
+    character: Dict,
+    history: BranchHistory,
+    user_content: Any = None,
+    memories: Optional[List[Dict]] = None,
+    before_seq: Optional[int] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET
+) -> List[Dict]:
+    """
+    在 token 预算内组装发给模型的消息列表
+
+    人设和用户消息必须保留，剩余预算先分给记忆（不超过 MEMORY_TOKEN_BUDGET）；
+    有滚动摘要时放入摘要，摘要已经包含的消息不再以原文放入，最后用最近的历史对话填满。
+    """
+    compiler = get_prompt_compiler()
+    remaining = budget - compiler.persona_tokens(character) - MESSAGE_OVERHEAD - content_tokens(user_content)
+
+    packed_memories, memory_tokens = pack_memories(memories, min(MEMORY_TOKEN_BUDGET, max(remaining, 0)))
+    remaining -= memory_tokens
+
+    summary = get_summary_store().for_history(history)
+    if summary is not None and before_seq is not None and summary["covered_seq"] >= before_seq:
+        summary = None
+    after_seq = 0
+    if summary is not None:
+        remaining -= summary["tokens"] + estimate_tokens(SUMMARY_HEADER) + MESSAGE_OVERHEAD
+        after_seq = summary["covered_seq"]
+
+    chat_history = pack_history(history, max(remaining, 0), before_seq, after_seq=after_seq)
+    return compiler.build_messages(
+        character, chat_history, user_content, packed_memories,
+        summary["summary"] if summary is not None else None
+    )
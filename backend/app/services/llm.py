@@ -0,0 +1,58 @@
+import os
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# 连接池：最多 LLM_MAX_CONNECTIONS 个并发连接，保留 LLM_MAX_KEEPALIVE 个空闲连接复用（免去重复的 TLS 握手）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# 单次请求超时（秒），建立连接单独限制为 10 秒
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+
+def create_llm_client(api_key: str = OPENAI_API_KEY) -> AsyncOpenAI:
+    """创建使用共享连接池的异步客户端"""
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+# 全局实例（由应用生命周期创建和关闭，所有调用共用一个连接池）
+_llm_client: Optional[AsyncOpenAI] = None
+
+
+def get_llm_client() -> Optional[AsyncOpenAI]:
+    """获取异步 OpenAI 客户端，没有配置 API Key 时返回 None"""
+    global _llm_client
+    if _llm_client is None and OPENAI_API_KEY:
+        _llm_client = create_llm_client()
+    return _llm_client
+
+
+async def close_llm_client():
+    """关闭客户端和连接池"""
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.close()
+        _llm_client = None
@@ -215,6 +215,17 @@ class MemoryService:
             print(f"清除记忆失败: {e}")
             return False
 
+    def delete_collections(self, character_id: str):
+        """删除角色的记忆集合（包括备用集合），集合不存在时忽略，其他错误抛出"""
+        self.collections.pop(character_id, None)
+        for collection_name in (f"memory_{character_id}", f"memory_{character_id}_backup"):
+            try:
+                self.client.delete_collection(collection_name)
+            except Exception as e:
+                # 各版本 chromadb 对不存在的集合抛出的异常类型不同，按错误信息判断
+                if "does not exist" not in str(e):
+                    raise
+
 
 # 单例实例
 _memory_service: Optional[MemoryService] = None
@@ -228,22 +239,20 @@ def get_memory_service() -> MemoryService:
     return _memory_service
 
 
-def _analyze_with_ai(user_message: str, ai_response: str, personality: Dict) -> List[Dict]:
+async def _analyze_with_ai(user_message: str, ai_response: str, personality: Dict) -> List[Dict]:
     """
     使用 AI 分析对话，提取重要记忆
 
     Returns:
         List of memory dicts with keys: content, memory_type, importance
     """
-    import openai
+    from app.services.llm import get_llm_client
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    client = get_llm_client()
+    if client is None:
         # 如果没有 API key，返回空列表，使用关键词回退
         return []
 
-    client = openai.OpenAI(api_key=api_key)
-
     personality_str = ", ".join([f"{k}: {v}" for k, v in personality.items() if v])
 
     prompt = f"""你是一个记忆分析专家。从以下对话中提取重要信息，生成结构化的记忆。
@@ -280,7 +289,7 @@ def _analyze_with_ai(user_message: str, ai_response: str, personality: Dict) ->
 """
 
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=os.getenv("MODEL_NAME", "gpt-3.5-turbo"),
             messages=[
                 {
@@ -341,7 +350,7 @@ def _keyword_fallback_analyze(user_message: str, ai_response: str) -> List[Dict]
     return memories
 
 
-def analyze_and_store_memory(
+async def analyze_and_store_memory(
     character_id: str,
     user_message: str,
     ai_response: str,
@@ -355,7 +364,7 @@ def analyze_and_store_memory(
     memory_service = get_memory_service()
 
     # 先尝试 AI 分析
-    ai_memories = _analyze_with_ai(user_message, ai_response, personality)
+    ai_memories = await _analyze_with_ai(user_message, ai_response, personality)
 
     memories_to_store = []
 
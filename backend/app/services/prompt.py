@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db.message import estimate_tokens
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 缓存编译好的人设提示词的角色数
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1000"))
+
+# 滚动摘要的说明
+SUMMARY_HEADER = "【之前的对话摘要】\n"
+
+# 记忆上下文的首尾说明
+MEMORY_HEADER = "【重要记忆】\n"
+MEMORY_FOOTER = "\n请根据以上记忆来回复，展现你对用户的了解和关心。\n"
+
+
+def persona_version(character: Dict) -> Tuple:
+    """参与人设提示词的字段，任一字段变化即视为新版本"""
+    personality = character.get("personality", {})
+    hobbies = character.get("hobbies", [])
+    return (
+        character.get("name", "AI伴侣"),
+        character.get("gender", "女性"),
+        character.get("age", 25),
+        character.get("appearance", ""),
+        tuple(personality.items()) if isinstance(personality, dict) else (),
+        tuple(hobbies) if hobbies else (),
+        character.get("background", ""),
+        character.get("relationship_type", "朋友"),
+    )
+
+
+def compile_persona(character: Dict) -> str:
+    """编译角色人设（不含任何随对话变化的内容）"""
+    name, gender, age, appearance, personality, hobbies, background, relationship_type = persona_version(character)
+
+    parts = [
+        f"你是{name}，一个{gender}性角色。\n\n",
+        "基本信息：\n",
+        f"- 年龄：{age}岁\n",
+        f"- 外貌：{appearance if appearance else '普通'}\n\n",
+        "性格特点：\n",
+    ]
+    for trait, desc in personality:
+        if desc:
+            parts.append(f"- {trait}: {desc}\n")
+    parts.append(f"\n爱好：{', '.join(hobbies) if hobbies else '暂无'}\n")
+    parts.append(f"\n背景：{background if background else '未知'}\n")
+    parts.append(f"""
+你们的关系是：{relationship_type}
+
+请用符合你性格特点的方式回复，保持自然、真实、有情感。
+回复要简洁温馨，不要太长。
+""")
+    return "".join(parts)
+
+
+def memory_line(memory: Dict) -> str:
+    content = memory.get("content", "")
+    mtype = memory.get("metadata", {}).get("type", "")
+    return f"- [{mtype}] {content}\n"
+
+
+def build_memory_context(memories: Optional[List[Dict]]) -> Optional[str]:
+    """把检索到的记忆整理成一段上下文，没有记忆时返回 None"""
+    if not memories:
+        return None
+    return "".join([MEMORY_HEADER, *(memory_line(mem) for mem in memories), MEMORY_FOOTER])
+
+
+class PromptCompiler:
+    """
+    人设提示词编译器
+
+    人设部分按角色版本（persona_version）编译一次后缓存，之后每轮对话直接复用同一个字符串。
+    消息列表按变化频率排列：人设（不变）→ 对话摘要（偶尔更新）→ 历史对话（只在末尾追加）→ 本轮的记忆 → 用户消息，
+    每轮请求的前缀保持一致，可以命中服务端的提示词缓存。
+    """
+
+    def __init__(self, max_size: int = PROMPT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[Tuple, str, int]]" = OrderedDict()
+
+    def _compiled(self, character: Dict) -> Tuple[Tuple, str, int]:
+        """(版本, 人设提示词, token 数)，版本未变时返回缓存"""
+        character_id = character.get("id", "")
+        version = persona_version(character)
+        with self._lock:
+            cached = self._cache.get(character_id)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(character_id)
+                return cached
+
+        prompt = compile_persona(character)
+        compiled = (version, prompt, estimate_tokens(prompt))
+        with self._lock:
+            self._cache[character_id] = compiled
+            self._cache.move_to_end(character_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return compiled
+
+    def persona(self, character: Dict) -> str:
+        """角色的人设提示词"""
+        return self._compiled(character)[1]
+
+    def persona_tokens(self, character: Dict) -> int:
+        """人设提示词的 token 数（随编译结果一起缓存）"""
+        return self._compiled(character)[2]
+
+    def build_messages(
+        self,
+        character: Dict,
+        history: List[Dict],
+        user_content: Any = None,
+        memories: Optional[List[Dict]] = None,
+        summary: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        组装发给模型的消息列表
+
+        history 是按时间顺序的聊天记录，summary 是更早对话的滚动摘要（放在历史对话之前，
+        每折叠一批才变化一次）；user_content 为 None 时（如重新生成回复）不追加用户消息。
+        """
+        messages = [{"role": "system", "content": self.persona(character)}]
+        if summary:
+            messages.append({"role": "system", "content": SUMMARY_HEADER + summary})
+        for chat in history:
+            messages.append({"role": chat["role"], "content": chat["content"]})
+
+        context = build_memory_context(memories)
+        if context is not None:
+            messages.append({"role": "system", "content": context})
+        if user_content is not None:
+            messages.append({"role": "user", "content": user_content})
+        return messages
+
+
+# 全局实例
+_prompt_compiler: Optional[PromptCompiler] = None
+
+
+def get_prompt_compiler() -> PromptCompiler:
+    """获取提示词编译器实例"""
+    global _prompt_compiler
+    if _prompt_compiler is None:
+        _prompt_compiler = PromptCompiler()
+    return _prompt_compiler
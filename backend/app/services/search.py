@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.db.repository import CharacterStore
+from app.services.tokenizer import tokenize, query_tokens
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 全文索引数据库（与角色存储后端无关）
+SEARCH_DB_PATH = os.getenv("SEARCH_DB_PATH", os.path.join("data", "search.db"))
+
+# 补建索引时每批读取的消息条数
+SYNC_BATCH_SIZE = 500
+
+SCHEMA = """
+-- 已索引的消息，id 同时作为全文索引表的 rowid
+CREATE TABLE IF NOT EXISTS indexed_messages (
+    id INTEGER PRIMARY KEY,
+    character_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    UNIQUE (character_id, seq)
+);
+
+-- 每个角色已连续索引到的消息序号
+CREATE TABLE IF NOT EXISTS index_state (
+    character_id TEXT PRIMARY KEY,
+    indexed_seq INTEGER NOT NULL
+);
+
+-- 倒排索引：tokens 是预先分好并以空格分隔的词
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+    tokens,
+    tokenize = 'unicode61 remove_diacritics 0'
+);
+"""
+
+
+class SearchIndex:
+    """
+    聊天记录全文检索
+
+    消息内容经 tokenizer 归一化并切词（中文 bigram、拉丁文单词）后写入 SQLite FTS5
+    倒排索引，检索只访问查询词的倒排列表，按 BM25 排序分页返回命中的角色和消息序号。
+
+    新消息在追加时写入索引；index_state 记录每个角色已连续索引到的序号，
+    检索前用 sync() 补齐遗漏的消息（包括建立索引之前的历史记录）。
+    补齐过的角色记在内存中，之后的写入保持连续时跨角色检索不再逐个访问存储。
+    """
+
+    def __init__(self, path: str = SEARCH_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # 本进程内已补齐、之后的写入都连续的角色
+        self._synced: Set[str] = set()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    # ============ 写入 ============
+
+    def _indexed_seq(self, character_id: str) -> int:
+        row = self.conn.execute(
+            "SELECT indexed_seq FROM index_state WHERE character_id = ?", (character_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _set_indexed_seq(self, character_id: str, seq: int):
+        self.conn.execute(
+            "INSERT INTO index_state (character_id, indexed_seq) VALUES (?, ?) "
+            "ON CONFLICT (character_id) DO UPDATE SET indexed_seq = excluded.indexed_seq",
+            (character_id, seq)
+        )
+
+    def _insert(self, character_id: str, messages: List[Dict]):
+        for message in messages:
+            tokens = tokenize(message.get("content") or "")
+            if not tokens:
+                continue
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO indexed_messages (character_id, seq) VALUES (?, ?)",
+                (character_id, message["seq"])
+            )
+            if cursor.rowcount:
+                self.conn.execute(
+                    "INSERT INTO message_fts (rowid, tokens) VALUES (?, ?)",
+                    (cursor.lastrowid, " ".join(tokens))
+                )
+
+    def add_messages(self, character_id: str, messages: List[Dict]):
+        """写入新追加的消息（需带 seq）"""
+        if not messages:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(character_id, messages)
+                # 只有与已索引部分连续时才推进同步位置，否则留给 sync() 补齐中间的缺口
+                indexed_seq = self._indexed_seq(character_id)
+                if messages[0]["seq"] <= indexed_seq + 1:
+                    self._set_indexed_seq(character_id, max(indexed_seq, messages[-1]["seq"]))
+                else:
+                    self._synced.discard(character_id)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                self._synced.discard(character_id)
+                raise
+            self.conn.execute("COMMIT")
+
+    def mark_stale(self, character_id: str):
+        """新消息没能写入索引时调用，下次检索前重新补齐"""
+        with self._lock:
+            self._synced.discard(character_id)
+
+    def sync(self, store: CharacterStore, character_id: str):
+        """从存储中补齐尚未索引的消息"""
+        last_seq = store.last_seq(character_id)
+        with self._lock:
+            indexed_seq = self._indexed_seq(character_id)
+        while indexed_seq < last_seq:
+            batch = store.get_messages_after(character_id, indexed_seq, SYNC_BATCH_SIZE)
+            indexed_seq = batch[-1]["seq"] if batch else last_seq
+            with self._lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._insert(character_id, batch)
+                    self._set_indexed_seq(character_id, max(indexed_seq, self._indexed_seq(character_id)))
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                self.conn.execute("COMMIT")
+        with self._lock:
+            self._synced.add(character_id)
+
+    def ensure_synced(self, store: CharacterStore, character_id: str):
+        """本进程内还没有补齐过（或之后的写入出现缺口）时才调用 sync()"""
+        with self._lock:
+            if character_id in self._synced:
+                return
+        self.sync(store, character_id)
+
+    def remove_message(self, character_id: str, seq: int):
+        """删除一条消息的索引"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id FROM indexed_messages WHERE character_id = ? AND seq = ?", (character_id, seq)
+            ).fetchone()
+            if row is None:
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM message_fts WHERE rowid = ?", (row[0],))
+            self.conn.execute("DELETE FROM indexed_messages WHERE id = ?", (row[0],))
+            self.conn.execute("COMMIT")
+
+    def remove_character(self, character_id: str):
+        """删除角色的全部索引（清空聊天记录或删除角色时）"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute(
+                "DELETE FROM message_fts WHERE rowid IN "
+                "(SELECT id FROM indexed_messages WHERE character_id = ?)",
+                (character_id,)
+            )
+            self.conn.execute("DELETE FROM indexed_messages WHERE character_id = ?", (character_id,))
+            self.conn.execute("DELETE FROM index_state WHERE character_id = ?", (character_id,))
+            self.conn.execute("COMMIT")
+            self._synced.discard(character_id)
+
+    # ============ 检索 ============
+
+    def search(self, query: str, character_ids: List[str], offset: int = 0, limit: int = 20) -> Tuple[int, List[Dict]]:
+        """
+        检索角色的聊天记录
+
+        所有查询词都要命中；按相关度排序，相关度相同时新消息在前。
+        返回 (命中总数, [{"character_id", "seq", "score"}])。
+        """
+        tokens = query_tokens(query)
+        if not tokens or not character_ids:
+            return 0, []
+
+        match = " ".join(f'"{token}"' for token in tokens)
+        placeholders = ", ".join("?" for _ in character_ids)
+        where = (
+            "FROM message_fts JOIN indexed_messages m ON m.id = message_fts.rowid "
+            f"WHERE message_fts MATCH ? AND m.character_id IN ({placeholders})"
+        )
+        params = [match, *character_ids]
+
+        with self._lock:
+            total = self.conn.execute(f"SELECT COUNT(*) {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT m.character_id, m.seq, bm25(message_fts) AS rank {where} "
+                "ORDER BY rank, m.seq DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset]
+            ).fetchall()
+        # bm25() 越小越相关，对外返回取反后的分数
+        return total, [{"character_id": row[0], "seq": row[1], "score": -row[2]} for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+# 全局实例
+_search_index: Optional[SearchIndex] = None
+
+
+def get_search_index() -> SearchIndex:
+    """获取全文检索索引实例"""
+    global _search_index
+    if _search_index is None:
+        _search_index = SearchIndex()
+    return _search_index
+
+
+def close_search_index():
+    """关闭全文检索索引"""
+    global _search_index
+    if _search_index is not None:
+        _search_index.close()
+        _search_index = None
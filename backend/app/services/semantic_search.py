@@ -0,0 +1,207 @@
+import os
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.db.database import get_character_store
+from app.db.locks import character_lock
+from app.db.repository import CharacterStore
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 语义检索是可选功能，默认关闭（需要 chromadb 及其默认的向量模型）
+SEMANTIC_SEARCH = os.getenv("SEMANTIC_SEARCH", "false").lower() in ("1", "true", "yes")
+SEMANTIC_INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", os.path.join("data", "semantic"))
+
+# 每批向量化的消息条数，以及凑批时最多等待的秒数
+SEMANTIC_BATCH_SIZE = int(os.getenv("SEMANTIC_BATCH_SIZE", "32"))
+SEMANTIC_BATCH_WAIT = float(os.getenv("SEMANTIC_BATCH_WAIT", "2.0"))
+# 补建历史索引时每批之间的间隔（秒），避免占满 CPU 影响对话
+SEMANTIC_BACKFILL_DELAY = float(os.getenv("SEMANTIC_BACKFILL_DELAY", "0.5"))
+# 待向量化队列的上限，超出后该角色的新消息不再入队，队列空闲时从存储补齐
+SEMANTIC_QUEUE_SIZE = 10000
+
+
+class SemanticHistoryIndex:
+    """
+    聊天记录语义检索
+
+    每条消息向量化一次，以 (character_id, seq) 存入 Chroma：每个角色一个集合，
+    文档ID为消息序号。追加消息时只放入内存队列，由后台任务按批向量化，
+    对话请求不等待索引。
+    """
+
+    def __init__(self, path: str = SEMANTIC_INDEX_DIR):
+        import chromadb
+
+        os.makedirs(path, exist_ok=True)
+        self.client = chromadb.PersistentClient(path=path)
+        self.queue: "asyncio.Queue[Tuple[str, Dict]]" = asyncio.Queue(maxsize=SEMANTIC_QUEUE_SIZE)
+        self.backfills: Dict[str, Dict] = {}
+        # 队列满时没能入队的角色 -> 已入队的最后一个序号，之后的消息由 run() 从存储补齐
+        self._overflow: Dict[str, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _collection(self, character_id: str):
+        return self.client.get_or_create_collection(name=f"history_{character_id}")
+
+    # ============ 写入 ============
+
+    def enqueue(self, character_id: str, messages: List[Dict]):
+        """
+        把新消息放入待向量化队列（不阻塞）
+
+        队列满时记下该角色已入队的位置，之后的消息合并为一次补齐，不再逐条入队。
+        """
+        for message in messages:
+            if character_id in self._overflow:
+                return
+            try:
+                self.queue.put_nowait((character_id, message))
+            except asyncio.QueueFull:
+                self._overflow[character_id] = message["seq"] - 1
+                print(f"语义索引队列已满，{character_id} 从 #{message['seq']} 起的消息稍后从存储补齐")
+
+    def _add(self, character_id: str, messages: List[Dict]):
+        """向量化并写入（同一消息重复写入时覆盖）"""
+        messages = [m for m in messages if m.get("content")]
+        if not messages:
+            return
+        self._collection(character_id).upsert(
+            ids=[str(m["seq"]) for m in messages],
+            documents=[m["content"] for m in messages],
+            metadatas=[{"seq": m["seq"], "role": m.get("role", "")} for m in messages]
+        )
+
+    def _add_batch(self, batch: List[Tuple[str, Dict]]):
+        by_character: Dict[str, List[Dict]] = {}
+        for character_id, message in batch:
+            by_character.setdefault(character_id, []).append(message)
+        for character_id, messages in by_character.items():
+            self._add(character_id, messages)
+
+    async def run(self):
+        """后台任务：从队列按批取出消息并向量化"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + SEMANTIC_BATCH_WAIT
+            while len(batch) < SEMANTIC_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                # 向量化是 CPU 密集的同步调用，放到线程中执行
+                await asyncio.to_thread(self._add_batch, batch)
+            except Exception as e:
+                print(f"写入语义索引失败: {e}")
+            if self._overflow and self.queue.empty():
+                await self._catch_up(get_character_store())
+
+    async def _read_after(self, store: CharacterStore, character_id: str, after_seq: int) -> List[Dict]:
+        """在角色锁内、线程池中从存储读取 after_seq 之后的一批消息"""
+        async with character_lock(character_id):
+            return await asyncio.to_thread(store.get_messages_after, character_id, after_seq, SEMANTIC_BATCH_SIZE)
+
+    async def _catch_up(self, store: CharacterStore):
+        """补齐队列满时没有入队的消息"""
+        for character_id in list(self._overflow):
+            try:
+                while character_id in self._overflow:
+                    after_seq = self._overflow[character_id]
+                    batch = await self._read_after(store, character_id, after_seq)
+                    if character_id not in self._overflow:
+                        # 补齐期间角色被删除
+                        break
+                    if not batch:
+                        # 读到末尾；此后追加的消息重新逐条入队
+                        del self._overflow[character_id]
+                        break
+                    self._overflow[character_id] = batch[-1]["seq"]
+                    await asyncio.to_thread(self._add, character_id, batch)
+            except Exception as e:
+                print(f"补齐语义索引失败: {e}")
+
+    def remove_message(self, character_id: str, seq: int):
+        """删除一条消息的向量"""
+        self._collection(character_id).delete(ids=[str(seq)])
+
+    def remove_character(self, character_id: str):
+        """删除角色的全部向量"""
+        self._overflow.pop(character_id, None)
+        try:
+            self.client.delete_collection(f"history_{character_id}")
+        except Exception:
+            # 集合不存在
+            pass
+
+    # ============ 补建 ============
+
+    async def _backfill(self, store: CharacterStore, character_id: str, status: Dict):
+        after_seq = 0
+        try:
+            while True:
+                batch = await self._read_after(store, character_id, after_seq)
+                if not batch:
+                    break
+                await asyncio.to_thread(self._add, character_id, batch)
+                after_seq = batch[-1]["seq"]
+                status["indexed"] += len(batch)
+                await asyncio.sleep(SEMANTIC_BACKFILL_DELAY)
+            status["status"] = "done"
+        except Exception as e:
+            status["status"] = "failed"
+            status["error"] = str(e)
+
+    def start_backfill(self, store: CharacterStore, character_id: str) -> Dict:
+        """为已有的聊天记录补建索引（限速的后台任务），返回任务状态"""
+        status = self.backfills.get(character_id)
+        if status is not None and status["status"] == "running":
+            return status
+
+        status = {"status": "running", "indexed": 0}
+        self.backfills[character_id] = status
+        task = asyncio.create_task(self._backfill(store, character_id, status))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return status
+
+    # ============ 检索 ============
+
+    def search(self, character_id: str, query: str, n_results: int = 10) -> List[Dict]:
+        """返回语义上最接近的消息 [{"character_id", "seq", "distance"}]"""
+        collection = self._collection(character_id)
+        count = collection.count()
+        if count == 0:
+            return []
+        results = collection.query(query_texts=[query], n_results=min(n_results, count))
+        return [
+            {"character_id": character_id, "seq": meta["seq"], "distance": distance}
+            for meta, distance in zip(results["metadatas"][0], results["distances"][0])
+        ]
+
+
+# 全局实例
+_semantic_index: Optional[SemanticHistoryIndex] = None
+
+
+def get_semantic_index() -> Optional[SemanticHistoryIndex]:
+    """获取语义检索实例，未启用时返回 None"""
+    global _semantic_index
+    if not SEMANTIC_SEARCH:
+        return None
+    if _semantic_index is None:
+        _semantic_index = SemanticHistoryIndex()
+    return _semantic_index
+
+
+async def run_semantic_indexer():
+    """后台向量化任务（未启用语义检索时直接返回）"""
+    index = get_semantic_index()
+    if index is not None:
+        await index.run()
@@ -0,0 +1,166 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.db.database import get_character_store
+from app.db.branches import BranchHistory, get_history
+from app.db.summaries import SummaryStore, get_summary_store
+from app.services.context import pack_history
+from app.services.llm import get_llm_client
+
+# 加载环境变量
+from dotenv import load_dotenv
+load_dotenv()
+
+# 滚动摘要：最近 SUMMARY_WINDOW_TOKENS 个 token 的对话保留原文，更早的对话每攒够 SUMMARY_BATCH_SIZE 条
+# 由后台任务按顺序折叠进摘要
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_WINDOW_TOKENS = int(os.getenv("SUMMARY_WINDOW_TOKENS", "2000"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "10"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL") or os.getenv("MODEL_NAME", "gpt-3.5-turbo")
+
+# 折叠时每条消息最多取的字数（长篇粘贴只保留开头）
+SUMMARY_MESSAGE_CHARS = 500
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你负责维护一段对话的滚动摘要。根据已有摘要和新增的对话，输出更新后的完整摘要："
+    "保留用户的重要信息（身份、喜好、经历、计划、情绪）、双方关系的进展和尚未结束的话题，"
+    "省略寒暄和重复内容。用第三人称、不超过 300 字，只输出摘要本身。"
+)
+
+# 调用模型的函数：接收消息列表，返回生成的文字（测试时可以替换为桩函数）
+CompleteFn = Callable[[List[Dict]], Awaitable[str]]
+
+
+async def complete_with_llm(messages: List[Dict]) -> str:
+    """用共享的 OpenAI 客户端生成摘要"""
+    client = get_llm_client()
+    if client is None:
+        raise RuntimeError("OpenAI API Key 未配置")
+    response = await client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=messages,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0.3,
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+def build_fold_prompt(summary: Optional[str], messages: List[Dict]) -> List[Dict]:
+    """把已有摘要和新增的一批对话组装成摘要请求"""
+    lines = []
+    for message in messages:
+        speaker = "用户" if message["role"] == "user" else "助手"
+        lines.append(f"{speaker}: {message.get('content', '')[:SUMMARY_MESSAGE_CHARS]}")
+    prompt = f"已有摘要：\n{summary or '（无）'}\n\n新增对话：\n" + "\n".join(lines)
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+class ConversationSummarizer:
+    """
+    滚动摘要的后台生成
+
+    新消息写入后把 (角色, 分支) 放进队列；后台任务找出已经滑出最近窗口、还没折叠进摘要的消息，
+    攒够一批就连同已有摘要交给模型生成新摘要。摘要不在请求路径上生成，组装上下文时直接读取。
+    """
+
+    def __init__(self, complete: Optional[CompleteFn] = None, summaries: Optional[SummaryStore] = None):
+        self.complete = complete or complete_with_llm
+        self._summaries = summaries
+        self.queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue()
+        self._queued: Set[Tuple[str, str]] = set()
+
+    @property
+    def summaries(self) -> SummaryStore:
+        return self._summaries or get_summary_store()
+
+    def enqueue(self, character_id: str, branch_id: str):
+        """安排检查一次（同一分支排队中时不重复加入）"""
+        key = (character_id, branch_id)
+        if key in self._queued:
+            return
+        self._queued.add(key)
+        self.queue.put_nowait(key)
+
+    def _pending(self, history: BranchHistory, covered_seq: int) -> List[Dict]:
+        """
+        紧接在摘要之后、已经滑出最近窗口的下一批消息（时间正序，最多 SUMMARY_BATCH_SIZE 条）
+
+        从 covered_seq 向后读取，落后再多也不会跳过中间的消息。
+        """
+        window = pack_history(history, SUMMARY_WINDOW_TOKENS)
+        if window:
+            boundary = window[0]["seq"]
+        else:
+            # 最新一条就超出了窗口：除它之外都可以折叠
+            latest = history.get_recent_messages(1)
+            if not latest:
+                return []
+            boundary = latest[-1]["seq"]
+        batch = history.get_messages_after(covered_seq, SUMMARY_BATCH_SIZE)
+        return [m for m in batch if m["seq"] < boundary]
+
+    async def summarize(self, character_id: str, branch_id: str) -> bool:
+        """把一批滑出窗口的消息折叠进摘要，返回是否生成了新摘要"""
+        summaries = self.summaries
+        generation = summaries.generation(character_id)
+        try:
+            history = get_history(get_character_store(), character_id, branch_id)
+        except KeyError:
+            return False
+
+        current = summaries.for_history(history)
+        covered_seq = current["covered_seq"] if current else 0
+        pending = self._pending(history, covered_seq)
+        if len(pending) < SUMMARY_BATCH_SIZE:
+            return False
+
+        summary = await self.complete(build_fold_prompt(current["summary"] if current else None, pending))
+        if not summary:
+            return False
+        return summaries.save(character_id, branch_id, summary, pending[-1]["seq"], generation)
+
+    async def run(self):
+        while True:
+            key = await self.queue.get()
+            self._queued.discard(key)
+            try:
+                # 落后较多时连续折叠，直到剩余的不够一批
+                while await self.summarize(*key):
+                    pass
+            except Exception as e:
+                print(f"生成对话摘要失败: {e}")
+
+
+# 全局实例
+_summarizer: Optional[ConversationSummarizer] = None
+
+
+def get_summarizer() -> ConversationSummarizer:
+    """获取摘要任务实例"""
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = ConversationSummarizer()
+    return _summarizer
+
+
+def summary_available() -> bool:
+    """是否生成滚动摘要：需要启用并配置 API Key"""
+    return SUMMARY_ENABLED and get_llm_client() is not None
+
+
+def schedule_summary(character_id: str, branch_id: str):
+    """新消息写入后安排更新摘要（后台任务没有运行时忽略，不在队列中堆积）"""
+    if summary_available():
+        get_summarizer().enqueue(character_id, branch_id)
+
+
+async def run_summarizer():
+    """后台生成滚动摘要（未启用或没有配置 API Key 时直接返回）"""
+    if not summary_available():
+        return
+    await get_summarizer().run()
@@ -0,0 +1,85 @@
+import re
+import unicodedata
+from typing import List
+
+# 常用繁体字到简体字的对照表（只用于检索归一化，索引和查询两侧使用同一映射即可）
+_TRADITIONAL = (
+    "們個這來說説時會為爲對學過還動點後氣發現問題話給開長東車見覺愛認識聽讓將實經種處"
+    "體麼當幾應無從兩關與裡裏頭樣嗎國裝買賣錢電腦網線號碼書寫讀語誰請謝歡樂親戀聲夢難"
+    "壞遠邊鐘錯間門飯餓飲雞魚鳥馬貓葉園圖畫歲媽爺孫兒妳陽陰風雲熱凍燈亂臉髮鬍齒腳醫藥"
+    "療傷數據記憶習慣興歷結離約戲劇視頻軟機場飛鐵橋樓層廳廚燒麵湯餃漢韓義藝術師員業專"
+    "導護衛軍戰爭勝敗輸贏練運籃選擇決計劃辦務費價貴質產際鄉區縣廣臺灣華僑憂慮緊張鬆靜"
+    "錄陸續斷絕總統變簡單複雜準確麗帥醜誒囉嘩於著沒帶幫備傳達連換歸圓滿溫涼濕乾淨潔顏"
+    "紅綠藍黃銀寶貝禮節聖誕慶賀願禱鬧紀懷舊戶蘋膽驚嚇憤惱煩悶閒閑況証證議論討厭驗試課"
+    "筆紙級閱覽讚誤許詞該調談譯訊訴詳諒豐豬貨財負責購貼資賺趕跡蹤較輕載輛農適週遲鄰針"
+    "鏡閃閉闆隊隨險雖雙靈響順須預領頁顧類顯飽館騎鬥鮮鳳麥齊龍龜壓夥奮妝娛嬰寵寧審尋屆"
+    "嶺幣幹廢彈徵憑擁擔擊擺攝敵曆暫樹橫檢權歐殺殼毀滅漸潛濟爛爾牆獎獨獲環畢盡監礎禍穩"
+    "競築範糧糾紛細終組維綱緒緣織繼罰聯聰職脅膚舉艱蘇蟲補襯襪規觀觸訂設訪評詩誠誇誌諾"
+    "謀謎講豈賽贈趨躍軌輔轉辭邁遺郵鄭釋鈴鋼錶鍵鎖鏈閘閣闖陣陳隱霧韻頂項頓額顆飄餅餘驅"
+    "驕髒鬱魯鴨鵝鹽黨齡係倫偉側傘僅優儲剛創劍勵勢勞協卻厲參嗚團堅報塊塵墳壯壽夠奪奧婦"
+    "寢尷岡島帳廟復態慘慚憐懶搖撐撿擠擾敘斂楊標歎殘氫沖淚淺測湧溝滾漁潤澀濃灑災煙爐牽"
+    "狀猶獄瑪畝疊瘋癢盜睜瞭矯碩禦稱穫窮竊筍簽籤紮紹絲綁緩編縮繩繪羅翹聞肅腸膩臟艦莊薦"
+    "虛襲託訓詢誘諮謠譽貞貧貸賓賞賴贊踐輪辯遊違遞遙醞釀銷鋪鍋鍛鏟鑰閨闊階隻韋頸頹颱飢"
+    "飾餵饅騙骯黴"
+)
+_SIMPLIFIED = (
+    "们个这来说说时会为为对学过还动点后气发现问题话给开长东车见觉爱认识听让将实经种处"
+    "体么当几应无从两关与里里头样吗国装买卖钱电脑网线号码书写读语谁请谢欢乐亲恋声梦难"
+    "坏远边钟错间门饭饿饮鸡鱼鸟马猫叶园图画岁妈爷孙儿你阳阴风云热冻灯乱脸发胡齿脚医药"
+    "疗伤数据记忆习惯兴历结离约戏剧视频软机场飞铁桥楼层厅厨烧面汤饺汉韩义艺术师员业专"
+    "导护卫军战争胜败输赢练运篮选择决计划办务费价贵质产际乡区县广台湾华侨忧虑紧张松静"
+    "录陆续断绝总统变简单复杂准确丽帅丑诶啰哗于着没带帮备传达连换归圆满温凉湿干净洁颜"
+    "红绿蓝黄银宝贝礼节圣诞庆贺愿祷闹纪怀旧户苹胆惊吓愤恼烦闷闲闲况证证议论讨厌验试课"
+    "笔纸级阅览赞误许词该调谈译讯诉详谅丰猪货财负责购贴资赚赶迹踪较轻载辆农适周迟邻针"
+    "镜闪闭板队随险虽双灵响顺须预领页顾类显饱馆骑斗鲜凤麦齐龙龟压伙奋妆娱婴宠宁审寻届"
+    "岭币干废弹征凭拥担击摆摄敌历暂树横检权欧杀壳毁灭渐潜济烂尔墙奖独获环毕尽监础祸稳"
+    "竞筑范粮纠纷细终组维纲绪缘织继罚联聪职胁肤举艰苏虫补衬袜规观触订设访评诗诚夸志诺"
+    "谋谜讲岂赛赠趋跃轨辅转辞迈遗邮郑释铃钢表键锁链闸阁闯阵陈隐雾韵顶项顿额颗飘饼余驱"
+    "骄脏郁鲁鸭鹅盐党龄系伦伟侧伞仅优储刚创剑励势劳协却厉参呜团坚报块尘坟壮寿够夺奥妇"
+    "寝尴冈岛帐庙复态惨惭怜懒摇撑捡挤扰叙敛杨标叹残氢冲泪浅测涌沟滚渔润涩浓洒灾烟炉牵"
+    "状犹狱玛亩叠疯痒盗睁了矫硕御称获穷窃笋签签扎绍丝绑缓编缩绳绘罗翘闻肃肠腻脏舰庄荐"
+    "虚袭托训询诱咨谣誉贞贫贷宾赏赖赞践轮辩游违递遥酝酿销铺锅锻铲钥闺阔阶只韦颈颓台饥"
+    "饰喂馒骗肮霉"
+)
+_T2S = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+# 中日韩文字连续片段，或由字母数字组成的单词
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+
+def normalize(text: str) -> str:
+    """检索归一化：NFKC（全角转半角）、大小写折叠、繁体转简体"""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_T2S)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    索引用分词
+
+    中日韩文字切成单字和相邻两字（bigram），这样单字和多字查询都能命中；
+    其他文字按单词切分。
+    """
+    tokens = []
+    for cjk, word in _TOKEN_PATTERN.findall(normalize(text)):
+        if cjk:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def query_tokens(text: str) -> List[str]:
+    """查询用分词：多字的中日韩片段只用 bigram，单字片段用单字"""
+    tokens = []
+    for cjk, word in _TOKEN_PATTERN.findall(normalize(text)):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    # 去重并保持顺序
+    return list(dict.fromkeys(tokens))
@@ -63,7 +63,8 @@ async def text_to_speech(
     voice: str = None,
     rate: str = "+0%",
     volume: str = "+0%",
-    pitch: str = "+0Hz"
+    pitch: str = "+0Hz",
+    character_id: str = None
 ) -> str:
     """
     将文本转换为语音，返回音频文件路径
@@ -76,6 +77,7 @@ async def text_to_speech(
         rate: 语速，如 "+0%", "+10%"
         volume: 音量，如 "+0%", "+10%"
         pitch: 音调，如 "+0Hz", "+10Hz"
+        character_id: 所属角色（可选），文件名以 "{character_id}_" 开头，删除角色时一并清理
 
     Returns:
         音频文件路径
@@ -90,6 +92,8 @@ async def text_to_speech(
     audio_id = str(uuid.uuid4())[:8]
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     audio_filename = f"{timestamp}_{audio_id}.mp3"
+    if character_id:
+        audio_filename = f"{character_id}_{audio_filename}"
     audio_path = os.path.join(AUDIO_DIR, audio_filename)
 
     # 限制文本长度（防止过长）
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.db import branches, database, media, summaries
+from app.db.cache import CachedCharacterStore
+from app.db.json_store import JsonCharacterStore
+from app.db.sqlite_store import SqliteCharacterStore, SqliteDatabase
+
+TIMESTAMP = "2024-01-01T00:00:00"
+
+
+def make_messages(n: int, start: int = 0):
+    """n 条用户和助手交替的消息"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"消息{i}", "timestamp": TIMESTAMP}
+        for i in range(start, start + n)
+    ]
+
+
+def _make_store(kind: str, tmp_path):
+    if kind.startswith("sqlite"):
+        store = SqliteCharacterStore(SqliteDatabase(str(tmp_path / "soulecho.db")))
+    else:
+        store = JsonCharacterStore(str(tmp_path / "characters"), str(tmp_path / "history"))
+    if kind.endswith("+cache"):
+        store = CachedCharacterStore(store)
+    return store
+
+
+@pytest.fixture(params=["json", "sqlite", "json+cache", "sqlite+cache"])
+def store(request, tmp_path):
+    """各种存储后端（含写回缓存）上的角色存储，已创建角色 c"""
+    store = _make_store(request.param, tmp_path)
+    store.save({"id": "c", "name": "小美", "created_at": TIMESTAMP})
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def cached_store(tmp_path):
+    store = _make_store("sqlite+cache", tmp_path)
+    store.save({"id": "c", "name": "小美", "created_at": TIMESTAMP})
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def app_store(monkeypatch, tmp_path):
+    """替换全局的角色、分支和摘要存储，数据都放在临时目录"""
+    monkeypatch.chdir(tmp_path)
+    store = _make_store("json+cache", tmp_path)
+    store.save({"id": "c", "name": "小美", "created_at": TIMESTAMP})
+    branch_store = branches.BranchStore(str(tmp_path / "branches.db"))
+    summary_store = summaries.SummaryStore(str(tmp_path / "summaries.db"))
+    monkeypatch.setattr(database, "_character_store", store)
+    monkeypatch.setattr(branches, "_branch_store", branch_store)
+    monkeypatch.setattr(summaries, "_summary_store", summary_store)
+    yield store
+    store.close()
+    branch_store.close()
+    summary_store.close()
+
+
+@pytest.fixture
+def client(app_store, monkeypatch, tmp_path):
+    """挂载角色和聊天路由的测试客户端，全文索引和媒体存储也放在临时目录"""
+    from app.api import characters, chat
+    from app.services import search
+
+    index = search.SearchIndex(str(tmp_path / "search.db"))
+    media_store = media.MediaStore(str(tmp_path / "media.db"), str(tmp_path / "media"))
+    monkeypatch.setattr(search, "_search_index", index)
+    monkeypatch.setattr(media, "_media_store", media_store)
+
+    app = FastAPI()
+    app.include_router(characters.router, prefix="/api")
+    app.include_router(chat.router, prefix="/api")
+    yield TestClient(app)
+    index.close()
+    media_store.close()
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.db import branches
+from app.db.branches import MAIN_BRANCH, get_history
+
+from tests.conftest import make_messages
+
+
+def _seqs(messages):
+    return [m["seq"] for m in messages]
+
+
+def test_branch_history_stitches_parent_chain(app_store):
+    app_store.append_messages("c", make_messages(10))
+    branch_store = branches.get_branch_store()
+
+    # 在第 6 条之后分叉，分支上再在第 7 条之后分叉
+    first = branch_store.create_branch("c", MAIN_BRANCH, 6)
+    get_history(app_store, "c", first["branch_id"]).append_messages(make_messages(3, 100))
+    second = branch_store.create_branch("c", first["branch_id"], 7)
+    history = get_history(app_store, "c", second["branch_id"])
+    history.append_messages(make_messages(2, 200))
+
+    assert _seqs(history.get_recent_messages(20)) == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert [m["content"] for m in history.get_recent_messages(3)] == ["消息100", "消息200", "消息201"]
+    assert history.count_messages() == 9
+    assert history.last_seq() == 9
+    assert history.branch_of(7) == first["branch_id"]
+    assert history.branch_of(3) == MAIN_BRANCH
+    assert _seqs(history.get_messages_after(5, 3)) == [6, 7, 8]
+
+    # 在分叉点之前再分叉，得到的是主线上的兄弟分支而不是更深的分支链
+    sibling = branch_store.create_branch("c", second["branch_id"], 4)
+    assert sibling["parent_id"] == MAIN_BRANCH
+    # 主线不受分支影响
+    assert get_history(app_store, "c").count_messages() == 10
+
+
+def test_removed_branch_raises_key_error(app_store):
+    app_store.append_messages("c", make_messages(4))
+    branch_store = branches.get_branch_store()
+    branch = branch_store.create_branch("c", MAIN_BRANCH, 2)
+    history = get_history(app_store, "c", branch["branch_id"])
+
+    branch_store.remove_character("c")
+    assert branch_store.list_branches("c") == []
+    with pytest.raises(KeyError):
+        history.last_seq()
+    with pytest.raises(KeyError):
+        get_history(app_store, "c", branch["branch_id"])
+
+
+def test_regenerate_forks_and_skips_deleted_character(client, app_store, monkeypatch):
+    from app.api import chat
+
+    app_store.append_messages("c", make_messages(4))
+    deleted = []
+
+    async def create(**kwargs):
+        if deleted:
+            app_store.delete("c")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="新的回复"))])
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(chat, "get_llm_client", lambda: fake_client)
+
+    body = client.post("/api/chat/history/c/regenerate").json()
+    assert body["seq"] == 4
+    history = get_history(app_store, "c")
+    assert history.branch_id == body["branch_id"]
+    assert [m["content"] for m in history.get_recent_messages(2)] == ["消息2", "新的回复"]
+
+    # 生成期间角色被删除：返回 404，不留下新分支
+    deleted.append(True)
+    assert client.post("/api/chat/history/c/regenerate").status_code == 404
+    assert len(branches.get_branch_store().list_branches("c")) == 1
@@ -0,0 +1,46 @@
+from app.db.repository import HOT_WINDOW
+
+from tests.conftest import make_messages
+
+
+def _seqs(messages):
+    return [m["seq"] for m in messages]
+
+
+def test_pending_messages_are_visible_before_flush(cached_store):
+    store = cached_store
+    store.append_messages("c", make_messages(HOT_WINDOW + 30))
+
+    assert store.count_messages("c") == HOT_WINDOW + 30
+    assert _seqs(store.get_recent_messages("c", 2)) == [HOT_WINDOW + 29, HOT_WINDOW + 30]
+    # 超出缓存范围的读取先写回待写数据，再从底层存储读取
+    assert _seqs(store.get_messages("c", 0, 2)) == [1, 2]
+    assert store.backend.count_messages("c") == HOT_WINDOW + 30
+
+
+def test_seq_position_after_deleting_whole_tail(cached_store):
+    store = cached_store
+    total = HOT_WINDOW + 5
+    store.append_messages("c", make_messages(total))
+    store.flush()
+    # 删光缓存中的最近记录，只剩更早的 5 条
+    for seq in range(6, total + 1):
+        assert store.delete_message("c", seq) is not None
+
+    assert store.count_messages("c") == 5
+    assert store.seq_position("c", 4) == 3
+    assert _seqs(store.get_messages_before("c", 4, 10)) == [1, 2, 3]
+    assert _seqs(store.get_recent_messages("c", 10)) == [1, 2, 3, 4, 5]
+    assert _seqs(store.append_messages("c", make_messages(1))) == [total + 1]
+    assert _seqs(store.get_recent_messages("c", 2)) == [5, total + 1]
+
+
+def test_flush_writes_profile_and_messages(cached_store):
+    store = cached_store
+    store.save({**store.get("c"), "name": "小丽"})
+    store.append_messages("c", make_messages(3))
+    assert store.backend.get("c")["name"] == "小美"
+
+    store.flush()
+    assert store.backend.get("c")["name"] == "小丽"
+    assert _seqs(store.backend.get_recent_messages("c", 5)) == [1, 2, 3]
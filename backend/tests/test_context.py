@@ -0,0 +1,61 @@
+from app.db.branches import get_history
+from app.db.message import MESSAGE_OVERHEAD, estimate_tokens
+from app.services import context
+from app.services.context import build_context, pack_history
+
+from tests.conftest import make_messages
+
+
+def _fill(store, n, tokens=10):
+    history = get_history(store, "c")
+    history.append_messages([{**m, "tokens": tokens} for m in make_messages(n)])
+    return history
+
+
+def _long_messages(n):
+    """内容较长、token 数在写入时估算的消息"""
+    return [{**m, "content": m["content"] * 10} for m in make_messages(n)]
+
+
+def _seqs(messages):
+    return [m["seq"] for m in messages]
+
+
+def test_pack_history_fills_budget_from_newest(app_store):
+    history = _fill(app_store, 50)
+    cost = 10 + MESSAGE_OVERHEAD
+
+    assert _seqs(pack_history(history, 5 * cost)) == [46, 47, 48, 49, 50]
+    assert _seqs(pack_history(history, 5 * cost - 1)) == [47, 48, 49, 50]
+    assert _seqs(pack_history(history, 3 * cost, before_seq=20)) == [17, 18, 19]
+    # 摘要已经覆盖的消息不再放入
+    assert _seqs(pack_history(history, 100 * cost, after_seq=45)) == [46, 47, 48, 49, 50]
+    assert len(pack_history(history, 100 * cost, max_messages=30)) == 30
+    assert pack_history(history, 0) == []
+
+
+def test_pack_history_stops_at_first_message_that_does_not_fit(app_store):
+    history = get_history(app_store, "c")
+    history.append_messages([
+        {"role": "user", "content": "短", "tokens": 5},
+        {"role": "assistant", "content": "长", "tokens": 500},
+        {"role": "user", "content": "短", "tokens": 5},
+    ])
+    # 不跳过放不下的消息去取更早的，保证对话连续
+    assert _seqs(pack_history(history, 100)) == [3]
+
+
+def test_build_context_stays_within_budget(app_store, monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_BATCH_SIZE", 4)
+    history = get_history(app_store, "c")
+    history.append_messages(_long_messages(200))
+    character = app_store.get("c")
+
+    messages = build_context(character, history, user_content="你好", budget=1000)
+    used = sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+    assert used <= 1000
+    # 预算足够放入最近的若干条对话，且以用户的新消息结尾
+    assert messages[-1] == {"role": "user", "content": "你好"}
+    assert len(messages) > 10
+
+    assert len(build_context(character, history, user_content="你好", budget=2000)) > len(messages)
@@ -0,0 +1,52 @@
+import json
+
+from app.db.repository import HOT_WINDOW, SEGMENT_SIZE
+
+from tests.conftest import make_messages
+
+TOTAL = HOT_WINDOW + SEGMENT_SIZE + 50
+
+
+def test_iter_messages_with_concurrent_delete_and_compaction(store):
+    store.append_messages("c", make_messages(TOTAL))
+    store.delete_message("c", 5)
+    messages = store.iter_messages("c", 100)
+    exported = list(next(messages))
+
+    # 导出进行中删除并压实：已经开始的导出不遗漏、不重复
+    for seq in (150, SEGMENT_SIZE + 10, TOTAL - 3):
+        store.delete_message("c", seq)
+    store.compact_messages("c")
+    for batch in messages:
+        exported.extend(batch)
+
+    seqs = [m["seq"] for m in exported]
+    assert seqs == sorted(set(seqs))
+    later = {150, SEGMENT_SIZE + 10, TOTAL - 3}
+    assert set(range(1, TOTAL + 1)) - {5} - later <= set(seqs)
+    assert 5 not in seqs
+
+
+def test_export_formats(client, app_store, monkeypatch):
+    from app.api import chat
+    monkeypatch.setattr(chat, "EXPORT_BATCH_SIZE", 7)
+    app_store.append_messages("c", make_messages(30))
+    app_store.delete_message("c", 3)
+
+    body = client.get("/api/chat/history/c/export").json()
+    assert body["character"]["name"] == "小美"
+    assert body["total_messages"] == 29
+    assert [m["seq"] for m in body["messages"]] == [s for s in range(1, 31) if s != 3]
+
+    response = client.get("/api/chat/history/c/export", params={"format": "ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["total_messages"] == 29
+    assert [m["seq"] for m in lines[1:]] == [s for s in range(1, 31) if s != 3]
+
+    # 客户端会按 Content-Encoding 自动解压
+    response = client.get("/api/chat/history/c/export", params={"format": "ndjson", "gzip": "true"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 30
+
+    assert client.get("/api/chat/history/c/export", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,89 @@
+import pytest
+
+from app.db.repository import HOT_WINDOW, SEGMENT_SIZE
+
+from tests.conftest import TIMESTAMP, _make_store, make_messages
+
+# 足够滚动出冷数据段：热数据超过 HOT_WINDOW + SEGMENT_SIZE 条时压缩
+TOTAL = HOT_WINDOW + 2 * SEGMENT_SIZE + 50
+
+
+def _fill(store, n=TOTAL, batch=97):
+    for start in range(0, n, batch):
+        store.append_messages("c", make_messages(min(batch, n - start), start))
+    if hasattr(store, "flush"):
+        store.flush()
+
+
+def _seqs(messages):
+    return [m["seq"] for m in messages]
+
+
+def test_append_and_read_across_segments(store):
+    _fill(store)
+
+    assert store.count_messages("c") == TOTAL
+    assert store.last_seq("c") == TOTAL
+    assert _seqs(store.get_messages("c", 0, 3)) == [1, 2, 3]
+    assert _seqs(store.get_messages("c", SEGMENT_SIZE - 1, 3)) == [SEGMENT_SIZE, SEGMENT_SIZE + 1, SEGMENT_SIZE + 2]
+    assert _seqs(store.get_recent_messages("c", 2)) == [TOTAL - 1, TOTAL]
+    assert _seqs(store.get_messages_before("c", 10, 3)) == [7, 8, 9]
+    assert _seqs(store.get_messages_after("c", SEGMENT_SIZE, 2)) == [SEGMENT_SIZE + 1, SEGMENT_SIZE + 2]
+    assert store.seq_position("c", SEGMENT_SIZE + 1) == SEGMENT_SIZE
+    assert store.get_messages("c", 0, 1)[0]["content"] == "消息0"
+
+    exported = [m for batch in store.iter_messages("c", 128) for m in batch]
+    assert _seqs(exported) == list(range(1, TOTAL + 1))
+
+
+def test_delete_keeps_seqs_and_survives_compaction(store):
+    _fill(store)
+    deleted = [3, SEGMENT_SIZE + 7, TOTAL - 1]
+    for seq in deleted:
+        assert store.delete_message("c", seq)["seq"] == seq
+    assert store.delete_message("c", 3) is None
+
+    def check():
+        remaining = [m for batch in store.iter_messages("c") for m in batch]
+        assert _seqs(remaining) == [s for s in range(1, TOTAL + 1) if s not in deleted]
+        assert store.count_messages("c") == TOTAL - len(deleted)
+        assert store.last_seq("c") == TOTAL
+        assert store.seq_position("c", 10) == 8
+        assert _seqs(store.get_messages_before("c", 5, 3)) == [1, 2, 4]
+        assert _seqs(store.get_recent_messages("c", 2)) == [TOTAL - 2, TOTAL]
+
+    check()
+    # 冷数据段中的删除一定留下删除标记（热数据是否直接删除取决于后端）
+    assert "c" in store.characters_to_compact(2)
+    assert store.compact_messages("c") >= 2
+    assert store.characters_to_compact(1) == []
+    check()
+
+    # 删除后追加的消息继续使用新的序号
+    assert _seqs(store.append_messages("c", make_messages(1))) == [TOTAL + 1]
+
+
+def test_clear_messages(store):
+    _fill(store, 150)
+    store.clear_messages("c")
+    assert store.count_messages("c") == 0
+    assert store.get_recent_messages("c", 5) == []
+    assert _seqs(store.append_messages("c", make_messages(1))) == [151]
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_tombstones_before_restart_are_compacted(kind, tmp_path):
+    store = _make_store(kind, tmp_path)
+    store.save({"id": "c", "name": "小美", "created_at": TIMESTAMP})
+    _fill(store)
+    for seq in (3, 4, SEGMENT_SIZE + 7):
+        store.delete_message("c", seq)
+    store.close()
+
+    store = _make_store(kind, tmp_path)
+    try:
+        assert store.characters_to_compact(3) == ["c"]
+        assert store.compact_messages("c") >= 3
+        assert store.count_messages("c") == TOTAL - 3
+    finally:
+        store.close()
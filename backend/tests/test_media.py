@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from app.db.media import MediaStore, hash_of_url
+
+
+@pytest.fixture
+def media_store(tmp_path):
+    store = MediaStore(str(tmp_path / "media.db"), str(tmp_path / "media"))
+    yield store
+    store.close()
+
+
+def _file(store, url):
+    return os.path.join(store.media_dir, *url.split("/")[-2:])
+
+
+def test_put_deduplicates_by_content(media_store):
+    url = media_store.put(b"png-bytes", "png")
+    assert media_store.put(b"png-bytes", "png") == url
+    assert hash_of_url(url) is not None
+    with open(_file(media_store, url), 'rb') as f:
+        assert f.read() == b"png-bytes"
+    assert not [name for name in os.listdir(os.path.dirname(_file(media_store, url))) if name.endswith(".tmp")]
+
+
+def test_collect_garbage_keeps_referenced_files(media_store):
+    kept = media_store.put(b"kept", "png")
+    dropped = media_store.put(b"dropped", "png")
+    media_store.add_ref(kept, "c", "avatar")
+    media_store.add_ref(dropped, "c", "image")
+    assert media_store.collect_garbage(grace=0) == 0
+
+    assert media_store.remove_ref(dropped, "c", "image")
+    assert media_store.collect_garbage(grace=0) == 1
+    assert os.path.exists(_file(media_store, kept))
+    assert not os.path.exists(_file(media_store, dropped))
+    assert media_store.list_refs("c", "avatar") == [{"url": kept, "filename": os.path.basename(kept)}]
+
+
+def test_import_legacy_hardlinks_files(media_store, tmp_path):
+    legacy = tmp_path / "avatars"
+    legacy.mkdir()
+    (legacy / "c_abc.png").write_bytes(b"avatar")
+    (legacy / "d_def.png").write_bytes(b"avatar")
+    (legacy / "temp_x.png").write_bytes(b"temp")
+
+    media_store.import_legacy(str(legacy), "avatar")
+
+    [ref] = media_store.list_refs("c", "avatar")
+    assert media_store.list_refs("d", "avatar") == [ref]
+    path = _file(media_store, ref["url"])
+    assert os.path.samefile(path, legacy / "c_abc.png") or os.path.samefile(path, legacy / "d_def.png")
+    # 只执行一次
+    os.remove(legacy / "c_abc.png")
+    media_store.import_legacy(str(legacy), "avatar")
+    assert media_store.list_refs("c", "avatar") == [ref]
@@ -0,0 +1,18 @@
+from app.db.message import Message
+
+
+def test_round_trip_keeps_only_set_fields():
+    record = {"seq": 3, "role": "user", "content": "你好", "timestamp": "2024-01-01T08:30:00.123456",
+              "tokens": 2, "images": ["/media/ab/ab.png"]}
+    message = Message.from_dict(record)
+    assert isinstance(message.ts, int)
+    assert message.to_dict() == record
+
+    # 没有时间戳、空的可选字段都不输出
+    sparse = Message.from_dict({"role": "assistant", "content": "嗯", "images": [], "timestamp": None})
+    assert sparse.to_dict() == {"role": "assistant", "content": "嗯"}
+
+
+def test_non_iso_timestamp_is_kept_verbatim():
+    record = {"seq": 1, "role": "user", "content": "", "timestamp": "2024-01-01T08:30:00+08:00"}
+    assert Message.from_dict(record).to_dict() == record
@@ -0,0 +1,35 @@
+from app.api.auth import create_access_token
+
+
+def _headers(user_id):
+    return {"Authorization": f"Bearer {create_access_token({'sub': user_id})}"}
+
+
+def test_characters_are_partitioned_by_owner(client, app_store):
+    created = client.post("/api/characters", json={"name": "小雪"}, headers=_headers("alice")).json()
+    character_id = created["id"]
+
+    assert [c["id"] for c in client.get("/api/characters", headers=_headers("alice")).json()] == [character_id]
+    assert client.get("/api/characters", headers=_headers("bob")).json() == []
+    assert client.get(f"/api/characters/{character_id}", headers=_headers("alice")).status_code == 200
+
+
+def test_foreign_character_is_not_found(client, app_store):
+    character_id = client.post("/api/characters", json={"name": "小雪"}, headers=_headers("alice")).json()["id"]
+
+    # 其他用户和匿名用户看到的都是 404，与角色不存在时相同
+    for headers in (_headers("bob"), {}):
+        assert client.get(f"/api/characters/{character_id}", headers=headers).status_code == 404
+        assert client.get(f"/api/chat/history/{character_id}", headers=headers).status_code == 404
+        assert client.get(f"/api/chat/history/{character_id}/export", headers=headers).status_code == 404
+        assert client.delete(f"/api/characters/{character_id}", headers=headers).status_code == 404
+    assert client.get("/api/characters/missing", headers=_headers("alice")).status_code == 404
+    assert client.get(f"/api/characters/{character_id}", headers=_headers("alice")).status_code == 200
+
+
+def test_invalid_token_is_rejected(client, app_store):
+    headers = {"Authorization": "Bearer not-a-token"}
+    assert client.get("/api/characters", headers=headers).status_code == 401
+    assert client.get("/api/chat/history/c", headers=headers).status_code == 401
+    # 没有令牌时使用匿名分区
+    assert client.get("/api/chat/history/c").status_code == 200
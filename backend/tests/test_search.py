@@ -0,0 +1,57 @@
+import pytest
+
+from app.services.search import SearchIndex
+from app.services.tokenizer import query_tokens, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    yield index
+    index.close()
+
+
+def _message(seq, content):
+    return {"role": "user", "content": content, "seq": seq}
+
+
+def test_tokenize_cjk_bigrams_and_normalization():
+    assert tokenize("喜欢蘋果 Hello，ＡＢＣ") == ["喜", "欢", "苹", "果", "喜欢", "欢苹", "苹果", "hello", "abc"]
+    assert query_tokens("我喜欢") == ["我喜", "喜欢"]
+    assert query_tokens("猫 猫") == ["猫"]
+    assert query_tokens("！？") == []
+
+
+def test_search_matches_bigrams_and_traditional(index):
+    index.add_messages("c", [_message(1, "我喜欢吃苹果"), _message(2, "今天天气很好"), _message(3, "苹果手机")])
+
+    assert index.search("苹果", ["c"])[0] == 2
+    assert {hit["seq"] for hit in index.search("蘋果", ["c"])[1]} == {1, 3}
+    assert [hit["seq"] for hit in index.search("喜欢 苹果", ["c"])[1]] == [1]
+    # 不跨越词边界匹配
+    assert index.search("果今", ["c"])[0] == 0
+    assert index.search("苹果", ["other"])[0] == 0
+
+    index.remove_message("c", 1)
+    assert [hit["seq"] for hit in index.search("苹果", ["c"])[1]] == [3]
+
+
+def test_sync_backfills_history_and_gaps(index, store, monkeypatch):
+    store.append_messages("c", [{"role": "user", "content": f"第{i}条 苹果"} for i in range(5)])
+    # 建立索引之前的历史记录由 ensure_synced() 补齐
+    index.ensure_synced(store, "c")
+    assert index.search("苹果", ["c"])[0] == 5
+
+    # 写入出现缺口（中间的消息没有写入索引）后，下次检索前重新补齐
+    missed = store.append_messages("c", [{"role": "user", "content": "香蕉"}])
+    later = store.append_messages("c", [{"role": "user", "content": "香蕉 苹果"}])
+    index.add_messages("c", later)
+    assert index.search("香蕉", ["c"])[0] == 1
+    index.ensure_synced(store, "c")
+    assert {hit["seq"] for hit in index.search("香蕉", ["c"])[1]} == {missed[0]["seq"], later[0]["seq"]}
+
+    # 已补齐且写入连续时不再访问存储
+    index.add_messages("c", store.append_messages("c", [{"role": "user", "content": "香蕉"}]))
+    monkeypatch.setattr(store, "last_seq", None)
+    index.ensure_synced(store, "c")
+    assert index.search("香蕉", ["c"])[0] == 3
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from app.db.branches import get_history
+from app.db.message import message_tokens, with_token_count
+from app.db.summaries import get_summary_store
+from app.services import summary as summary_module
+from app.services.summary import ConversationSummarizer
+
+from tests.conftest import TIMESTAMP
+
+BATCH = 6
+WINDOW = 4
+
+
+def _message(i: int):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": "聊天内容" * 5, "timestamp": TIMESTAMP}
+
+
+@pytest.fixture
+def history(app_store, monkeypatch):
+    """固定长度的消息，窗口恰好放得下最近 WINDOW 条"""
+    monkeypatch.setattr(summary_module, "SUMMARY_BATCH_SIZE", BATCH)
+    monkeypatch.setattr(summary_module, "SUMMARY_WINDOW_TOKENS", WINDOW * message_tokens(with_token_count(_message(0))))
+
+    def append(n: int):
+        history = get_history(app_store, "c")
+        history.append_messages([_message(i) for i in range(n)])
+        return history
+    return append
+
+
+class StubLLM:
+    """记录每次请求中新增对话的条数，返回编号递增的摘要"""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def __call__(self, messages):
+        self.prompts.append(messages[1]["content"])
+        return f"摘要{len(self.prompts)}"
+
+    def folded(self, index: int) -> int:
+        lines = self.prompts[index].split("新增对话：\n", 1)[1].splitlines()
+        return sum(1 for line in lines if line.startswith(("用户:", "助手:")))
+
+
+def _fold_all(summarizer):
+    async def run():
+        covered = []
+        while await summarizer.summarize("c", "main"):
+            covered.append(get_summary_store().get("c", "main")["covered_seq"])
+        return covered
+    return asyncio.run(run())
+
+
+def test_folds_batches_in_order(history):
+    history(40)
+    stub = StubLLM()
+
+    covered = _fold_all(ConversationSummarizer(stub))
+
+    # 最近 WINDOW 条保留原文，之前的 36 条按批折叠
+    assert covered == [6, 12, 18, 24, 30, 36]
+    assert all(stub.folded(i) == BATCH for i in range(len(stub.prompts)))
+    assert "已有摘要：\n（无）" in stub.prompts[0]
+    assert "已有摘要：\n摘要1" in stub.prompts[1]
+    assert get_summary_store().get("c", "main")["summary"] == "摘要6"
+
+
+def test_far_behind_summarizer_skips_nothing(history):
+    history(300)
+
+    covered = _fold_all(ConversationSummarizer(StubLLM()))
+
+    assert covered == list(range(BATCH, 300 - WINDOW + 1, BATCH))
+
+
+def test_waits_for_a_full_batch(history):
+    history(WINDOW + BATCH - 1)
+    stub = StubLLM()
+
+    assert _fold_all(ConversationSummarizer(stub)) == []
+    assert stub.prompts == []
+
+
+def test_save_dropped_after_invalidate(history):
+    history(20)
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow(messages):
+        started.set()
+        await release.wait()
+        return "过期的摘要"
+
+    async def run():
+        task = asyncio.create_task(ConversationSummarizer(slow).summarize("c", "main"))
+        await started.wait()
+        # 生成期间删除了一条消息
+        get_summary_store().invalidate("c", 3)
+        release.set()
+        return await task
+
+    assert asyncio.run(run()) is False
+    assert get_summary_store().get("c", "main") is None
+
+
+def test_schedule_summary_needs_a_client(app_store, monkeypatch):
+    summarizer = ConversationSummarizer(StubLLM())
+    monkeypatch.setattr(summary_module, "_summarizer", summarizer)
+    monkeypatch.setattr(summary_module, "get_llm_client", lambda: None)
+
+    summary_module.schedule_summary("c", "main")
+
+    assert summarizer.queue.empty()
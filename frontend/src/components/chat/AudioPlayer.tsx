@@ -5,10 +5,11 @@ import { ttsApi } from '@/services/api';
 interface AudioPlayerProps {
   text: string;
   gender: string;
+  characterId?: string;
   autoPlay?: boolean;
 }
 
-export default function AudioPlayer({ text, gender, autoPlay = false }: AudioPlayerProps) {
+export default function AudioPlayer({ text, gender, characterId, autoPlay = false }: AudioPlayerProps) {
   const [playing, setPlaying] = useState(false);
   const [muted, setMuted] = useState(false);
   const [loading, setLoading] = useState(false);
@@ -67,7 +68,7 @@ export default function AudioPlayer({ text, gender, autoPlay = false }: AudioPla
   const generateAndPlay = async () => {
     setLoading(true);
     try {
-      const response = await ttsApi.generate(text, gender);
+      const response = await ttsApi.generate(text, gender, characterId);
       setAudioUrl(response.audio_url);
 
       if (audioRef.current) {
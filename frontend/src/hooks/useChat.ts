@@ -1,5 +1,6 @@
-import { useState, useRef, useCallback } from 'react';
+import { useState, useRef, useCallback, useEffect } from 'react';
 import type { ChatMessage } from '@/types';
+import { getAuthHeaders } from '@/services/api';
 
 const API_BASE = import.meta.env.VITE_API_BASE_URL || '/api';
 
@@ -11,12 +12,101 @@ export function useChat(characterId: string | null) {
   const [streaming, setStreaming] = useState(false);
   const [hasMore, setHasMore] = useState(true);
   const [totalMessages, setTotalMessages] = useState(0);
+  const [nextBeforeSeq, setNextBeforeSeq] = useState<number | null>(null);
+  // 客户端已同步到的最大消息序号，用于增量同步
+  const lastSeqRef = useRef(0);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = useCallback(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, []);
 
+  const loadHistory = useCallback(async () => {
+    if (!characterId) return;
+
+    setLoading(true);
+    try {
+      const response = await fetch(`${API_BASE}/chat/history/${characterId}?limit=50`, {
+        headers: getAuthHeaders(),
+      });
+      if (response.ok) {
+        const data = await response.json();
+        // 接口按最新在前返回，界面按时间正序展示
+        setMessages([...data.messages].reverse());
+        setTotalMessages(data.total);
+        setHasMore(data.has_more);
+        setNextBeforeSeq(data.next_before_seq);
+        lastSeqRef.current = data.last_seq;
+        setTimeout(scrollToBottom, 100);
+      }
+    } catch (err) {
+      console.error('加载历史记录失败:', err);
+    } finally {
+      setLoading(false);
+    }
+  }, [characterId, scrollToBottom]);
+
+  const loadMoreHistory = useCallback(async () => {
+    if (!characterId || loadingMore || !hasMore || nextBeforeSeq === null) return;
+
+    setLoadingMore(true);
+    try {
+      const response = await fetch(
+        `${API_BASE}/chat/history/${characterId}?before_seq=${nextBeforeSeq}&limit=50`,
+        { headers: getAuthHeaders() }
+      );
+      if (response.ok) {
+        const data = await response.json();
+        // 插入到开头
+        setMessages((prev) => [...[...data.messages].reverse(), ...prev]);
+        setTotalMessages(data.total);
+        setHasMore(data.has_more);
+        setNextBeforeSeq(data.next_before_seq);
+      }
+    } catch (err) {
+      console.error('加载更多历史记录失败:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [characterId, loadingMore, hasMore, nextBeforeSeq]);
+
+  // 增量同步：只拉取比本地更新的消息，并替换发送时本地临时添加的消息
+  const syncHistory = useCallback(async () => {
+    if (!characterId) return;
+
+    try {
+      const response = await fetch(
+        `${API_BASE}/chat/history/${characterId}?since=${lastSeqRef.current}&limit=50`,
+        { headers: getAuthHeaders() }
+      );
+      if (!response.ok) return;
+      const data = await response.json();
+      if (data.truncated) {
+        // 落后太多，直接重新加载
+        await loadHistory();
+        return;
+      }
+      const newer: ChatMessage[] = [...data.messages].reverse();
+      setMessages((prev) => {
+        const known = new Set(prev.map((m) => m.seq));
+        return [
+          ...prev.filter((m) => m.seq !== undefined),
+          ...newer.filter((m) => !known.has(m.seq)),
+        ];
+      });
+      setTotalMessages(data.total);
+      lastSeqRef.current = data.last_seq;
+    } catch (err) {
+      console.error('同步聊天记录失败:', err);
+    }
+  }, [characterId, loadHistory]);
+
+  // 网络恢复后补齐断线期间的消息
+  useEffect(() => {
+    window.addEventListener('online', syncHistory);
+    return () => window.removeEventListener('online', syncHistory);
+  }, [syncHistory]);
+
   const sendMessage = useCallback(async (content: string) => {
     if (!characterId || !content.trim()) return;
 
@@ -45,6 +135,7 @@ export function useChat(characterId: string | null) {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...getAuthHeaders(),
         },
         body: JSON.stringify({
           character_id: characterId,
@@ -114,6 +205,8 @@ export function useChat(characterId: string | null) {
           }
         }
       }
+      // 用服务端保存的消息（带序号）替换本地临时消息
+      await syncHistory();
     } catch (err) {
       setError(err instanceof Error ? err.message : '发送消息失败');
       // 移除空的AI消息
@@ -121,56 +214,15 @@ export function useChat(characterId: string | null) {
       setStreaming(false);
       setLoading(false);
     }
-  }, [characterId, scrollToBottom]);
-
-  const loadHistory = useCallback(async () => {
-    if (!characterId) return;
-
-    setLoading(true);
-    try {
-      const response = await fetch(`${API_BASE}/chat/history/${characterId}?offset=0&limit=50`);
-      if (response.ok) {
-        const data = await response.json();
-        setMessages(data.messages);
-        setTotalMessages(data.total);
-        setHasMore(data.has_more);
-        setTimeout(scrollToBottom, 100);
-      }
-    } catch (err) {
-      console.error('加载历史记录失败:', err);
-    } finally {
-      setLoading(false);
-    }
-  }, [characterId, scrollToBottom]);
-
-  const loadMoreHistory = useCallback(async () => {
-    if (!characterId || loadingMore || !hasMore) return;
-
-    setLoadingMore(true);
-    try {
-      const response = await fetch(
-        `${API_BASE}/chat/history/${characterId}?offset=${messages.length}&limit=50`
-      );
-      if (response.ok) {
-        const data = await response.json();
-        // 插入到开头
-        setMessages((prev) => [...data.messages, ...prev]);
-        setTotalMessages(data.total);
-        setHasMore(data.has_more);
-      }
-    } catch (err) {
-      console.error('加载更多历史记录失败:', err);
-    } finally {
-      setLoadingMore(false);
-    }
-  }, [characterId, messages.length, loadingMore, hasMore]);
+  }, [characterId, scrollToBottom, syncHistory]);
 
   const searchHistory = useCallback(async (query: string) => {
     if (!characterId || !query.trim()) return [];
 
     try {
       const response = await fetch(
-        `${API_BASE}/chat/history/${characterId}/search?q=${encodeURIComponent(query)}`
+        `${API_BASE}/chat/history/${characterId}/search?q=${encodeURIComponent(query)}`,
+        { headers: getAuthHeaders() }
       );
       if (response.ok) {
         return await response.json();
@@ -185,9 +237,12 @@ export function useChat(characterId: string | null) {
     if (!characterId) return null;
 
     try {
-      const response = await fetch(`${API_BASE}/chat/history/${characterId}/export`);
+      // 服务端分批流式输出，直接作为文件内容保存，不在前端解析
+      const response = await fetch(`${API_BASE}/chat/history/${characterId}/export`, {
+        headers: getAuthHeaders(),
+      });
       if (response.ok) {
-        return await response.json();
+        return await response.blob();
       }
     } catch (err) {
       console.error('导出历史记录失败:', err);
@@ -199,7 +254,10 @@ export function useChat(characterId: string | null) {
     if (!characterId) return;
 
     try {
-      await fetch(`${API_BASE}/chat/history/${characterId}`, { method: 'DELETE' });
+      await fetch(`${API_BASE}/chat/history/${characterId}`, {
+        method: 'DELETE',
+        headers: getAuthHeaders(),
+      });
       setMessages([]);
       setTotalMessages(0);
     } catch (err) {
@@ -211,7 +269,9 @@ export function useChat(characterId: string | null) {
     if (!characterId) return null;
 
     try {
-      const response = await fetch(`${API_BASE}/chat/history/${characterId}/stats`);
+      const response = await fetch(`${API_BASE}/chat/history/${characterId}/stats`, {
+        headers: getAuthHeaders(),
+      });
       if (response.ok) {
         return await response.json();
       }
@@ -232,6 +292,7 @@ export function useChat(characterId: string | null) {
     sendMessage,
     loadHistory,
     loadMoreHistory,
+    syncHistory,
     searchHistory,
     exportHistory,
     clearMessages,
@@ -30,7 +30,7 @@ export default function Chat() {
   const [autoPlayVoice, setAutoPlayVoice] = useState(false);
 
   const character = characters.find((c) => c.id === id);
-  const { messages, loading, loadingMore, streaming, sendMessage, messagesEndRef, loadHistory, loadMoreHistory, searchHistory, exportHistory, clearMessages, getStats, hasMore } = useChat(id || null);
+  const { messages, loading, loadingMore, streaming, sendMessage, messagesEndRef, loadHistory, loadMoreHistory, syncHistory, searchHistory, exportHistory, clearMessages, getStats, hasMore } = useChat(id || null);
 
   const API_BASE = import.meta.env.VITE_API_BASE_URL || '';
   const messagesContainerRef = useRef<HTMLDivElement>(null);
@@ -84,9 +84,8 @@ export default function Chat() {
 
   // 导出聊天记录
   const handleExport = async () => {
-    const data = await exportHistory();
-    if (data) {
-      const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
+    const blob = await exportHistory();
+    if (blob) {
       const url = URL.createObjectURL(blob);
       const a = document.createElement('a');
       a.href = url;
@@ -118,9 +117,7 @@ export default function Chat() {
           images: selectedImages,
         });
         // 刷新消息历史
-        const { loadHistory: load } = await import('@/hooks/useChat');
-        const chatHook = load(id!);
-        await chatHook.loadHistory();
+        await syncHistory();
       } else {
         await sendMessage(inputValue);
       }
@@ -176,9 +173,7 @@ export default function Chat() {
       }
 
       // 刷新消息历史
-      const { loadHistory: load } = await import('@/hooks/useChat');
-      const chatHook = load(id!);
-      await chatHook.loadHistory();
+      await syncHistory();
     } catch (error) {
       console.error('语音消息发送失败:', error);
     } finally {
@@ -575,6 +570,7 @@ export default function Chat() {
                       <AudioPlayer
                         text={message.content}
                         gender={character.gender}
+                        characterId={character.id}
                       />
                     )}
                   </div>
@@ -3,7 +3,7 @@ import { useParams, useNavigate } from 'react-router-dom';
 import { motion, AnimatePresence } from 'framer-motion';
 import { ArrowLeft, Trash2, Search, Sparkles, RefreshCw, Filter, Tag } from 'lucide-react';
 import { useAuthStore } from '@/stores/authStore';
-import { memoryApi } from '@/services/api';
+import { memoryApi, getAuthHeaders } from '@/services/api';
 
 interface Memory {
   id: string;
@@ -68,9 +68,7 @@ export default function Memories() {
     try {
       // 获取所有记忆
       const response = await fetch(`/api/characters/${id}/memories/all?limit=100`, {
-        headers: {
-          Authorization: `Bearer ${localStorage.getItem('soul-auth') ? JSON.parse(localStorage.getItem('soul-auth') || '{}').state?.token || JSON.parse(localStorage.getItem('soul-auth') || '{}').token : ''}`,
-        },
+        headers: getAuthHeaders(),
       });
       if (response.ok) {
         const data = await response.json();
@@ -108,9 +106,7 @@ export default function Memories() {
     try {
       const response = await fetch(`/api/characters/${id}/memories/consolidate`, {
         method: 'POST',
-        headers: {
-          Authorization: `Bearer ${localStorage.getItem('soul-auth') ? JSON.parse(localStorage.getItem('soul-auth') || '{}').state?.token || JSON.parse(localStorage.getItem('soul-auth') || '{}').token : ''}`,
-        },
+        headers: getAuthHeaders(),
       });
       if (response.ok) {
         const data = await response.json();
@@ -8,8 +8,8 @@ const api = axios.create({
   },
 });
 
-// 添加 token 到请求
-api.interceptors.request.use((config) => {
+// 读取登录令牌，角色和聊天记录按用户隔离，未登录时使用匿名分区
+export const getAuthHeaders = (): Record<string, string> => {
   const data = localStorage.getItem('soul-auth');
   if (data) {
     try {
@@ -18,12 +18,21 @@ api.interceptors.request.use((config) => {
       // direct format: {"token":...}
       const token = parsed.state?.token || parsed.token;
       if (token) {
-        config.headers.Authorization = `Bearer ${token}`;
+        return { Authorization: `Bearer ${token}` };
       }
     } catch {
       // ignore
     }
   }
+  return {};
+};
+
+// 添加 token 到请求
+api.interceptors.request.use((config) => {
+  const headers = getAuthHeaders();
+  if (headers.Authorization) {
+    config.headers.Authorization = headers.Authorization;
+  }
   return config;
 });
 
@@ -64,8 +73,8 @@ export interface TTSResponse {
 }
 
 export const ttsApi = {
-  generate: (text: string, gender: string) =>
-    api.post<TTSResponse>('/tts', { text, gender }).then(res => res.data),
+  generate: (text: string, gender: string, characterId?: string) =>
+    api.post<TTSResponse>('/tts', { text, gender, character_id: characterId }).then(res => res.data),
   getVoices: () => api.get<{ voices: string[] }>('/tts/voices').then(res => res.data),
 };
 
@@ -14,12 +14,14 @@ export interface Character {
   background: string;
   relationship_type: string;
   created_at: string;
+  last_active_at?: string | null;
   avatar?: string;
   chat_history?: ChatMessage[];
   memories?: Memory[];
 }
 
 export interface ChatMessage {
+  seq?: number;  // 服务端分配的消息序号，本地临时消息没有
   role: 'user' | 'assistant' | 'system';
   content: string;
   timestamp?: string;